@@ -0,0 +1,84 @@
+"""已结束流程的冷热分离归档
+
+已通过/已驳回且结束超过 WF_ARCHIVE_AFTER_DAYS 天的流程实例连同其任务，从 processinstance/task
+移到 processinstancearchive/taskarchive，待办、监控等按状态查询的热表只保留活跃数据。
+移动按批进行（每批 WF_ARCHIVE_BATCH 个实例一个短事务，批间暂停 WF_ARCHIVE_PAUSE_MS 毫秒），
+不会长时间持有写锁；PostgreSQL 上用 FOR UPDATE SKIP LOCKED 选取，多个进程同时执行也不会互相等待。
+
+归档后仍可读取：流程详情先查热表、查不到再查归档表（find_instance）；“我的流程”列表在热表之后
+列出归档流程（带 archived 标记），与首页按状态统计中加上的归档数一致；检索索引条目不删除，
+全量重建时也会包含归档表。
+任务被加入迭代（CycleTask）的实例不归档，迭代详情与燃尽图只读热表。
+"""
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlmodel import Session, select
+from sqlalchemy import insert, delete, exists, literal, func
+
+from . import metrics
+from .models import ProcessInstance, ProcessInstanceArchive, Task, TaskArchive, TaskLabel, CycleTask
+
+FINISHED_STATUSES = ("approved", "rejected")
+
+ARCHIVED_ROWS = metrics.Counter("wf_archive_rows_total", "Rows moved from hot tables to archive tables", ("table",))
+
+_INSTANCE_COLUMNS = [c.name for c in ProcessInstance.__table__.columns]
+_TASK_COLUMNS = [c.name for c in Task.__table__.columns]
+
+
+def _candidate_ids(s: Session, cutoff: datetime, limit: int) -> List[str]:
+    in_cycle = exists().where(CycleTask.task_id == Task.id, Task.instance_id == ProcessInstance.id)
+    query = (
+        select(ProcessInstance.id)
+        .where(ProcessInstance.status.in_(FINISHED_STATUSES), ProcessInstance.ended_at < cutoff, ~in_cycle)
+        .order_by(ProcessInstance.ended_at)
+        .limit(limit)
+    )
+    if s.get_bind().dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True, of=ProcessInstance)
+    return list(s.exec(query).all())
+
+
+def archive_batch(s: Session, cutoff: datetime, limit: int) -> Tuple[int, int]:
+    """在当前事务中归档最多 limit 个实例，返回 (实例数, 任务数)；由调用方提交"""
+    ids = _candidate_ids(s, cutoff, limit)
+    if not ids:
+        return 0, 0
+    now = datetime.now()
+    task_ids = select(Task.id).where(Task.instance_id.in_(ids))
+    s.exec(insert(ProcessInstanceArchive).from_select(
+        _INSTANCE_COLUMNS + ["archived_at"],
+        select(*ProcessInstance.__table__.columns, literal(now)).where(ProcessInstance.id.in_(ids)),
+    ))
+    s.exec(insert(TaskArchive).from_select(
+        _TASK_COLUMNS + ["archived_at"],
+        select(*Task.__table__.columns, literal(now)).where(Task.instance_id.in_(ids)),
+    ))
+    s.exec(delete(TaskLabel).where(TaskLabel.task_id.in_(task_ids)))
+    tasks = s.exec(delete(Task).where(Task.instance_id.in_(ids))).rowcount
+    instances = s.exec(delete(ProcessInstance).where(ProcessInstance.id.in_(ids))).rowcount
+    ARCHIVED_ROWS.inc(instances, "processinstance")
+    ARCHIVED_ROWS.inc(tasks, "task")
+    return instances, tasks
+
+
+def find_instance(s: Session, instance_id: str):
+    """返回 (实例, 任务列表, 是否已归档)；热表与归档表都没有时实例为 None"""
+    inst = s.get(ProcessInstance, instance_id)
+    if inst is not None:
+        tasks = s.exec(select(Task).where(Task.instance_id == inst.id).order_by(Task.assigned_at)).all()
+        return inst, tasks, False
+    inst = s.get(ProcessInstanceArchive, instance_id)
+    if inst is None:
+        return None, [], False
+    tasks = s.exec(select(TaskArchive).where(TaskArchive.instance_id == inst.id).order_by(TaskArchive.assigned_at)).all()
+    return inst, tasks, True
+
+
+def status_counts(s: Session, started_by: Optional[str] = None):
+    """归档实例按状态计数，与热表的统计相加得到全部流程数"""
+    query = select(ProcessInstanceArchive.status, func.count(ProcessInstanceArchive.id))
+    if started_by is not None:
+        query = query.where(ProcessInstanceArchive.started_by == started_by)
+    return s.exec(query.group_by(ProcessInstanceArchive.status)).all()
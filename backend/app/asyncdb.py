@@ -0,0 +1,123 @@
+"""异步数据库访问
+
+高频只读接口（待办、我的流程、首页统计、流程详情、监控）写成 async def，经这里在事件循环上
+查询，不占用 Starlette 线程池（默认 40 个线程）：慢查询等待数据库期间，其它请求照常被接收处理，
+并发上限由连接池而不是线程数决定。
+
+查询逻辑与同步接口共用：crud 中对应的读取函数拆成接收 Session 的 _xxx(s, ...)，这里用
+AsyncSession.run_sync 在绑定异步连接的 Session 上执行它，数据库 I/O 等待时让出事件循环。
+驱动：SQLite 用 aiosqlite，PostgreSQL 优先 asyncpg、其次 psycopg（3.x）。驱动未安装或
+WF_ASYNC_DB=0 时退化为在线程池中用同步引擎执行，结果不变。
+
+只读副本：run_read 与 crud.read_engine() 的路由一致（见 replica.py），副本对应另一个异步引擎。
+
+PostgreSQL 的连接池、探活、语句缓存与 statement_timeout 与同步引擎相同（见 dbprofile.py）；经 PgBouncer
+事务模式连接（如 Supabase 的 6543 端口）时设置 WF_PG_PREPARE_THRESHOLD=0 关闭 asyncpg 的语句缓存。
+"""
+import importlib.util
+from typing import Optional
+
+from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import metrics, querylog, dbprofile, replica
+from .config import ASYNC_DB, PG_PREPARE_THRESHOLD
+
+_sync_engine = None
+_engines = {}  # 同步引擎 -> 对应的异步引擎（主库、副本各一个）
+_driver: Optional[str] = None
+
+
+def bind(sync_engine):
+    """记录同步引擎：异步引擎的连接地址由它推导，不可用时也用它兜底"""
+    global _sync_engine
+    _sync_engine = sync_engine
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def _pick_driver(backend: str) -> Optional[str]:
+    candidates = ("aiosqlite",) if backend == "sqlite" else ("asyncpg", "psycopg")
+    return next((d for d in candidates if _installed(d)), None)
+
+
+def _create_engine(sync_engine):
+    global _driver
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url = sync_engine.url
+    backend = url.get_backend_name()
+    _driver = _pick_driver(backend)
+    if _driver is None:
+        return None
+    if backend == "sqlite":
+        # aiosqlite 默认不使用连接池，每次会话都要新建连接和后台线程
+        from sqlalchemy.pool import AsyncAdaptedQueuePool
+        engine = create_async_engine(url.set(drivername="sqlite+aiosqlite"), poolclass=AsyncAdaptedQueuePool,
+                                     **dbprofile.pool_kwargs())
+        dbprofile.apply_sqlite_profile(engine.sync_engine, write_queue=False)
+        return engine
+    if _driver == "asyncpg":
+        url = url.set(drivername="postgresql+asyncpg").difference_update_query(["sslmode", "connect_timeout"])
+        if not PG_PREPARE_THRESHOLD:
+            url = url.update_query_dict({"prepared_statement_cache_size": "0"})
+    else:
+        url = url.set(drivername="postgresql+psycopg")
+    engine = create_async_engine(url, **dbprofile.pg_engine_kwargs(_driver))
+    dbprofile.apply_pg_profile(engine.sync_engine)
+    return engine
+
+
+def get_engine(sync_engine=None):
+    """sync_engine 对应的异步引擎（默认主库），首次使用时创建（导入本模块不创建连接），每个 worker 进程各自一份"""
+    sync_engine = sync_engine if sync_engine is not None else _sync_engine
+    if not ASYNC_DB or sync_engine is None:
+        return None
+    if sync_engine not in _engines:
+        engine = _engines[sync_engine] = _create_engine(sync_engine)
+        if engine is not None:
+            name = "async-replica" if replica.is_replica(sync_engine) else "async"
+            metrics.instrument_engine(engine.sync_engine, name)
+            querylog.instrument_engine(engine.sync_engine)
+    return _engines[sync_engine]
+
+
+def describe() -> str:
+    if not ASYNC_DB:
+        return "disabled (WF_ASYNC_DB=0), using threadpool"
+    if get_engine() is None:
+        return "async driver not installed, using threadpool"
+    return f"enabled ({_driver})"
+
+
+def _run_in_session(sync_engine, fn, args, kwargs):
+    with Session(sync_engine) as s:
+        return fn(s, *args, **kwargs)
+
+
+async def _run_on(sync_engine, fn, args, kwargs):
+    engine = get_engine(sync_engine)
+    if engine is None:
+        return await run_in_threadpool(_run_in_session, sync_engine, fn, args, kwargs)
+    from sqlmodel.ext.asyncio.session import AsyncSession
+    async with AsyncSession(engine, expire_on_commit=False) as s:
+        return await s.run_sync(fn, *args, **kwargs)
+
+
+async def run(fn, *args, **kwargs):
+    """在主库上执行 fn(session, *args, **kwargs) 并返回结果；fn 按同步代码编写，只读不提交"""
+    return await _run_on(_sync_engine, fn, args, kwargs)
+
+
+async def run_read(fn, *args, **kwargs):
+    """同 run，但按 crud.read_engine() 的规则可能在只读副本上执行"""
+    return await _run_on(replica.read_engine(), fn, args, kwargs)
+
+
+async def dispose():
+    """关闭池中连接；引擎本身保留，之后使用时重新建立连接"""
+    for engine in _engines.values():
+        if engine is not None:
+            await engine.dispose()
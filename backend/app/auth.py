@@ -1,27 +1,40 @@
+from typing import Optional
 from fastapi import Depends, HTTPException, Header, Security
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlmodel import Session
 from .utils import create_access_token, decode_token, hash_password, verify_password
-from .crud import get_user_by_username
+from .crud import get_user_by_username, get_user_by_username_async, get_session
+from . import replica
 
 security = HTTPBearer()
 
-def authenticate_user(username: str, password: str):
-    user = get_user_by_username(username)
+def authenticate_user(username: str, password: str, session: Optional[Session] = None):
+    user = get_user_by_username(username, session=session)
     if not user:
         return None
     if not verify_password(password, user.password_hash):
         return None
     return user
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Security(security)):
-    token = credentials.credentials
-    
+def _token_subject(token: str) -> str:
     payload = decode_token(token)
     if not payload or "sub" not in payload:
         raise HTTPException(status_code=401, detail="Invalid token")
-    
-    username = payload["sub"]
-    user = get_user_by_username(username)
+    return payload["sub"]
+
+def get_current_user(credentials: HTTPAuthorizationCredentials = Security(security),
+                     session: Session = Depends(get_session)):
+    """返回的用户属于请求级会话，端点中对它的修改随请求一起提交"""
+    user = get_user_by_username(_token_subject(credentials.credentials), session=session)
+    if not user or user.disabled:
+        raise HTTPException(status_code=401, detail="User not found or disabled")
+    replica.set_user(user.username)
+    return user
+
+async def get_current_user_async(credentials: HTTPAuthorizationCredentials = Security(security)):
+    """供 async 端点使用：查用户走异步连接，不为鉴权再占用线程池"""
+    user = await get_user_by_username_async(_token_subject(credentials.credentials))
     if not user or user.disabled:
         raise HTTPException(status_code=401, detail="User not found or disabled")
+    replica.set_user(user.username)
     return user
@@ -0,0 +1,72 @@
+"""进程内缓存
+
+LocalCache 是带 TTL 与容量上限的线程安全 LRU 缓存；缓存值可以附带一个
+“代号”（generation），数据变更时调用 bump() 递增代号，旧代号的缓存即失效。
+代号计数器放在导入时分配的共享内存中，生产模式下 fork 出的各 worker（见 server.py）
+共用同一组计数器：任一 worker 提交变更后，其它 worker 的缓存也立即失效。
+缓存内容仍按进程各自保存；多台机器之间不共享代号，只能依赖 TTL 兜底，因此 TTL 应保持较短。
+"""
+import multiprocessing
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+# 按命名空间的哈希分配槽位；不同命名空间落到同一槽位只会多失效一些缓存，不影响正确性
+_GENERATION_SLOTS = 64
+_generations = multiprocessing.RawArray("q", _GENERATION_SLOTS)
+_generation_lock = multiprocessing.Lock()
+
+
+def _slot(namespace: str) -> int:
+    return zlib.crc32(namespace.encode("utf-8")) % _GENERATION_SLOTS
+
+
+def generation(namespace: str) -> int:
+    return _generations[_slot(namespace)]
+
+
+def bump(namespace: str):
+    slot = _slot(namespace)
+    with _generation_lock:
+        _generations[slot] += 1
+
+
+class LocalCache:
+    def __init__(self, maxsize: int = 256, ttl: float = 60.0, namespace: str = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.namespace = namespace
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at, gen = item
+            if expires_at < time.monotonic() or (self.namespace and gen != generation(self.namespace)):
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, gen: int = None):
+        """gen 应取自查询开始前的 generation()，避免查询期间的变更被缓存成新值"""
+        if gen is None and self.namespace:
+            gen = generation(self.namespace)
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl, gen)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, predicate=None):
+        """清空缓存；传入 predicate(key) 时只删除匹配的键"""
+        with self._lock:
+            if predicate is None:
+                self._data.clear()
+                return
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
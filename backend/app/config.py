@@ -9,18 +9,99 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 # SQLite 配置（本地开发或备用）
 DB_FILE = os.getenv("WF_DB", os.path.join(BASE_DIR, "workflow.sqlite"))
 
-# 确保 SQLite 数据库文件所在目录存在
-if not DATABASE_URL:
-    db_dir = os.path.dirname(DB_FILE)
-    if db_dir and not os.path.exists(db_dir):
-        os.makedirs(db_dir, exist_ok=True)
-    print(f"[Database Config] Using SQLite: {DB_FILE}")
-    print(f"[Database Config] Database directory exists: {os.path.exists(db_dir)}")
-else:
-    print(f"[Database Config] Using PostgreSQL: {DATABASE_URL.split('@')[1] if '@' in DATABASE_URL else 'configured'}")
+# SQLite 连接配置：production 启用 WAL、PRAGMA 调优与进程内写入排队（见 dbprofile.py），default 为 SQLAlchemy 默认行为
+SQLITE_PROFILE = os.getenv("WF_SQLITE_PROFILE", "production")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("WF_SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_CACHE_MB = int(os.getenv("WF_SQLITE_CACHE_MB", 64))
+SQLITE_MMAP_MB = int(os.getenv("WF_SQLITE_MMAP_MB", 256))
+SQLITE_WRITE_QUEUE = os.getenv("WF_SQLITE_WRITE_QUEUE", "1") == "1"
+
+# 连接池（每个 worker 进程、同步与异步引擎各一个）：常驻连接数、额外溢出数、取连接的最长等待秒数
+DB_POOL_SIZE = int(os.getenv("WF_DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("WF_DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("WF_DB_POOL_TIMEOUT", 30))
+
+# PostgreSQL 连接配置（见 dbprofile.py）：连接回收秒数；探活方式 always/idle/off 与 idle 模式下的空闲阈值；
+# psycopg 3 转为服务端预编译语句的执行次数（0 关闭，经 PgBouncer 事务模式连接时必须关闭）；
+# 连接默认 statement_timeout 与各类路由的上限（毫秒，0 不设置）；application_name 前缀
+PG_POOL_RECYCLE = int(os.getenv("WF_PG_POOL_RECYCLE", 300))
+PG_PRE_PING = os.getenv("WF_PG_PRE_PING", "idle")
+PG_PING_IDLE_SECONDS = float(os.getenv("WF_PG_PING_IDLE_SECONDS", 30))
+PG_PREPARE_THRESHOLD = int(os.getenv("WF_PG_PREPARE_THRESHOLD", 5))
+PG_STATEMENT_TIMEOUT_MS = int(os.getenv("WF_PG_STATEMENT_TIMEOUT_MS", 30000))
+PG_TIMEOUT_READ_MS = int(os.getenv("WF_PG_TIMEOUT_READ_MS", 10000))
+PG_TIMEOUT_WRITE_MS = int(os.getenv("WF_PG_TIMEOUT_WRITE_MS", 15000))
+PG_TIMEOUT_REPORT_MS = int(os.getenv("WF_PG_TIMEOUT_REPORT_MS", 60000))
+PG_APPLICATION_NAME = os.getenv("WF_PG_APPLICATION_NAME", "workflow")
+
+# 只读副本（见 replica.py）：PostgreSQL 用 WF_REPLICA_DATABASE_URL，SQLite 用 WF_REPLICA_DB（本地测试）；
+# 写入后 WF_REPLICA_STICKY_SECONDS 秒内该用户的读取仍走主库（读己之写），应大于副本的复制延迟；
+# 副本连接出错后改读主库的秒数
+REPLICA_DATABASE_URL = os.getenv("WF_REPLICA_DATABASE_URL")
+REPLICA_DB = os.getenv("WF_REPLICA_DB")
+REPLICA_STICKY_SECONDS = float(os.getenv("WF_REPLICA_STICKY_SECONDS", 5))
+REPLICA_RETRY_SECONDS = float(os.getenv("WF_REPLICA_RETRY_SECONDS", 30))
+
+# 冷热分离归档（见 archive.py）：已结束超过 N 天的流程及其任务移入归档表，0 关闭；
+# 定时执行间隔秒数、每批（一个事务）的实例数、单次执行最多批数（0 不限）、批间暂停毫秒数
+ARCHIVE_AFTER_DAYS = int(os.getenv("WF_ARCHIVE_AFTER_DAYS", 0))
+ARCHIVE_INTERVAL = int(os.getenv("WF_ARCHIVE_INTERVAL", 3600))
+ARCHIVE_BATCH = int(os.getenv("WF_ARCHIVE_BATCH", 200))
+ARCHIVE_MAX_BATCHES = int(os.getenv("WF_ARCHIVE_MAX_BATCHES", 50))
+ARCHIVE_PAUSE_MS = int(os.getenv("WF_ARCHIVE_PAUSE_MS", 50))
 
 SECRET_KEY = os.getenv("WF_SECRET", "change_this_secret_for_prod")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 480))
 UPLOAD_FOLDER = os.path.join(BASE_DIR, "..", "uploads")
-if not os.path.exists(UPLOAD_FOLDER):
+
+# 启动时是否自动执行 init_db（建表、迁移、默认管理员）；
+# 多 worker 部署建议设为 0，发布前单独执行一次 python run.py migrate
+AUTO_MIGRATE = os.getenv("WF_AUTO_MIGRATE", "1") == "1"
+
+
+def ensure_directories():
+    """创建 SQLite 数据库与上传文件所需的目录。导入本模块不做任何文件操作，由启动流程/迁移命令调用"""
+    if not DATABASE_URL:
+        db_dir = os.path.dirname(DB_FILE)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+
+def log_summary():
+    if not DATABASE_URL:
+        print(f"[Database Config] Using SQLite: {DB_FILE}")
+    else:
+        print(f"[Database Config] Using PostgreSQL: {DATABASE_URL.split('@')[1] if '@' in DATABASE_URL else 'configured'}")
+
+# 高频只读接口使用异步驱动（aiosqlite/asyncpg/psycopg）；0 或驱动未安装时退回线程池
+ASYNC_DB = os.getenv("WF_ASYNC_DB", "1") == "1"
+
+# 后台定时任务（迭代快照等）；多 worker 部署时只需在一个进程中开启（python run.py prod 只在 0 号 worker 开启）
+JOBS_ENABLED = os.getenv("WF_JOBS", "1") == "1"
+
+# 生产模式（python run.py prod）：监听地址、worker 数（0 表示按 CPU 数自动选择）、
+# 收到 SIGTERM 后先让 /readyz 失败再停止接收连接的等待秒数、等待进行中请求完成的最长秒数
+HOST = os.getenv("WF_HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", os.getenv("WF_PORT", 8000)))
+WORKERS = int(os.getenv("WF_WORKERS", 0))
+DRAIN_DELAY = float(os.getenv("WF_DRAIN_DELAY", 0))
+GRACEFUL_TIMEOUT = float(os.getenv("WF_GRACEFUL_TIMEOUT", 30))
+CYCLE_SNAPSHOT_INTERVAL = int(os.getenv("WF_CYCLE_SNAPSHOT_INTERVAL", 3600))
+# 每人每个工作日可投入工时，用于迭代容量估算
+DAILY_CAPACITY_HOURS = float(os.getenv("WF_DAILY_CAPACITY_HOURS", 8))
+# /metrics 访问令牌；为空时不校验（仅应在内网暴露）
+METRICS_TOKEN = os.getenv("WF_METRICS_TOKEN", "")
+
+# SQL 诊断：调试响应头、慢查询阈值（毫秒）、N+1 判定阈值；WF_SQL_STRICT=1 时 N+1 直接报错（用于测试）
+SQL_DEBUG = os.getenv("WF_SQL_DEBUG", "0") == "1"
+SLOW_QUERY_MS = float(os.getenv("WF_SLOW_QUERY_MS", 200))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("WF_N_PLUS_ONE_THRESHOLD", 10))
+SQL_STRICT = os.getenv("WF_SQL_STRICT", "0") == "1"
+
+# 请求剖析：抽样比例（0~1）、方式（sample/cprofile）、采样间隔、输出目录与保留份数
+PROFILE_SAMPLE_RATE = float(os.getenv("WF_PROFILE_SAMPLE_RATE", 0))
+PROFILE_MODE = os.getenv("WF_PROFILE_MODE", "sample")
+PROFILE_INTERVAL_MS = float(os.getenv("WF_PROFILE_INTERVAL_MS", 5))
+PROFILE_DIR = os.getenv("WF_PROFILE_DIR", os.path.join(BASE_DIR, "profiles"))
+PROFILE_KEEP = int(os.getenv("WF_PROFILE_KEEP", 50))
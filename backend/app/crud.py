@@ -1,10 +1,17 @@
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone, timedelta, date
 from sqlmodel import Session, select, create_engine
-from sqlalchemy import text, func
-from typing import Optional
+from sqlalchemy import text, func, case, update, bindparam, inspect, delete, insert, event, or_, exists, String
+from sqlalchemy.pool import QueuePool
+from typing import Optional, List
 from .models import *
-from .utils import hash_password
-from .config import DATABASE_URL, DB_FILE
+from .utils import hash_password, pinyin_initials
+import base64
+import time
+from contextlib import contextmanager
+from . import search, cache, metrics, querylog, asyncdb, dbprofile, replica, archive
+from .config import DATABASE_URL, DB_FILE, DAILY_CAPACITY_HOURS, SQLITE_BUSY_TIMEOUT_MS, SQLITE_WRITE_QUEUE
+from .config import DB_POOL_SIZE, DB_MAX_OVERFLOW
+from .config import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH, ARCHIVE_MAX_BATCHES, ARCHIVE_PAUSE_MS
 
 LOCAL_TZ = timezone(timedelta(hours=8))
 IS_POSTGRES = DATABASE_URL is not None
@@ -36,26 +43,266 @@ if DATABASE_URL:
     # 如果连接字符串是 postgres:// 开头，需要改为 postgresql://
     if db_url.startswith("postgres://"):
         db_url = db_url.replace("postgres://", "postgresql://", 1)
-    # 使用连接池配置，支持 IPv4 网络
-    engine = create_engine(
-        db_url, 
-        echo=False, 
-        pool_pre_ping=True, 
-        pool_recycle=300,
-        connect_args={
-            "connect_timeout": 10,
-            "sslmode": "require"  # Supabase 需要 SSL
-        }
-    )
+    # 连接池、探活、预编译语句、statement_timeout 与 application_name 见 dbprofile.py
+    db_url = dbprofile.pg_url(db_url)
+    engine = create_engine(db_url, echo=False, **dbprofile.pg_engine_kwargs(db_url.get_driver_name()))
+    dbprofile.apply_pg_profile(engine)
 else:
     # SQLite 连接（本地开发）
     engine = create_engine(
         f"sqlite:///{DB_FILE}",
         echo=False,
-        connect_args={"check_same_thread": False},
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000.0},
+        **dbprofile.pool_kwargs(),
+    )
+    # WAL、PRAGMA 与写入排队（WF_SQLITE_PROFILE）
+    dbprofile.apply_sqlite_profile(engine, write_queue=SQLITE_WRITE_QUEUE)
+
+metrics.instrument_engine(engine)
+querylog.instrument_engine(engine)
+asyncdb.bind(engine)
+# 只读副本（WF_REPLICA_DATABASE_URL / WF_REPLICA_DB），未配置时 read_engine() 即主库
+replica.configure(engine)
+
+
+def read_engine():
+    """显式只读、可接受复制延迟的查询使用：配置了副本时读副本，刚写过的用户仍读主库"""
+    return replica.read_engine()
+
+
+# 请求级工作单元：get_session 为每个请求提供一个 Session，鉴权、crud 与审计共用同一个连接和事务，
+# 请求正常结束时提交，抛出异常时回滚。crud 函数的 session 参数为空时（后台任务、脚本）自建会话并自行提交。
+UNIT_OF_WORK = "wf_unit_of_work"
+
+
+def get_session():
+    """FastAPI 依赖：一个请求一个 Session"""
+    with Session(engine, expire_on_commit=False) as s:
+        s.info[UNIT_OF_WORK] = True
+        try:
+            yield s
+        except Exception:
+            s.rollback()
+            raise
+        tx = s.get_transaction()
+        if tx is not None and not tx.is_active:
+            # 端点捕获了数据库错误后正常返回，但事务已不可用、修改不会保存：回滚并报错（500），不能返回成功
+            s.rollback()
+            raise RuntimeError("request transaction was rolled back after a database error")
+        s.commit()
+
+
+@contextmanager
+def _session(session: Optional[Session] = None, read_only: bool = False, **kwargs):
+    """crud 函数内打开会话：传入请求级会话时直接使用（不关闭），否则新建。
+    read_only 的查询在路由到只读副本时总是新建副本上的会话"""
+    target = read_engine() if read_only else engine
+    if session is not None and target is engine:
+        yield session
+        return
+    with Session(target, **kwargs) as s:
+        yield s
+
+
+def read_session(session: Optional[Session] = None):
+    """端点中的只读查询使用，规则同 read_engine()"""
+    return _session(session, read_only=True)
+
+
+def _commit(s: Session):
+    """请求级会话只 flush（让后续语句看到修改），由 get_session 在请求结束时统一提交"""
+    if s.info.get(UNIT_OF_WORK):
+        s.flush()
+    else:
+        s.commit()
+
+# 数据变更提交后递增对应缓存代号，使依赖这些表的进程内缓存失效
+TASK_CACHE_NAMESPACE = "tasks"
+DEPARTMENT_CACHE_NAMESPACE = "departments"
+USER_CACHE_NAMESPACE = "users"
+_CACHE_NAMESPACES = (
+    ((Task, ProcessInstance, TaskLabel), TASK_CACHE_NAMESPACE),
+    ((Department,), DEPARTMENT_CACHE_NAMESPACE),
+    ((User,), USER_CACHE_NAMESPACE),
+)
+
+
+def _mark_changed(session, namespace: str):
+    """Core 语句不经过 flush 跟踪，需要手动标记"""
+    session.info.setdefault("cache_changed", set()).add(namespace)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_cache_changes(session, flush_context):
+    objs = (*session.new, *session.dirty, *session.deleted)
+    for models, namespace in _CACHE_NAMESPACES:
+        if any(isinstance(obj, models) for obj in objs):
+            _mark_changed(session, namespace)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_caches(session):
+    for namespace in session.info.pop("cache_changed", ()):
+        cache.bump(namespace)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_cache_changes(session):
+    session.info.pop("cache_changed", None)
+
+
+@event.listens_for(User, "before_insert")
+@event.listens_for(User, "before_update")
+def _refresh_user_search_key(mapper, connection, user):
+    user.pinyin_initials = pinyin_initials(user.display_name or user.username)
+
+
+INSTANCE_PROJECTION_COLUMNS = [
+    ("title", "TEXT"),
+    ("priority", "TEXT"),
+    ("due_date", "DATE"),
+]
+PROJECTION_BACKFILL_BATCH = 1000
+
+
+def instance_projection(data: Optional[dict]):
+    """从表单 data 中提取标题/优先级/截止日期，对应 ProcessInstance 的投影列"""
+    data = data or {}
+    title = data.get("title")
+    priority = data.get("priority")
+    due = data.get("due_date")
+    due_date = None
+    if isinstance(due, date):
+        due_date = due
+    elif isinstance(due, str):
+        try:
+            due_date = datetime.strptime(due, "%Y-%m-%d").date()
+        except ValueError:
+            due_date = None
+    return {
+        "title": str(title) if title is not None else None,
+        "priority": str(priority) if priority is not None else None,
+        "due_date": due_date,
+    }
+
+
+def backfill_instance_projection(s: Session):
+    """按主键分批回填投影列，每批单独提交，避免长时间锁表"""
+    stmt = (
+        update(ProcessInstance.__table__)
+        .where(ProcessInstance.__table__.c.id == bindparam("_id"))
+        .values(title=bindparam("title"), priority=bindparam("priority"), due_date=bindparam("due_date"))
     )
+    last_id = ""
+    while True:
+        rows = s.exec(
+            select(ProcessInstance.id, ProcessInstance.data)
+            .where(ProcessInstance.id > last_id)
+            .order_by(ProcessInstance.id)
+            .limit(PROJECTION_BACKFILL_BATCH)
+        ).all()
+        if not rows:
+            break
+        s.connection().execute(stmt, [{"_id": rid, **instance_projection(data)} for rid, data in rows])
+        s.commit()
+        last_id = rows[-1][0]
+
+
+def normalize_labels(labels) -> List[str]:
+    """去除空白与重复标签，保持原有顺序"""
+    result = []
+    for label in labels or []:
+        value = str(label).strip()
+        if value and value not in result:
+            result.append(value)
+    return result
+
+
+def _replace_task_labels(s: Session, task_id: str, labels: List[str]):
+    s.exec(delete(TaskLabel).where(TaskLabel.task_id == task_id))
+    if labels:
+        s.exec(insert(TaskLabel), params=[{"task_id": task_id, "label": label} for label in labels])
+
+
+def backfill_task_labels(s: Session):
+    """按主键分批把 Task.labels 展开写入 TaskLabel"""
+    last_id = ""
+    while True:
+        rows = s.exec(
+            select(Task.id, Task.labels)
+            .where(Task.id > last_id)
+            .order_by(Task.id)
+            .limit(PROJECTION_BACKFILL_BATCH)
+        ).all()
+        if not rows:
+            break
+        values = [
+            {"task_id": tid, "label": label}
+            for tid, labels in rows
+            for label in normalize_labels(labels)
+        ]
+        if values:
+            s.exec(insert(TaskLabel), params=values)
+        s.commit()
+        last_id = rows[-1][0]
+
+
+def backfill_user_initials(s: Session):
+    rows = s.exec(select(User.id, User.display_name, User.username)).all()
+    if rows:
+        s.connection().execute(
+            update(User.__table__).where(User.__table__.c.id == bindparam("_id")).values(pinyin_initials=bindparam("initials")),
+            [{"_id": uid, "initials": pinyin_initials(display_name or username)} for uid, display_name, username in rows],
+        )
+    s.commit()
+
+
+def migrate_departments(s: Session):
+    """补齐已有部门的物化路径，并把用户的部门名称关联到部门表（缺失的部门作为顶级部门创建）"""
+    depts = {d.id: d for d in s.exec(select(Department)).all()}
+
+    def build_path(d, seen=()):
+        if d.parent_id and d.parent_id in depts and d.parent_id not in seen:
+            return build_path(depts[d.parent_id], seen + (d.id,)) + f"{d.id}/"
+        return f"/{d.id}/"
+
+    for d in depts.values():
+        if not d.path:
+            d.path = build_path(d)
+            s.add(d)
+    s.commit()
+    names = s.exec(select(User.department).where(User.department.isnot(None)).distinct()).all()
+    for name in names:
+        if name and name.strip():
+            dept = resolve_department(s, name)
+            s.exec(update(User).where(User.department == name).values(department_id=dept.id))
+    s.commit()
+
+
+def check_database():
+    """就绪检查：连接池未被占满且能执行 SELECT 1，返回 (是否就绪, 详情)"""
+    pool = engine.pool
+    detail = {}
+    if isinstance(pool, QueuePool):
+        # 所有引擎都按 dbprofile.pool_kwargs() 建池，上限直接取配置
+        limit = DB_POOL_SIZE + max(DB_MAX_OVERFLOW, 0)
+        checked_out = pool.checkedout()
+        detail.update(pool_size=pool.size(), checked_out=checked_out, overflow=max(pool.overflow(), 0), limit=limit)
+        # 池已占满时新请求只能排队等连接，此时不应再接收流量（max_overflow<0 表示不限）
+        if DB_MAX_OVERFLOW >= 0 and checked_out >= limit:
+            return False, dict(detail, error="connection pool exhausted")
+    start = time.perf_counter()
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception as e:
+        return False, dict(detail, error=str(e).splitlines()[0] if str(e) else type(e).__name__)
+    detail["latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return True, detail
+
 
 def init_db():
+    existing_tables = set(inspect(engine).get_table_names())
     SQLModel.metadata.create_all(engine)
     
     # 检查并添加新列（用于现有数据库的迁移）
@@ -77,6 +324,21 @@ def init_db():
                     s.commit()
                     print("Added 'avatar' column to user table")
 
+                # 部门树：物化路径 + 用户外键
+                if not has_column("department", "path"):
+                    s.exec(text("ALTER TABLE department ADD COLUMN path TEXT NOT NULL DEFAULT ''"))
+                    s.commit()
+                if not has_column("user", "pinyin_initials"):
+                    s.exec(text("ALTER TABLE user ADD COLUMN pinyin_initials TEXT"))
+                    s.commit()
+                    backfill_user_initials(s)
+                    print("Added 'pinyin_initials' column to user table")
+                if not has_column("user", "department_id"):
+                    s.exec(text("ALTER TABLE user ADD COLUMN department_id INTEGER REFERENCES department(id)"))
+                    s.commit()
+                    migrate_departments(s)
+                    print("Added 'department_id' column to user table")
+
                 # Task 新增列
                 task_new_columns = [
                     ("priority", "TEXT"),
@@ -90,6 +352,15 @@ def init_db():
                         s.exec(text(f"ALTER TABLE task ADD COLUMN {col} {col_type}"))
                         s.commit()
                         print(f"Added '{col}' column to task table")
+
+                # ProcessInstance 热点字段投影列
+                if not has_column("processinstance", "title"):
+                    for col, col_type in INSTANCE_PROJECTION_COLUMNS:
+                        s.exec(text(f"ALTER TABLE processinstance ADD COLUMN {col} {col_type}"))
+                        s.exec(text(f"CREATE INDEX IF NOT EXISTS ix_processinstance_{col} ON processinstance ({col})"))
+                    s.commit()
+                    backfill_instance_projection(s)
+                    print("Added projection columns to processinstance table")
             except Exception as e:
                 print(f"Migration check error (may be normal for new DB): {e}")
                 s.rollback()
@@ -114,6 +385,20 @@ def init_db():
                     s.commit()
                     print("Added 'avatar' column to user table")
 
+                if not has_column_pg("department", "path"):
+                    s.exec(text("ALTER TABLE department ADD COLUMN path TEXT NOT NULL DEFAULT ''"))
+                    s.commit()
+                if not has_column_pg("user", "pinyin_initials"):
+                    s.exec(text("ALTER TABLE \"user\" ADD COLUMN pinyin_initials TEXT"))
+                    s.commit()
+                    backfill_user_initials(s)
+                    print("Added 'pinyin_initials' column to user table")
+                if not has_column_pg("user", "department_id"):
+                    s.exec(text("ALTER TABLE \"user\" ADD COLUMN department_id INTEGER REFERENCES department(id)"))
+                    s.commit()
+                    migrate_departments(s)
+                    print("Added 'department_id' column to user table")
+
                 task_new_columns = [
                     ("priority", "TEXT"),
                     ("labels", "JSONB"),
@@ -126,9 +411,43 @@ def init_db():
                         s.exec(text(f"ALTER TABLE \"task\" ADD COLUMN {col} {col_type}"))
                         s.commit()
                         print(f"Added '{col}' column to task table")
+
+                if not has_column_pg("processinstance", "title"):
+                    for col, col_type in INSTANCE_PROJECTION_COLUMNS:
+                        s.exec(text(f"ALTER TABLE processinstance ADD COLUMN {col} {col_type}"))
+                        s.exec(text(f"CREATE INDEX IF NOT EXISTS ix_processinstance_{col} ON processinstance ({col})"))
+                    s.commit()
+                    backfill_instance_projection(s)
+                    print("Added projection columns to processinstance table")
+
+                # 审计日志主键改为原生 uuid（16 字节）；已有的 UUID4 文本值可直接转换，改写整表期间会锁表
+                id_type = s.exec(text("""
+                    SELECT data_type FROM information_schema.columns
+                    WHERE table_name='auditlog' AND column_name='id'
+                """)).first()
+                if id_type and id_type[0] != "uuid":
+                    s.exec(text("ALTER TABLE auditlog ALTER COLUMN id TYPE uuid USING id::uuid"))
+                    s.commit()
+                    print("Converted auditlog.id to uuid")
             except Exception as e:
                 print(f"PostgreSQL migration check error (may be normal for new DB): {e}")
                 s.rollback()
+
+    # 为已有表补建模型中新声明的索引
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(engine, checkfirst=True)
+            except Exception as e:
+                print(f"Create index {index.name} failed: {e}")
+
+    # 新建的标签表需要从 Task.labels 回填
+    if "tasklabel" not in existing_tables and "task" in existing_tables:
+        with Session(engine) as s:
+            backfill_task_labels(s)
+
+    # 全文检索索引（首次启用时自动回填）
+    search.ensure_index(engine)
     
     # 创建默认管理员账户
     with Session(engine) as s:
@@ -137,34 +456,43 @@ def init_db():
             admin = User(username="admin", password_hash=hash_password("admin123"), display_name="系统管理员", role="admin")
             s.add(admin); s.commit()
 
-def get_user_by_username(username: str):
-    with Session(engine) as s:
-        return s.exec(select(User).where(User.username == username)).first()
+def _user_by_username(s: Session, username: str):
+    return s.exec(select(User).where(User.username == username)).first()
 
-def create_user(username: str, password_hash: str, display_name: str = None, role: str = "user", department: str = None):
-    with Session(engine) as s:
-        user = User(username=username, password_hash=password_hash, display_name=display_name, role=role, department=department)
-        s.add(user); s.commit(); s.refresh(user)
+def get_user_by_username(username: str, session: Optional[Session] = None):
+    with _session(session) as s:
+        return _user_by_username(s, username)
+
+async def get_user_by_username_async(username: str):
+    """get_user_by_username 的异步版本"""
+    return await asyncdb.run(_user_by_username, username)
+
+def create_user(username: str, password_hash: str, display_name: str = None, role: str = "user", department: str = None, session: Optional[Session] = None):
+    with _session(session) as s:
+        user = User(username=username, password_hash=password_hash, display_name=display_name, role=role)
+        if department:
+            assign_user_department(s, user, name=department)
+        s.add(user); _commit(s); s.refresh(user)
         return user
 
-def create_template(name: str, definition: dict, created_by: str):
-    with Session(engine) as s:
+def create_template(name: str, definition: dict, created_by: str, session: Optional[Session] = None):
+    with _session(session) as s:
         tpl = ProcessTemplate(name=name, definition=definition, created_by=created_by)
-        s.add(tpl); s.commit(); s.refresh(tpl)
+        s.add(tpl); _commit(s); s.refresh(tpl)
         return tpl
 
-def list_templates():
-    with Session(engine) as s:
+def list_templates(session: Optional[Session] = None):
+    with _session(session) as s:
         return s.exec(select(ProcessTemplate)).all()
 
-def get_template(tid: str):
-    with Session(engine) as s:
+def get_template(tid: str, session: Optional[Session] = None):
+    with _session(session) as s:
         return s.get(ProcessTemplate, tid)
 
-def create_instance(template_id: str, data: dict, started_by: str, old_instance_id: Optional[str] = None):
+def create_instance(template_id: str, data: dict, started_by: str, old_instance_id: Optional[str] = None, session: Optional[Session] = None):
     local_now = datetime.now()
     
-    with Session(engine, expire_on_commit=False) as s:
+    with _session(session, expire_on_commit=False) as s:
         # 如果是重新提交，将旧实例的相关任务标记为已完成，并更新实例状态
         if old_instance_id:
             old_inst = s.get(ProcessInstance, old_instance_id)
@@ -182,7 +510,7 @@ def create_instance(template_id: str, data: dict, started_by: str, old_instance_
                 old_inst.status = "approved"
                 old_inst.ended_at = local_now
                 s.add(old_inst)
-                s.commit()
+                _commit(s)
         
         tpl = s.get(ProcessTemplate, template_id)
         if not tpl:
@@ -195,97 +523,173 @@ def create_instance(template_id: str, data: dict, started_by: str, old_instance_
         if not nexts:
             raise ValueError("no edge from start")
         first_node_id = nexts[0]
-        inst = ProcessInstance(template_id=template_id, data=data or {}, current_node=first_node_id, started_by=started_by)
-        s.add(inst); s.commit(); s.refresh(inst)
+        inst = ProcessInstance(
+            template_id=template_id, data=data or {}, current_node=first_node_id, started_by=started_by,
+            **instance_projection(data),
+        )
+        s.add(inst); s.flush()
+        search.index_instance(s, inst, tpl.name)
+        _commit(s); s.refresh(inst)
         node = next((n for n in defn.get("nodes", []) if n['id'] == first_node_id), None)
         assignee = node.get('meta', {}).get('assignee')
-        priority = (data or {}).get("priority")
-        t = Task(instance_id=inst.id, node_id=first_node_id, assignee=assignee, priority=priority)
-        s.add(t); s.commit(); s.refresh(t)
+        t = Task(instance_id=inst.id, node_id=first_node_id, assignee=assignee, priority=inst.priority)
+        s.add(t); _commit(s); s.refresh(t)
         return inst, t
 
-def get_tasks_for_user(username: str):
-    with Session(engine) as s:
-        # 只查询状态为 pending 的任务
-        tasks = s.exec(select(Task).where(Task.assignee == username, Task.status == "pending")).all()
-        results = []
-        for task in tasks:
-            inst = s.get(ProcessInstance, task.instance_id)
-            # 排除已驳回和已结束的流程任务
-            if inst and inst.status not in ["rejected", "approved"]:
-                # 获取模板定义以获取节点名称
-                tpl = s.get(ProcessTemplate, inst.template_id)
-                node_name = task.node_id  # 默认使用 node_id
-                if tpl and tpl.definition:
-                    node = next((n for n in tpl.definition.get("nodes", []) if n.get("id") == task.node_id), None)
-                    if node and node.get("meta", {}).get("name"):
-                        node_name = node.get("meta", {}).get("name")
-                
-                results.append({
-                    "id": task.id,
-                    "instance_id": task.instance_id,
-                    "node_id": task.node_id,
-                    "node_name": node_name,
-                    "assignee": task.assignee,
-                    "status": task.status,
-                    "opinion": task.opinion,
-                    "assigned_at": iso_local(task.assigned_at),
-                    "finished_at": iso_local(task.finished_at),
-                    "priority": task.priority,
-                    "labels": task.labels or [],
-                    "module_id": task.module_id,
-                    "estimate_hours": task.estimate_hours,
-                    "due_date": task.due_date.isoformat() if task.due_date else None,
-                    "data": inst.data if inst else {},
-                    "instance": {
-                        "id": inst.id,
-                        "started_by": inst.started_by,
-                        "status": inst.status,
-                        "current_node": inst.current_node,
-                    } if inst else None,
-                })
-        return results
-
-def get_task(tid: str):
-    with Session(engine) as s:
+def _node_name(definition: Optional[dict], node_id: Optional[str]):
+    """从模板定义中取节点显示名称，缺省返回 node_id"""
+    if definition and node_id:
+        node = next((n for n in definition.get("nodes", []) if n.get("id") == node_id), None)
+        if node and node.get("meta", {}).get("name"):
+            return node.get("meta", {}).get("name")
+    return node_id
+
+def _load_by_ids(s: Session, model, ids):
+    """按主键批量加载，返回 {id: 对象}；用于替代循环内逐条 s.get"""
+    result = {}
+    ids = list({i for i in ids if i})
+    for chunk in _chunks(ids):
+        for obj in s.exec(select(model).where(model.id.in_(chunk))).all():
+            result[obj.id] = obj
+    return result
+
+def _current_tasks(s: Session, instances):
+    """批量取各实例当前节点上的待办任务，返回 {instance_id: Task}"""
+    wanted = {inst.id: inst.current_node for inst in instances if inst.current_node}
+    result = {}
+    for chunk in _chunks(list(wanted)):
+        tasks = s.exec(
+            select(Task)
+            .where(Task.instance_id.in_(chunk), Task.status == "pending")
+            .order_by(Task.assigned_at)
+        ).all()
+        for t in tasks:
+            if t.node_id == wanted[t.instance_id] and t.instance_id not in result:
+                result[t.instance_id] = t
+    return result
+
+def _tasks_for_user(s: Session, username: str):
+    # 只查询状态为 pending 的任务，并排除已驳回和已结束的流程任务
+    rows = s.exec(
+        select(Task, ProcessInstance)
+        .join(ProcessInstance, ProcessInstance.id == Task.instance_id)
+        .where(Task.assignee == username, Task.status == "pending",
+               ProcessInstance.status.notin_(["rejected", "approved"]))
+    ).all()
+    templates = _load_by_ids(s, ProcessTemplate, [inst.template_id for _, inst in rows])
+    results = []
+    for task, inst in rows:
+        tpl = templates.get(inst.template_id)
+        node_name = _node_name(tpl.definition if tpl else None, task.node_id)
+        results.append({
+            "id": task.id,
+            "instance_id": task.instance_id,
+            "node_id": task.node_id,
+            "node_name": node_name,
+            "assignee": task.assignee,
+            "status": task.status,
+            "opinion": task.opinion,
+            "assigned_at": iso_local(task.assigned_at),
+            "finished_at": iso_local(task.finished_at),
+            "priority": task.priority,
+            "labels": task.labels or [],
+            "module_id": task.module_id,
+            "estimate_hours": task.estimate_hours,
+            "due_date": task.due_date.isoformat() if task.due_date else None,
+            "data": inst.data if inst else {},
+            "instance": {
+                "id": inst.id,
+                "started_by": inst.started_by,
+                "status": inst.status,
+                "current_node": inst.current_node,
+            } if inst else None,
+        })
+    return results
+
+def get_tasks_for_user(username: str, session: Optional[Session] = None):
+    with _session(session) as s:
+        return _tasks_for_user(s, username)
+
+async def get_tasks_for_user_async(username: str):
+    """get_tasks_for_user 的异步版本"""
+    return await asyncdb.run(_tasks_for_user, username)
+
+def get_task(tid: str, session: Optional[Session] = None):
+    with _session(session) as s:
         return s.get(Task, tid)
 
-def list_all_tasks_admin():
+def _filter_tasks(query, labels: Optional[List[str]] = None, status: Optional[str] = None):
+    """按状态与标签（需同时包含全部标签）筛选任务"""
+    if status:
+        query = query.where(Task.status == status)
+    labels = normalize_labels(labels)
+    if labels:
+        query = query.where(Task.id.in_(
+            select(TaskLabel.task_id)
+            .where(TaskLabel.label.in_(labels))
+            .group_by(TaskLabel.task_id)
+            .having(func.count(TaskLabel.label) == len(labels))
+        ))
+    return query
+
+
+def _admin_tasks_query(labels: Optional[List[str]] = None, status: Optional[str] = None):
+    return _filter_tasks(
+        select(Task, ProcessInstance).outerjoin(ProcessInstance, ProcessInstance.id == Task.instance_id),
+        labels, status,
+    )
+
+def _admin_task_rows(s: Session, rows):
+    templates = _load_by_ids(s, ProcessTemplate, [inst.template_id for _, inst in rows if inst])
+    results = []
+    for task, inst in rows:
+        tpl = templates.get(inst.template_id) if inst else None
+        node_name = _node_name(tpl.definition if tpl else None, task.node_id)
+        results.append({
+            "id": task.id,
+            "instance_id": task.instance_id,
+            "node_id": task.node_id,
+            "node_name": node_name,
+            "assignee": task.assignee,
+            "status": task.status,
+            "priority": task.priority,
+            "labels": task.labels or [],
+            "module_id": task.module_id,
+            "estimate_hours": task.estimate_hours,
+            "due_date": task.due_date.isoformat() if task.due_date else None,
+            "assigned_at": iso_local(task.assigned_at),
+            "finished_at": iso_local(task.finished_at),
+            "instance_title": inst.title if inst else None,
+            "instance_status": inst.status if inst else None,
+            "template_name": tpl.name if tpl else None,
+        })
+    return results
+
+def list_all_tasks_admin(labels: Optional[List[str]] = None, status: Optional[str] = None, session: Optional[Session] = None):
     """管理员视角查看所有任务（含已完成/驳回），用于分配到迭代"""
-    with Session(engine) as s:
-        tasks = s.exec(select(Task)).all()
-        results = []
-        for task in tasks:
-            inst = s.get(ProcessInstance, task.instance_id)
-            tpl = s.get(ProcessTemplate, inst.template_id) if inst else None
-            node_name = task.node_id
-            if tpl and tpl.definition:
-                node = next((n for n in tpl.definition.get("nodes", []) if n.get("id") == task.node_id), None)
-                if node and node.get("meta", {}).get("name"):
-                    node_name = node.get("meta", {}).get("name")
-            results.append({
-                "id": task.id,
-                "instance_id": task.instance_id,
-                "node_id": task.node_id,
-                "node_name": node_name,
-                "assignee": task.assignee,
-                "status": task.status,
-                "priority": task.priority,
-                "labels": task.labels or [],
-                "module_id": task.module_id,
-                "estimate_hours": task.estimate_hours,
-                "due_date": task.due_date.isoformat() if task.due_date else None,
-                "assigned_at": iso_local(task.assigned_at),
-                "finished_at": iso_local(task.finished_at),
-                "instance_title": inst.data.get("title") if inst and inst.data else None,
-                "instance_status": inst.status if inst else None,
-                "template_name": tpl.name if tpl else None,
-            })
-        return results
+    with _session(session, read_only=True) as s:
+        return _admin_task_rows(s, s.exec(_admin_tasks_query(labels, status)).all())
+
+def iter_all_tasks_admin(labels: Optional[List[str]] = None, status: Optional[str] = None):
+    """list_all_tasks_admin 的流式版本"""
+    for s, batch in _stream_batches(_admin_tasks_query(labels, status)):
+        yield from _admin_task_rows(s, batch)
+
+def task_label_facets(labels: Optional[List[str]] = None, status: Optional[str] = None, session: Optional[Session] = None):
+    """统计（筛选后）任务上各标签出现的次数"""
+    with _session(session, read_only=True) as s:
+        filtered = _filter_tasks(select(Task.id), labels, status)
+        rows = s.exec(
+            select(TaskLabel.label, func.count(TaskLabel.task_id))
+            .where(TaskLabel.task_id.in_(filtered))
+            .group_by(TaskLabel.label)
+            .order_by(func.count(TaskLabel.task_id).desc(), TaskLabel.label)
+        ).all()
+        return [{"label": label, "count": count} for label, count in rows]
 
-def complete_task(task_id: str, username: str, decision: str, opinion: str = None):
+def complete_task(task_id: str, username: str, decision: str, opinion: str = None, session: Optional[Session] = None):
     local_now = datetime.now()
-    with Session(engine) as s:
+    with _session(session) as s:
         task = s.get(Task, task_id)
         if not task:
             raise ValueError("task not found")
@@ -297,7 +701,10 @@ def complete_task(task_id: str, username: str, decision: str, opinion: str = Non
         task.opinion = opinion
         task.finished_at = local_now
         s.add(task)
+        if task.assigned_at:
+            metrics.TASK_COMPLETION.observe((local_now - task.assigned_at).total_seconds(), task.status)
         inst = s.get(ProcessInstance, task.instance_id)
+        search.index_task(s, task, inst.title)
         tpl = s.get(ProcessTemplate, inst.template_id)
         defn = tpl.definition
         curr_node = next((n for n in defn.get("nodes", []) if n['id'] == task.node_id), None)
@@ -306,7 +713,7 @@ def complete_task(task_id: str, username: str, decision: str, opinion: str = Non
             inst.status = "rejected" if decision == "reject" else "approved"
             inst.current_node = None
             inst.ended_at = local_now
-            s.add(inst); s.commit()
+            s.add(inst); _commit(s)
             return task, inst, None
         next_node_id = nexts[0]
         next_node = next((n for n in defn.get("nodes", []) if n['id'] == next_node_id), None)
@@ -314,66 +721,69 @@ def complete_task(task_id: str, username: str, decision: str, opinion: str = Non
             inst.status = "approved"
             inst.current_node = None
             inst.ended_at = local_now
-            s.add(inst); s.commit()
+            s.add(inst); _commit(s)
             return task, inst, None
         inst.current_node = next_node_id
-        s.add(inst); s.commit()
+        s.add(inst); _commit(s)
         assignee = next_node.get('meta', {}).get('assignee') if next_node else None
-        priority = inst.data.get("priority") if inst and inst.data else None
-        new_task = Task(instance_id=inst.id, node_id=next_node_id, assignee=assignee, priority=priority)
-        s.add(new_task); s.commit(); s.refresh(new_task)
+        new_task = Task(instance_id=inst.id, node_id=next_node_id, assignee=assignee, priority=inst.priority)
+        s.add(new_task); _commit(s); s.refresh(new_task)
         return task, inst, new_task
 
-def save_document(title: str, filename: str, uploaded_by: str):
-    with Session(engine) as s:
+def save_document(title: str, filename: str, uploaded_by: str, session: Optional[Session] = None):
+    with _session(session) as s:
         doc = Document(title=title, filename=filename, uploaded_by=uploaded_by)
-        s.add(doc); s.commit(); s.refresh(doc)
+        s.add(doc); s.flush()
+        search.index_document(s, doc)
+        _commit(s); s.refresh(doc)
         return doc
 
-def list_documents():
-    with Session(engine) as s:
+def list_documents(session: Optional[Session] = None):
+    with _session(session) as s:
         return s.exec(select(Document)).all()
 
-def get_document(doc_id: str):
-    with Session(engine) as s:
+def get_document(doc_id: str, session: Optional[Session] = None):
+    with _session(session) as s:
         return s.get(Document, doc_id)
 
-def publish_document(doc_id: str):
-    with Session(engine) as s:
+def publish_document(doc_id: str, session: Optional[Session] = None):
+    with _session(session) as s:
         doc = s.get(Document, doc_id)
         if not doc:
             raise ValueError("doc not found")
         doc.status = "published"
         doc.version += 1
-        s.add(doc); s.commit(); s.refresh(doc)
+        s.add(doc); _commit(s); s.refresh(doc)
         return doc
 
-def write_audit(user: str, action: str, detail: dict):
+def write_audit(user: str, action: str, detail: dict, session: Optional[Session] = None):
+    """传入请求级会话时审计日志与业务修改在同一事务中提交；写在保存点内，
+    审计写入失败只丢弃这条日志，不会让请求事务失效"""
     try:
-        with Session(engine) as s:
-            log = AuditLog(user=user, action=action, detail=detail or {})
-            s.add(log)
-        s.commit()
+        with _session(session) as s:
+            with s.begin_nested():
+                s.add(AuditLog(user=user, action=action, detail=detail or {}))
+            _commit(s)
     except Exception as e:
         # 审计日志失败不应该影响主流程
         print(f"Audit log error: {str(e)}")
 
-def delete_template(template_id: str):
-    with Session(engine) as s:
+def delete_template(template_id: str, session: Optional[Session] = None):
+    with _session(session) as s:
         tpl = s.get(ProcessTemplate, template_id)
         if not tpl:
             raise ValueError("模板不存在")
         s.delete(tpl)
-        s.commit()
+        _commit(s)
 
 
 # --------------------------
 # 模块（Module）
 # --------------------------
-def create_module(name: str, description: str, creator: str):
-    with Session(engine) as s:
+def create_module(name: str, description: str, creator: str, session: Optional[Session] = None):
+    with _session(session) as s:
         m = Module(name=name, description=description, created_by=creator)
-        s.add(m); s.commit(); s.refresh(m)
+        s.add(m); _commit(s); s.refresh(m)
         return {
             "id": m.id,
             "name": m.name,
@@ -382,8 +792,8 @@ def create_module(name: str, description: str, creator: str):
             "created_at": iso_local(m.created_at)
         }
 
-def update_module(module_id: str, name: str = None, description: str = None):
-    with Session(engine) as s:
+def update_module(module_id: str, name: str = None, description: str = None, session: Optional[Session] = None):
+    with _session(session) as s:
         m = s.get(Module, module_id)
         if not m:
             raise ValueError("模块不存在")
@@ -391,7 +801,7 @@ def update_module(module_id: str, name: str = None, description: str = None):
             m.name = name
         if description is not None:
             m.description = description
-        s.add(m); s.commit(); s.refresh(m)
+        s.add(m); _commit(s); s.refresh(m)
         return {
             "id": m.id,
             "name": m.name,
@@ -400,18 +810,18 @@ def update_module(module_id: str, name: str = None, description: str = None):
             "created_at": iso_local(m.created_at)
         }
 
-def delete_module(module_id: str):
-    with Session(engine) as s:
+def delete_module(module_id: str, session: Optional[Session] = None):
+    with _session(session) as s:
         m = s.get(Module, module_id)
         if not m:
             raise ValueError("模块不存在")
-        s.delete(m); s.commit()
+        s.delete(m); _commit(s)
 
-def list_modules(role: str, username: str):
+def list_modules(role: str, username: str, session: Optional[Session] = None):
     """管理员/公司管理员/部门管理员可见；普通用户暂不返回。"""
     if role not in ("admin", "company_admin", "dept_admin"):
         return []
-    with Session(engine) as s:
+    with _session(session) as s:
         modules = s.exec(select(Module).order_by(Module.created_at.desc())).all()
         return [
             {
@@ -428,33 +838,34 @@ def list_modules(role: str, username: str):
 # --------------------------
 # 任务元数据
 # --------------------------
-def update_task_meta(task_id: str, priority: str = None, labels = None, module_id: str = None, estimate_hours: float = None, due_date = None):
-    with Session(engine) as s:
+def update_task_meta(task_id: str, priority: str = None, labels = None, module_id: str = None, estimate_hours: float = None, due_date = None, session: Optional[Session] = None):
+    with _session(session) as s:
         task = s.get(Task, task_id)
         if not task:
             raise ValueError("任务不存在")
         if priority is not None:
             task.priority = priority
         if labels is not None:
-            # labels 允许字符串数组
-            task.labels = labels
+            # labels 允许字符串数组，同步维护 TaskLabel
+            task.labels = normalize_labels(labels)
+            _replace_task_labels(s, task.id, task.labels)
         if module_id is not None:
             task.module_id = module_id
         if estimate_hours is not None:
             task.estimate_hours = estimate_hours
         if due_date is not None:
             task.due_date = due_date
-        s.add(task); s.commit(); s.refresh(task)
+        s.add(task); _commit(s); s.refresh(task)
         return task
 
 
 # --------------------------
 # 迭代（Cycle）
 # --------------------------
-def create_cycle(name: str, start_date, end_date, goal: str, creator: str):
-    with Session(engine) as s:
+def create_cycle(name: str, start_date, end_date, goal: str, creator: str, session: Optional[Session] = None):
+    with _session(session) as s:
         c = Cycle(name=name, start_date=start_date, end_date=end_date, goal=goal, created_by=creator)
-        s.add(c); s.commit(); s.refresh(c)
+        s.add(c); _commit(s); s.refresh(c)
         return {
             "id": c.id,
             "name": c.name,
@@ -465,11 +876,11 @@ def create_cycle(name: str, start_date, end_date, goal: str, creator: str):
             "created_at": iso_local(c.created_at),
         }
 
-def list_cycles(role: str, username: str):
+def list_cycles(role: str, username: str, session: Optional[Session] = None):
     """管理员/公司管理员/部门管理员可见"""
     if role not in ("admin", "company_admin", "dept_admin"):
         return []
-    with Session(engine) as s:
+    with _session(session) as s:
         cycles = s.exec(select(Cycle).order_by(Cycle.start_date.desc())).all()
         return [
             {
@@ -484,8 +895,8 @@ def list_cycles(role: str, username: str):
             for c in cycles
         ]
 
-def assign_task_to_cycle(cycle_id: str, task_id: str):
-    with Session(engine) as s:
+def assign_task_to_cycle(cycle_id: str, task_id: str, session: Optional[Session] = None):
+    with _session(session) as s:
         c = s.get(Cycle, cycle_id)
         if not c:
             raise ValueError("迭代不存在")
@@ -496,24 +907,102 @@ def assign_task_to_cycle(cycle_id: str, task_id: str):
         if not exists:
             ct = CycleTask(cycle_id=cycle_id, task_id=task_id)
             s.add(ct)
-        s.commit()
+        _commit(s)
 
-def remove_task_from_cycle(cycle_id: str, task_id: str):
-    with Session(engine) as s:
+def remove_task_from_cycle(cycle_id: str, task_id: str, session: Optional[Session] = None):
+    with _session(session) as s:
         ct = s.get(CycleTask, (cycle_id, task_id))
         if ct:
-            s.delete(ct); s.commit()
+            s.delete(ct); _commit(s)
 
-def get_cycle_detail(cycle_id: str):
-    with Session(engine) as s:
+# 批量操作时每条语句携带的 id 数量上限（SQLite 默认变量上限为 999）
+ID_CHUNK_SIZE = 500
+
+
+def _chunks(ids: List[str], size: int = ID_CHUNK_SIZE):
+    ids = list(dict.fromkeys(i for i in ids if i))
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def _insert_cycle_tasks(s: Session, cycle_id: str, source):
+    """把 source（选出 task_id 的子查询）中尚未在迭代里的任务批量加入迭代，返回新增条数"""
+    already = exists().where(CycleTask.cycle_id == cycle_id, CycleTask.task_id == source.c.task_id)
+    result = s.exec(insert(CycleTask).from_select(
+        ["cycle_id", "task_id"],
+        select(bindparam("cycle_id", cycle_id), source.c.task_id).where(~already),
+    ))
+    return result.rowcount or 0
+
+
+def bulk_assign_tasks_to_cycle(cycle_id: str, task_ids: List[str], session: Optional[Session] = None):
+    """批量加入迭代：每批一条 INSERT ... SELECT，不存在的任务 id 会被忽略"""
+    added = 0
+    with _session(session) as s:
+        if not s.get(Cycle, cycle_id):
+            raise ValueError("迭代不存在")
+        for chunk in _chunks(task_ids):
+            source = select(Task.id.label("task_id")).where(Task.id.in_(chunk)).subquery()
+            added += _insert_cycle_tasks(s, cycle_id, source)
+        _commit(s)
+    return added
+
+
+def bulk_remove_tasks_from_cycle(cycle_id: str, task_ids: List[str], session: Optional[Session] = None):
+    removed = 0
+    with _session(session) as s:
+        for chunk in _chunks(task_ids):
+            result = s.exec(delete(CycleTask).where(CycleTask.cycle_id == cycle_id, CycleTask.task_id.in_(chunk)))
+            removed += result.rowcount or 0
+        _commit(s)
+    return removed
+
+
+def move_tasks_between_cycles(cycle_id: str, target_cycle_id: str, task_ids: List[str], session: Optional[Session] = None):
+    """把任务从一个迭代移到另一个迭代，在同一事务中完成插入与删除"""
+    if cycle_id == target_cycle_id:
+        return 0
+    moved = 0
+    with _session(session) as s:
+        if not s.get(Cycle, target_cycle_id):
+            raise ValueError("目标迭代不存在")
+        for chunk in _chunks(task_ids):
+            source = (
+                select(CycleTask.task_id.label("task_id"))
+                .where(CycleTask.cycle_id == cycle_id, CycleTask.task_id.in_(chunk))
+                .subquery()
+            )
+            _insert_cycle_tasks(s, target_cycle_id, source)
+            result = s.exec(delete(CycleTask).where(CycleTask.cycle_id == cycle_id, CycleTask.task_id.in_(chunk)))
+            moved += result.rowcount or 0
+        _commit(s)
+    return moved
+
+
+def get_cycle_detail(cycle_id: str, page: int = 1, page_size: int = 100, status: Optional[str] = None, session: Optional[Session] = None):
+    """迭代详情：任务通过 JOIN 分页读取，另附总数与各状态计数"""
+    with _session(session) as s:
         c = s.get(Cycle, cycle_id)
         if not c:
             return None
-        mappings = s.exec(select(CycleTask).where(CycleTask.cycle_id == cycle_id)).all()
-        task_ids = [m.task_id for m in mappings]
-        tasks = []
-        if task_ids:
-            tasks = s.exec(select(Task).where(Task.id.in_(task_ids))).all()
+        in_cycle = (
+            select(Task)
+            .join(CycleTask, CycleTask.task_id == Task.id)
+            .where(CycleTask.cycle_id == cycle_id)
+        )
+        status_counts = {
+            st: count for st, count in s.exec(
+                select(Task.status, func.count(Task.id))
+                .join(CycleTask, CycleTask.task_id == Task.id)
+                .where(CycleTask.cycle_id == cycle_id)
+                .group_by(Task.status)
+            ).all()
+        }
+        if status:
+            in_cycle = in_cycle.where(Task.status == status)
+        tasks = s.exec(
+            in_cycle.order_by(Task.assigned_at, Task.id).offset((page - 1) * page_size).limit(page_size)
+        ).all()
         return {
             "id": c.id,
             "name": c.name,
@@ -522,6 +1011,10 @@ def get_cycle_detail(cycle_id: str):
             "goal": c.goal,
             "created_by": c.created_by,
             "created_at": iso_local(c.created_at),
+            "total": sum(status_counts.values()),
+            "status_counts": status_counts,
+            "page": page,
+            "page_size": page_size,
             "tasks": [
                 {
                     "id": t.id,
@@ -540,338 +1033,931 @@ def get_cycle_detail(cycle_id: str):
         }
 
 
+def snapshot_cycles(day: Optional[date] = None, cycle_ids: Optional[List[str]] = None, session: Optional[Session] = None):
+    """为进行中的迭代写入当天快照（按处理人、模块分组），同一天重复执行会覆盖"""
+    day = day or datetime.now(LOCAL_TZ).date()
+    with _session(session) as s:
+        active = select(Cycle.id).where(Cycle.start_date <= day, Cycle.end_date >= day)
+        if cycle_ids:
+            active = active.where(Cycle.id.in_(cycle_ids))
+        active_ids = s.exec(active).all()
+        if not active_ids:
+            return 0
+        pending = Task.status == "pending"
+        aggregate = (
+            select(
+                CycleTask.cycle_id,
+                bindparam("snap_date", day),
+                Task.assignee,
+                Task.module_id,
+                func.count(Task.id),
+                func.sum(case((pending, 1), else_=0)),
+                func.coalesce(func.sum(case((pending, Task.estimate_hours), else_=0)), 0),
+            )
+            .join(Task, Task.id == CycleTask.task_id)
+            .where(CycleTask.cycle_id.in_(active_ids))
+            .group_by(CycleTask.cycle_id, Task.assignee, Task.module_id)
+        )
+        s.exec(delete(CycleSnapshot).where(CycleSnapshot.cycle_id.in_(active_ids), CycleSnapshot.snap_date == day))
+        s.exec(insert(CycleSnapshot).from_select(
+            ["cycle_id", "snap_date", "assignee", "module_id", "total_tasks", "remaining_tasks", "remaining_hours"],
+            aggregate,
+        ))
+        _commit(s)
+        return len(active_ids)
+
+
+def archive_finished_instances(days: int = ARCHIVE_AFTER_DAYS, batch: int = ARCHIVE_BATCH,
+                               max_batches: int = ARCHIVE_MAX_BATCHES, pause_ms: int = ARCHIVE_PAUSE_MS):
+    """把结束超过 days 天的流程及其任务移入归档表（见 archive.py）。每批一个事务，
+    批间暂停让出写锁；单次最多 max_batches 批（0 不限），剩余的留给下一次定时执行。返回 (实例数, 任务数)"""
+    if days <= 0:
+        return 0, 0
+    cutoff = datetime.now() - timedelta(days=days)
+    total_instances = total_tasks = batches = 0
+    while not max_batches or batches < max_batches:
+        with Session(engine) as s:
+            instances, tasks = archive.archive_batch(s, cutoff, batch)
+            if not instances:
+                break
+            _mark_changed(s, TASK_CACHE_NAMESPACE)
+            s.commit()
+        total_instances += instances
+        total_tasks += tasks
+        batches += 1
+        if instances < batch:
+            break
+        time.sleep(pause_ms / 1000.0)
+    if total_instances:
+        print(f"[Archive] moved {total_instances} instances and {total_tasks} tasks older than {days} days")
+    return total_instances, total_tasks
+
+
+def _working_days(start: date, end: date) -> int:
+    if end < start:
+        return 0
+    days = (end - start).days + 1
+    full_weeks, rest = divmod(days, 7)
+    weekdays = full_weeks * 5
+    for i in range(rest):
+        if (start.weekday() + i) % 7 < 5:
+            weekdays += 1
+    return weekdays
+
+
+def get_cycle_burndown(cycle_id: str, session: Optional[Session] = None):
+    """燃尽序列与处理人容量/负载，只读取快照表（每天每个分组一行）"""
+    today = datetime.now(LOCAL_TZ).date()
+    with _session(session) as s:
+        c = s.get(Cycle, cycle_id)
+        if not c:
+            return None
+    if c.start_date <= today <= c.end_date:
+        with _session(session) as s:
+            has_today = s.exec(
+                select(CycleSnapshot.id).where(CycleSnapshot.cycle_id == cycle_id, CycleSnapshot.snap_date == today).limit(1)
+            ).first()
+        if not has_today:
+            snapshot_cycles(today, [cycle_id], session=session)
+    with _session(session) as s:
+        series_rows = s.exec(
+            select(
+                CycleSnapshot.snap_date,
+                func.sum(CycleSnapshot.total_tasks),
+                func.sum(CycleSnapshot.remaining_tasks),
+                func.sum(CycleSnapshot.remaining_hours),
+            )
+            .where(CycleSnapshot.cycle_id == cycle_id)
+            .group_by(CycleSnapshot.snap_date)
+            .order_by(CycleSnapshot.snap_date)
+        ).all()
+        latest = series_rows[-1][0] if series_rows else None
+        latest_rows = s.exec(
+            select(CycleSnapshot).where(CycleSnapshot.cycle_id == cycle_id, CycleSnapshot.snap_date == latest)
+        ).all() if latest else []
+
+    by_assignee = {}
+    by_module = {}
+    for row in latest_rows:
+        a = by_assignee.setdefault(row.assignee, {"remaining_tasks": 0, "load_hours": 0.0})
+        a["remaining_tasks"] += row.remaining_tasks
+        a["load_hours"] += row.remaining_hours or 0
+        m = by_module.setdefault(row.module_id, {"remaining_tasks": 0, "remaining_hours": 0.0})
+        m["remaining_tasks"] += row.remaining_tasks
+        m["remaining_hours"] += row.remaining_hours or 0
+    capacity_days = _working_days(max(today, c.start_date), c.end_date)
+    capacity_hours = capacity_days * DAILY_CAPACITY_HOURS
+    return {
+        "id": c.id,
+        "name": c.name,
+        "start_date": c.start_date.isoformat(),
+        "end_date": c.end_date.isoformat(),
+        "snapshot_date": latest.isoformat() if latest else None,
+        "series": [
+            {
+                "date": d.isoformat(),
+                "total_tasks": total or 0,
+                "remaining_tasks": remaining or 0,
+                "remaining_hours": float(hours or 0),
+            }
+            for d, total, remaining, hours in series_rows
+        ],
+        "capacity": sorted([
+            {
+                "assignee": assignee,
+                "remaining_tasks": v["remaining_tasks"],
+                "load_hours": v["load_hours"],
+                "capacity_hours": capacity_hours if assignee else None,
+                "utilization": round(v["load_hours"] / capacity_hours, 2) if assignee and capacity_hours else None,
+            }
+            for assignee, v in by_assignee.items()
+        ], key=lambda x: x["load_hours"], reverse=True),
+        "modules": [
+            {"module_id": module_id, **v} for module_id, v in by_module.items()
+        ],
+    }
+
+
 # --------------------------
 # 视图（SavedView）
 # --------------------------
-def save_view(owner: str, name: str, filters: dict):
-    with Session(engine) as s:
+def save_view(owner: str, name: str, filters: dict, session: Optional[Session] = None):
+    with _session(session) as s:
         v = SavedView(name=name, owner=owner, filters=filters or {})
-        s.add(v); s.commit(); s.refresh(v)
+        s.add(v); _commit(s); s.refresh(v)
         return v
 
-def list_views(owner: str):
-    with Session(engine) as s:
+def list_views(owner: str, session: Optional[Session] = None):
+    with _session(session) as s:
         return s.exec(select(SavedView).where(SavedView.owner == owner).order_by(SavedView.created_at.desc())).all()
 
-def delete_view(view_id: str, owner: str):
-    with Session(engine) as s:
+def delete_view(view_id: str, owner: str, session: Optional[Session] = None):
+    with _session(session) as s:
         v = s.get(SavedView, view_id)
         if v and v.owner == owner:
-            s.delete(v); s.commit()
+            s.delete(v); _commit(s)
+            _view_cache.invalidate(lambda key: key[1] == view_id)
 
-def list_instances_by_user(username: str, status: Optional[str] = None):
-    with Session(engine) as s:
-        query = select(ProcessInstance).where(ProcessInstance.started_by == username)
-        if status:
-            query = query.where(ProcessInstance.status == status)
-        instances = s.exec(query.order_by(ProcessInstance.started_at.desc())).all()
-        results = []
-        for inst in instances:
-            tpl = s.get(ProcessTemplate, inst.template_id)
-            current_task = None
-            current_node_name = inst.current_node  # 默认使用 node_id
-            if inst.current_node:
-                current_task = s.exec(
-                    select(Task).where(
-                        Task.instance_id == inst.id,
-                        Task.node_id == inst.current_node,
-                        Task.status == "pending"
-                    )
-                ).first()
-                # 获取节点名称
-                if tpl and tpl.definition:
-                    node = next((n for n in tpl.definition.get("nodes", []) if n.get("id") == inst.current_node), None)
-                    if node and node.get("meta", {}).get("name"):
-                        current_node_name = node.get("meta", {}).get("name")
-            results.append({
-                "id": inst.id,
-                "template_id": inst.template_id,
-                "template_name": tpl.name if tpl else None,
-                "title": inst.data.get("title") if inst.data else None,
-                "status": inst.status,
-                "current_node": inst.current_node,
-                "current_node_name": current_node_name,
-                "current_assignee": current_task.assignee if current_task else None,
-                "started_by": inst.started_by,
-            "started_at": iso_local(inst.started_at),
-            "ended_at": iso_local(inst.ended_at),
+
+# 视图结果缓存：任务变更时整体失效，TTL 兜底多 worker 之间的不一致
+_view_cache = cache.LocalCache(maxsize=512, ttl=30, namespace=TASK_CACHE_NAMESPACE)
+
+
+def compile_view_filters(owner: str, filters: dict):
+    """把 SavedView.filters 编译为待办任务查询（与 TaskTodo 页面的筛选语义一致）"""
+    filters = filters or {}
+    query = (
+        select(Task, ProcessInstance, ProcessTemplate.definition, func.count(Task.id).over())
+        .join(ProcessInstance, ProcessInstance.id == Task.instance_id)
+        .outerjoin(ProcessTemplate, ProcessTemplate.id == ProcessInstance.template_id)
+        .where(
+            Task.assignee == owner,
+            Task.status == "pending",
+            ProcessInstance.status.notin_(["rejected", "approved"]),
+        )
+    )
+    keyword = str(filters.get("keyword") or "").strip().lower()
+    if keyword:
+        query = query.where(or_(
+            func.lower(ProcessInstance.title).contains(keyword, autoescape=True),
+            func.lower(ProcessInstance.started_by).contains(keyword, autoescape=True),
+        ))
+    if filters.get("priority"):
+        query = query.where(Task.priority == filters["priority"])
+    if filters.get("module_id"):
+        query = query.where(Task.module_id == filters["module_id"])
+    label = str(filters.get("label") or "").strip().lower()
+    if label:
+        query = query.where(exists().where(
+            TaskLabel.task_id == Task.id,
+            func.lower(TaskLabel.label).contains(label, autoescape=True),
+        ))
+    if filters.get("labels"):
+        query = _filter_tasks(query, labels=filters["labels"])
+    return query.order_by(Task.assigned_at.desc(), Task.id)
+
+
+def run_view(view_id: str, owner: str, page: int = 1, page_size: int = 50, session: Optional[Session] = None):
+    """在服务端执行保存的视图，返回分页后的待办任务；视图不存在或不属于 owner 时返回 None"""
+    gen = cache.generation(TASK_CACHE_NAMESPACE)
+    with _session(session) as s:
+        # 先校验归属再读缓存，缓存键也带上 owner，避免把他人视图的结果返回给当前用户
+        view = s.get(SavedView, view_id)
+        if not view or view.owner != owner:
+            return None
+        key = (owner, view_id, page, page_size)
+        cached = _view_cache.get(key)
+        if cached is not None:
+            return cached
+        query = compile_view_filters(owner, view.filters).offset((page - 1) * page_size).limit(page_size)
+        rows = s.exec(query).all()
+        items = []
+        total = 0
+        for task, inst, definition, total in rows:
+            items.append({
+                "id": task.id,
+                "instance_id": task.instance_id,
+                "node_id": task.node_id,
+                "node_name": _node_name(definition, task.node_id),
+                "assignee": task.assignee,
+                "status": task.status,
+                "opinion": task.opinion,
+                "assigned_at": iso_local(task.assigned_at),
+                "finished_at": iso_local(task.finished_at),
+                "priority": task.priority,
+                "labels": task.labels or [],
+                "module_id": task.module_id,
+                "estimate_hours": task.estimate_hours,
+                "due_date": task.due_date.isoformat() if task.due_date else None,
                 "data": inst.data,
+                "instance": {
+                    "id": inst.id,
+                    "started_by": inst.started_by,
+                    "status": inst.status,
+                    "current_node": inst.current_node,
+                },
             })
-        return results
+        if not rows and page > 1:
+            total = s.exec(select(func.count()).select_from(compile_view_filters(owner, view.filters).subquery())).one()
+        result = {"id": view.id, "name": view.name, "items": items, "total": total, "page": page, "page_size": page_size}
+    _view_cache.set(key, result, gen)
+    return result
 
-def list_departments():
-    with Session(engine) as s:
-        rows = s.exec(select(User.department).where(User.department.isnot(None))).all()
-        departments_set = set()
-        for row in rows:
-            # 兼容 SQLite（返回元组）和 PostgreSQL（可能直接返回标量）
-            if isinstance(row, (list, tuple)):
-                value = row[0] if row else None
-            else:
-                value = row
-            if not value:
-                continue
-            # 去掉首尾空白，过滤空字符串
-            value_str = str(value).strip()
-            if value_str:
-                departments_set.add(value_str)
-        departments = sorted(departments_set)
-        return departments
-
-def list_all_instances_for_monitoring():
-    """列出所有流程实例供系统管理员监控，包括当前节点、负责人、停留时长"""
-    now = datetime.now()
-    
-    with Session(engine) as s:
-        # 获取所有运行中的实例
-        instances = s.exec(
-            select(ProcessInstance)
-            .where(ProcessInstance.status == "running")
-            .order_by(ProcessInstance.started_at.desc())
+def _instances_by_user_query(username: str, status: Optional[str] = None, keyword: Optional[str] = None,
+                             due_from: Optional[date] = None, due_to: Optional[date] = None, model=ProcessInstance):
+    query = select(model).where(model.started_by == username)
+    if status:
+        query = query.where(model.status == status)
+    if keyword:
+        query = query.where(model.title.contains(keyword))
+    if due_from:
+        query = query.where(model.due_date >= due_from)
+    if due_to:
+        query = query.where(model.due_date <= due_to)
+    return query.order_by(model.started_at.desc())
+
+def _instances_by_user_queries(username: str, status: Optional[str] = None, keyword: Optional[str] = None,
+                               due_from: Optional[date] = None, due_to: Optional[date] = None):
+    """“我的流程”依次读取热表与归档表（归档的都是已结束流程，按已结束状态筛选或不筛选时才需要查），
+    与首页统计中计入的归档数保持一致"""
+    queries = [_instances_by_user_query(username, status, keyword, due_from, due_to)]
+    if not status or status in archive.FINISHED_STATUSES:
+        queries.append(_instances_by_user_query(username, status, keyword, due_from, due_to, ProcessInstanceArchive))
+    return queries
+
+def _instance_list_rows(s: Session, instances):
+    templates = _load_by_ids(s, ProcessTemplate, [inst.template_id for inst in instances])
+    # 归档实例都已结束，没有当前任务
+    current_tasks = _current_tasks(s, [inst for inst in instances if isinstance(inst, ProcessInstance)])
+    results = []
+    for inst in instances:
+        tpl = templates.get(inst.template_id)
+        current_task = current_tasks.get(inst.id)
+        current_node_name = _node_name(tpl.definition if tpl else None, inst.current_node)
+        results.append({
+            "id": inst.id,
+            "template_id": inst.template_id,
+            "template_name": tpl.name if tpl else None,
+            "title": inst.title,
+            "status": inst.status,
+            "current_node": inst.current_node,
+            "current_node_name": current_node_name,
+            "current_assignee": current_task.assignee if current_task else None,
+            "started_by": inst.started_by,
+            "started_at": iso_local(inst.started_at),
+            "ended_at": iso_local(inst.ended_at),
+            "data": inst.data,
+            "archived": isinstance(inst, ProcessInstanceArchive),
+        })
+    return results
+
+def _instances_by_user(s: Session, username: str, status: Optional[str] = None, keyword: Optional[str] = None,
+                       due_from: Optional[date] = None, due_to: Optional[date] = None):
+    instances = []
+    for query in _instances_by_user_queries(username, status, keyword, due_from, due_to):
+        instances.extend(s.exec(query).all())
+    return _instance_list_rows(s, instances)
+
+def list_instances_by_user(username: str, status: Optional[str] = None, keyword: Optional[str] = None,
+                           due_from: Optional[date] = None, due_to: Optional[date] = None, session: Optional[Session] = None):
+    with _session(session) as s:
+        return _instances_by_user(s, username, status, keyword, due_from, due_to)
+
+async def list_instances_by_user_async(username: str, status: Optional[str] = None, keyword: Optional[str] = None,
+                                       due_from: Optional[date] = None, due_to: Optional[date] = None):
+    """list_instances_by_user 的异步版本"""
+    return await asyncdb.run(_instances_by_user, username, status, keyword, due_from, due_to)
+
+def iter_instances_by_user(username: str, status: Optional[str] = None, keyword: Optional[str] = None,
+                           due_from: Optional[date] = None, due_to: Optional[date] = None):
+    """list_instances_by_user 的流式版本（见 jsonstream.py）：逐批查询、逐批转换"""
+    for query in _instances_by_user_queries(username, status, keyword, due_from, due_to):
+        for s, batch in _stream_batches(query, read_only=False):
+            yield from _instance_list_rows(s, batch)
+
+# --------------------------
+# 人员目录
+# --------------------------
+_user_search_cache = cache.LocalCache(maxsize=1024, ttl=30, namespace=USER_CACHE_NAMESPACE)
+
+
+def _prefix_condition(column, prefix: str):
+    """前缀匹配写成范围条件（col >= 'zs' AND col < 'zt'），可直接使用普通 B-tree 索引"""
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return (column >= prefix) & (column < upper)
+
+
+def _user_option(u: User):
+    return {
+        "id": u.id,
+        "username": u.username,
+        "display_name": u.display_name or u.username,
+        "department": u.department,
+        "role": u.role or "user",
+    }
+
+
+def search_users(q: str, limit: int = 10, session: Optional[Session] = None):
+    """人员联想：按用户名、显示名或拼音首字母前缀匹配"""
+    q = (q or "").strip()
+    if not q:
+        return []
+    key = (q, limit)
+    cached = _user_search_cache.get(key)
+    if cached is not None:
+        return cached
+    gen = cache.generation(USER_CACHE_NAMESPACE)
+    conditions = [
+        _prefix_condition(User.username, q),
+        _prefix_condition(User.display_name, q),
+        _prefix_condition(User.pinyin_initials, q.lower()),
+    ]
+    if q.lower() != q:
+        conditions.append(_prefix_condition(User.username, q.lower()))
+    with _session(session) as s:
+        users = s.exec(
+            select(User)
+            .where(or_(*conditions), User.disabled == False)  # noqa: E712
+            .order_by(User.display_name, User.username)
+            .limit(limit)
         ).all()
-        
-        results = []
-        for inst in instances:
-            tpl = s.get(ProcessTemplate, inst.template_id)
-            current_task = None
-            current_node_name = inst.current_node  # 默认使用 node_id
-            stuck_duration = None  # 停留时长（秒）
-            progress_percent = 0
-            
-            # 计算进度
-            total_nodes = 0
-            completed_nodes = 0
-            if tpl and tpl.definition:
-                total_nodes = len([n for n in tpl.definition.get("nodes", []) if n.get("type") not in ("start", "end")])
-                tasks = s.exec(select(Task).where(Task.instance_id == inst.id)).all()
-                completed_nodes = len([t for t in tasks if t.status != "pending"])
-                if total_nodes > 0:
-                    progress_percent = int(min(100, (completed_nodes / total_nodes) * 100))
-            
-            if inst.current_node:
-                # 查找当前待办任务
-                current_task = s.exec(
-                    select(Task).where(
-                        Task.instance_id == inst.id,
-                        Task.node_id == inst.current_node,
-                        Task.status == "pending"
-                    )
-                ).first()
-                
-                # 获取节点名称
-                if tpl and tpl.definition:
-                    node = next((n for n in tpl.definition.get("nodes", []) if n.get("id") == inst.current_node), None)
-                    if node and node.get("meta", {}).get("name"):
-                        current_node_name = node.get("meta", {}).get("name")
-                
-                # 计算停留时长（从任务分配时间到现在）
-                if current_task and current_task.assigned_at:
-                    assigned_time_local = to_local(current_task.assigned_at)
-                    if assigned_time_local:
-                        delta = now - assigned_time_local
-                        stuck_duration = max(0, int(delta.total_seconds()))
-            
-            # 获取发起人信息
-            starter = s.get(User, inst.started_by) if inst.started_by else None
-            started_at_local = to_local(inst.started_at)
-            
-            results.append({
-                "id": inst.id,
-                "template_id": inst.template_id,
-                "template_name": tpl.name if tpl else None,
-                "title": inst.data.get("title") if inst.data else None,
-                "status": inst.status,
-                "current_node": inst.current_node,
-                "current_node_name": current_node_name,
-                "current_assignee": current_task.assignee if current_task else None,
-                "stuck_duration": stuck_duration,  # 停留时长（秒）
-                "started_by": inst.started_by,
-                "started_by_name": starter.display_name or starter.username if starter else None,
-                "started_at": started_at_local.isoformat() if started_at_local else None,
-                "data": inst.data,
-                "progress_percent": progress_percent if inst.status != "approved" else 100,
-            })
-        return results
+        result = [_user_option(u) for u in users]
+    _user_search_cache.set(key, result, gen)
+    return result
 
-def get_instance_detail(instance_id: str, requester: str):
-    with Session(engine) as s:
-        inst = s.get(ProcessInstance, instance_id)
-        if not inst:
-            return None
-        tpl = s.get(ProcessTemplate, inst.template_id)
-        tasks = s.exec(select(Task).where(Task.instance_id == inst.id).order_by(Task.assigned_at)).all()
-        history = []
-        for t in tasks:
-            # 获取节点名称
-            node_name = t.node_id
-            if tpl and tpl.definition:
-                node = next((n for n in tpl.definition.get("nodes", []) if n.get("id") == t.node_id), None)
-                if node and node.get("meta", {}).get("name"):
-                    node_name = node.get("meta", {}).get("name")
-            history.append({
-                "id": t.id,
-                "node_id": t.node_id,
-                "node_name": node_name,
-                "assignee": t.assignee,
-                "status": t.status,
-                "opinion": t.opinion,
-                "assigned_at": t.assigned_at.isoformat() if t.assigned_at else None,
-                "finished_at": t.finished_at.isoformat() if t.finished_at else None,
-            })
-        current_task = next((t for t in tasks if t.status == "pending"), None)
-        current_node_name = inst.current_node
-        if inst.current_node and tpl and tpl.definition:
-            node = next((n for n in tpl.definition.get("nodes", []) if n.get("id") == inst.current_node), None)
-            if node and node.get("meta", {}).get("name"):
-                current_node_name = node.get("meta", {}).get("name")
-        return {
+
+def _encode_cursor(u: User) -> str:
+    return base64.urlsafe_b64encode(f"{u.created_at.isoformat()}|{u.id}".encode()).decode()
+
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, uid = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), uid
+    except Exception:
+        raise ValueError("invalid cursor")
+
+
+def list_users_page(limit: int, cursor: Optional[str] = None, condition=None, session: Optional[Session] = None):
+    """按 created_at 倒序的游标分页；返回 (users, next_cursor)"""
+    query = select(User)
+    if condition is not None:
+        query = query.where(condition)
+    if cursor:
+        created_at, uid = _decode_cursor(cursor)
+        query = query.where(or_(
+            User.created_at < created_at,
+            (User.created_at == created_at) & (User.id < uid),
+        ))
+    with _session(session, read_only=True) as s:
+        users = s.exec(query.order_by(User.created_at.desc(), User.id.desc()).limit(limit + 1)).all()
+    next_cursor = _encode_cursor(users[limit - 1]) if len(users) > limit else None
+    return users[:limit], next_cursor
+
+
+# --------------------------
+# 部门（Department）
+# --------------------------
+_department_cache = cache.LocalCache(maxsize=4, ttl=300, namespace=DEPARTMENT_CACHE_NAMESPACE)
+
+
+def _department_dict(d: Department):
+    return {"id": d.id, "name": d.name, "parent_id": d.parent_id, "path": d.path}
+
+
+def list_department_tree(session: Optional[Session] = None):
+    """全部部门节点（按路径排序，父节点在前），进程内缓存"""
+    gen = cache.generation(DEPARTMENT_CACHE_NAMESPACE)
+    nodes = _department_cache.get("tree")
+    if nodes is None:
+        with _session(session) as s:
+            nodes = [_department_dict(d) for d in s.exec(select(Department).order_by(Department.path)).all()]
+        _department_cache.set("tree", nodes, gen)
+    return nodes
+
+
+def list_departments():
+    return sorted({n["name"].strip() for n in list_department_tree() if n["name"] and n["name"].strip()})
+
+
+def _subtree_condition(path: str):
+    """路径前缀对应的范围条件（"/1/4/" <= path < "/1/40"），可走 path 索引"""
+    return (Department.path >= path) & (Department.path < path[:-1] + "0")
+
+
+def department_subtree(department_id: int):
+    """返回子树内部门 id 的子查询"""
+    node = next((n for n in list_department_tree() if n["id"] == department_id), None)
+    path = node["path"] if node else f"/{department_id}/"
+    return select(Department.id).where(_subtree_condition(path))
+
+
+def user_department_filter(department_id: Optional[int], department: Optional[str] = None):
+    """部门管理员的数据范围：有 department_id 时取整个子树，否则退回按名称匹配"""
+    if department_id:
+        return User.department_id.in_(department_subtree(department_id))
+    return User.department == department
+
+
+def resolve_department(s: Session, name: str):
+    """按名称查找部门，找不到时创建为顶级部门"""
+    name = name.strip()
+    dept = s.exec(select(Department).where(Department.name == name).order_by(Department.path)).first()
+    if not dept:
+        dept = Department(name=name)
+        s.add(dept); s.flush()
+        dept.path = f"/{dept.id}/"
+        s.add(dept); s.flush()
+    return dept
+
+
+def assign_user_department(s: Session, user: User, name: Optional[str] = None, department_id: Optional[int] = None):
+    """设置用户部门，同时维护 department 名称与 department_id"""
+    if department_id is not None:
+        dept = s.get(Department, department_id)
+        if not dept:
+            raise ValueError("部门不存在")
+    elif name is not None and name.strip():
+        dept = resolve_department(s, name)
+    else:
+        user.department = name or None
+        user.department_id = None
+        return
+    user.department = dept.name
+    user.department_id = dept.id
+
+
+def create_department(name: str, parent_id: Optional[int] = None, session: Optional[Session] = None):
+    with _session(session) as s:
+        parent = s.get(Department, parent_id) if parent_id else None
+        if parent_id and not parent:
+            raise ValueError("上级部门不存在")
+        dept = Department(name=name.strip(), parent_id=parent_id)
+        s.add(dept); s.flush()
+        dept.path = f"{parent.path if parent else '/'}{dept.id}/"
+        s.add(dept); _commit(s); s.refresh(dept)
+        return _department_dict(dept)
+
+
+def update_department(department_id: int, name: Optional[str] = None, parent_id: Optional[int] = None, move: bool = False, session: Optional[Session] = None):
+    """重命名或移动部门；移动时用一条 UPDATE 改写整个子树的路径前缀"""
+    with _session(session) as s:
+        dept = s.get(Department, department_id)
+        if not dept:
+            raise ValueError("部门不存在")
+        if name is not None and name.strip() and name.strip() != dept.name:
+            dept.name = name.strip()
+            s.exec(update(User).where(User.department_id == dept.id).values(department=dept.name))
+        if move and parent_id != dept.parent_id:
+            parent = s.get(Department, parent_id) if parent_id else None
+            if parent_id and not parent:
+                raise ValueError("上级部门不存在")
+            if parent and parent.path.startswith(dept.path):
+                raise ValueError("不能移动到自己的下级部门")
+            old_path = dept.path
+            new_path = f"{parent.path if parent else '/'}{dept.id}/"
+            s.exec(
+                update(Department)
+                .where(_subtree_condition(old_path))
+                .values(path=new_path + func.substr(Department.path, len(old_path) + 1, type_=String))
+                .execution_options(synchronize_session=False)
+            )
+            dept.parent_id = parent_id
+            dept.path = new_path
+        s.add(dept); _commit(s); s.refresh(dept)
+        return _department_dict(dept)
+
+
+def delete_department(department_id: int, session: Optional[Session] = None):
+    with _session(session) as s:
+        dept = s.get(Department, department_id)
+        if not dept:
+            raise ValueError("部门不存在")
+        if s.exec(select(Department.id).where(Department.parent_id == department_id).limit(1)).first():
+            raise ValueError("请先删除下级部门")
+        if s.exec(select(User.id).where(User.department_id == department_id).limit(1)).first():
+            raise ValueError("部门下仍有用户")
+        s.delete(dept); _commit(s)
+
+# 所有运行中的实例
+_MONITOR_QUERY = select(ProcessInstance).where(ProcessInstance.status == "running").order_by(ProcessInstance.started_at.desc())
+
+def _instances_for_monitoring(s: Session):
+    return _monitor_rows(s, s.exec(_MONITOR_QUERY).all())
+
+def _monitor_rows(s: Session, instances):
+    now = datetime.now(LOCAL_TZ)  # 与 to_local 的结果同为东八区时间
+
+    # 模板、当前待办、已完成节点数、发起人一次性批量取出
+    templates = _load_by_ids(s, ProcessTemplate, [inst.template_id for inst in instances])
+    current_tasks = _current_tasks(s, instances)
+    instance_ids = [inst.id for inst in instances]
+    completed_counts = {}
+    for chunk in _chunks(instance_ids):
+        completed_counts.update(s.exec(
+            select(Task.instance_id, func.count(Task.id))
+            .where(Task.instance_id.in_(chunk), Task.status != "pending")
+            .group_by(Task.instance_id)
+        ).all())
+    starters = {}
+    usernames = list({inst.started_by for inst in instances if inst.started_by})
+    for chunk in _chunks(usernames):
+        starters.update({u.username: u for u in s.exec(select(User).where(User.username.in_(chunk))).all()})
+
+    results = []
+    for inst in instances:
+        tpl = templates.get(inst.template_id)
+        current_task = current_tasks.get(inst.id)
+        current_node_name = _node_name(tpl.definition if tpl else None, inst.current_node)
+        stuck_duration = None  # 停留时长（秒）
+        progress_percent = 0
+        
+        # 计算进度
+        if tpl and tpl.definition:
+            total_nodes = len([n for n in tpl.definition.get("nodes", []) if n.get("type") not in ("start", "end")])
+            completed_nodes = completed_counts.get(inst.id, 0)
+            if total_nodes > 0:
+                progress_percent = int(min(100, (completed_nodes / total_nodes) * 100))
+        
+        # 计算停留时长（从任务分配时间到现在）
+        if current_task and current_task.assigned_at:
+            assigned_time_local = to_local(current_task.assigned_at)
+            if assigned_time_local:
+                delta = now - assigned_time_local
+                stuck_duration = max(0, int(delta.total_seconds()))
+        
+        # 获取发起人信息
+        starter = starters.get(inst.started_by) if inst.started_by else None
+        started_at_local = to_local(inst.started_at)
+        
+        results.append({
             "id": inst.id,
             "template_id": inst.template_id,
             "template_name": tpl.name if tpl else None,
-            "template_definition": tpl.definition if tpl else None,
-            "title": inst.data.get("title") if inst.data else None,
+            "title": inst.title,
             "status": inst.status,
             "current_node": inst.current_node,
             "current_node_name": current_node_name,
             "current_assignee": current_task.assignee if current_task else None,
+            "stuck_duration": stuck_duration,  # 停留时长（秒）
             "started_by": inst.started_by,
-            "started_at": inst.started_at.isoformat() if inst.started_at else None,
-            "ended_at": inst.ended_at.isoformat() if inst.ended_at else None,
+            "started_by_name": starter.display_name or starter.username if starter else None,
+            "started_at": started_at_local.isoformat() if started_at_local else None,
             "data": inst.data,
-            "history": history,
-        }
+            "progress_percent": progress_percent if inst.status != "approved" else 100,
+        })
+    return results
+
+def list_all_instances_for_monitoring(session: Optional[Session] = None):
+    """列出所有流程实例供系统管理员监控，包括当前节点、负责人、停留时长"""
+    with _session(session, read_only=True) as s:
+        return _instances_for_monitoring(s)
+
+async def list_all_instances_for_monitoring_async():
+    """list_all_instances_for_monitoring 的异步版本"""
+    return await asyncdb.run_read(_instances_for_monitoring)
+
+def iter_all_instances_for_monitoring():
+    """list_all_instances_for_monitoring 的流式版本"""
+    for s, batch in _stream_batches(_MONITOR_QUERY):
+        yield from _monitor_rows(s, batch)
+
+def _instance_detail(s: Session, instance_id: str, requester: str):
+    inst, tasks, archived = archive.find_instance(s, instance_id)
+    if not inst:
+        return None
+    tpl = s.get(ProcessTemplate, inst.template_id)
+    history = []
+    for t in tasks:
+        # 获取节点名称
+        node_name = t.node_id
+        if tpl and tpl.definition:
+            node = next((n for n in tpl.definition.get("nodes", []) if n.get("id") == t.node_id), None)
+            if node and node.get("meta", {}).get("name"):
+                node_name = node.get("meta", {}).get("name")
+        history.append({
+            "id": t.id,
+            "node_id": t.node_id,
+            "node_name": node_name,
+            "assignee": t.assignee,
+            "status": t.status,
+            "opinion": t.opinion,
+            "assigned_at": t.assigned_at.isoformat() if t.assigned_at else None,
+            "finished_at": t.finished_at.isoformat() if t.finished_at else None,
+        })
+    current_task = next((t for t in tasks if t.status == "pending"), None)
+    current_node_name = inst.current_node
+    if inst.current_node and tpl and tpl.definition:
+        node = next((n for n in tpl.definition.get("nodes", []) if n.get("id") == inst.current_node), None)
+        if node and node.get("meta", {}).get("name"):
+            current_node_name = node.get("meta", {}).get("name")
+    return {
+        "id": inst.id,
+        "template_id": inst.template_id,
+        "template_name": tpl.name if tpl else None,
+        "template_definition": tpl.definition if tpl else None,
+        "title": inst.title,
+        "status": inst.status,
+        "current_node": inst.current_node,
+        "current_node_name": current_node_name,
+        "current_assignee": current_task.assignee if current_task else None,
+        "started_by": inst.started_by,
+        "started_at": inst.started_at.isoformat() if inst.started_at else None,
+        "ended_at": inst.ended_at.isoformat() if inst.ended_at else None,
+        "data": inst.data,
+        "history": history,
+        "archived": archived,
+    }
 
-def get_dashboard_stats(username: str, role: str = "user", department: Optional[str] = None):
-    from datetime import datetime, timezone, timedelta, date
-    tz = timezone(timedelta(hours=8))
-    today = datetime.now(tz).date()
+def get_instance_detail(instance_id: str, requester: str, session: Optional[Session] = None):
+    with _session(session) as s:
+        return _instance_detail(s, instance_id, requester)
+
+async def get_instance_detail_async(instance_id: str, requester: str):
+    """get_instance_detail 的异步版本"""
+    return await asyncdb.run(_instance_detail, instance_id, requester)
+
+def _dashboard_stats(s: Session, username: str, role: str = "user", department: Optional[str] = None,
+                     department_id: Optional[int] = None):
+    today = datetime.now(LOCAL_TZ).date()
     view_scope = "self"
     target_department = None
     if role in ("admin", "company_admin"):
         view_scope = "all"
-    elif role == "dept_admin" and department:
+    elif role == "dept_admin" and (department or department_id):
         view_scope = "department"
         target_department = department
     
-    with Session(engine) as s:
-        # 统计我发起的流程状态
-        rows = s.exec(
-            select(ProcessInstance.status, func.count(ProcessInstance.id))
-            .where(ProcessInstance.started_by == username)
-            .group_by(ProcessInstance.status)
-        ).all()
-        stats = {"running": 0, "approved": 0, "rejected": 0}
-        total = 0
-        for row in rows:
-            status, count = row
-            if status in stats:
-                stats[status] = count
-            else:
-                # 未知状态归为 running
-                stats["running"] += count
-            total += count
+    # 统计我发起的流程状态
+    rows = s.exec(
+        select(ProcessInstance.status, func.count(ProcessInstance.id))
+        .where(ProcessInstance.started_by == username)
+        .group_by(ProcessInstance.status)
+    ).all()
+    stats = {"running": 0, "approved": 0, "rejected": 0}
+    total = 0
+    # 已归档的流程同样计入
+    for row in [*rows, *archive.status_counts(s, username)]:
+        status, count = row
+        if status in stats:
+            stats[status] += count
+        else:
+            # 未知状态归为 running
+            stats["running"] += count
+        total += count
 
-        # 统计当前用户个人待办
+    # 统计当前用户个人待办（截止日期取自实例投影列，在 SQL 中完成计数）
+    due_counts = (
+        func.count(Task.id),
+        func.sum(case((ProcessInstance.due_date == today, 1), else_=0)),
+        func.sum(case((ProcessInstance.due_date < today, 1), else_=0)),
+    )
+    try:
+        pending_tasks, today_tasks, overdue_tasks = s.exec(
+            select(*due_counts)
+            .select_from(Task)
+            .outerjoin(ProcessInstance, ProcessInstance.id == Task.instance_id)
+            .where(Task.assignee == username, Task.status == "pending")
+        ).one()
+        today_tasks = today_tasks or 0
+        overdue_tasks = overdue_tasks or 0
+    except Exception as e:
+        print(f"Error counting personal pending tasks: {e}")
+        import traceback
+        traceback.print_exc()
+        pending_tasks = 0
+        today_tasks = 0
+        overdue_tasks = 0
+    
+    # 统计管理员/部门管理员视图下的用户汇总
+    summary_map = {}
+    user_summary = []
+    if view_scope in ("all", "department"):
         try:
-            personal_tasks = s.exec(
-                select(Task).where(Task.assignee == username, Task.status == "pending")
-            ).all()
-            pending_tasks = len(personal_tasks)
-            today_tasks = 0
-            overdue_tasks = 0
-            for task in personal_tasks:
-                inst = s.get(ProcessInstance, task.instance_id)
-                if inst and inst.data and inst.data.get("due_date"):
-                    try:
-                        due_date_str = inst.data.get("due_date")
-                        if isinstance(due_date_str, str):
-                            due_date = datetime.strptime(due_date_str, "%Y-%m-%d").date()
-                        elif isinstance(due_date_str, date):
-                            due_date = due_date_str
-                        else:
-                            continue
-                        if due_date == today:
-                            today_tasks += 1
-                        elif due_date < today:
-                            overdue_tasks += 1
-                    except (ValueError, TypeError):
-                        continue
+            agg_query = (
+                select(Task.assignee, *due_counts)
+                .select_from(Task)
+                .outerjoin(ProcessInstance, ProcessInstance.id == Task.instance_id)
+                .where(Task.status == "pending")
+                .group_by(Task.assignee)
+            )
+            if view_scope == "all":
+                user_records = s.exec(select(User)).all()
+            else:
+                dept_filter = user_department_filter(department_id, target_department)
+                user_records = s.exec(select(User).where(dept_filter)).all()
+                agg_query = agg_query.where(Task.assignee.in_(select(User.username).where(dept_filter)))
+            user_map = {u.username: u for u in user_records}
+            for uname, user_info in user_map.items():
+                summary_map[uname] = {
+                    "username": uname,
+                    "display_name": user_info.display_name or uname,
+                    "department": user_info.department or "",
+                    "role": user_info.role or "user",
+                    "total_pending": 0,
+                    "today_tasks": 0,
+                    "overdue_tasks": 0,
+                }
+            for assignee, pending, due_today, overdue in s.exec(agg_query).all():
+                entry = summary_map.get(assignee)
+                if not entry:
+                    continue
+                entry["total_pending"] = pending
+                entry["today_tasks"] = due_today or 0
+                entry["overdue_tasks"] = overdue or 0
+            user_summary = sorted(summary_map.values(), key=lambda x: x["total_pending"], reverse=True)
         except Exception as e:
-            print(f"Error counting personal pending tasks: {e}")
+            print(f"Error counting aggregated tasks: {e}")
             import traceback
             traceback.print_exc()
-            pending_tasks = 0
-            today_tasks = 0
-            overdue_tasks = 0
-        
-        # 统计管理员/部门管理员视图下的用户汇总
-        summary_map = {}
-        user_summary = []
-        if view_scope in ("all", "department"):
-            try:
-                if view_scope == "all":
-                    agg_tasks = s.exec(select(Task).where(Task.status == "pending")).all()
-                    user_records = s.exec(select(User)).all()
-                else:
-                    user_records = s.exec(
-                        select(User).where(User.department == target_department)
-                    ).all()
-                    dept_usernames = [u.username for u in user_records]
-                    if dept_usernames:
-                        agg_tasks = s.exec(
-                            select(Task).where(
-                                Task.status == "pending",
-                                Task.assignee.in_(dept_usernames)
-                            )
-                        ).all()
-                    else:
-                        agg_tasks = []
-                user_map = {u.username: u for u in user_records}
-                for uname, user_info in user_map.items():
-                    summary_map[uname] = {
-                        "username": uname,
-                        "display_name": user_info.display_name or uname,
-                        "department": user_info.department or "",
-                        "role": user_info.role or "user",
-                        "total_pending": 0,
-                        "today_tasks": 0,
-                        "overdue_tasks": 0,
-                    }
-                for task in agg_tasks:
-                    entry = summary_map.get(task.assignee)
-                    if not entry:
-                        continue
-                    entry["total_pending"] += 1
-                    inst = s.get(ProcessInstance, task.instance_id)
-                    if inst and inst.data and inst.data.get("due_date"):
-                        try:
-                            due_date_str = inst.data.get("due_date")
-                            if isinstance(due_date_str, str):
-                                due_date = datetime.strptime(due_date_str, "%Y-%m-%d").date()
-                            elif isinstance(due_date_str, date):
-                                due_date = due_date_str
-                            else:
-                                continue
-                            if due_date == today:
-                                entry["today_tasks"] += 1
-                            elif due_date < today:
-                                entry["overdue_tasks"] += 1
-                        except (ValueError, TypeError):
-                            continue
-                user_summary = sorted(summary_map.values(), key=lambda x: x["total_pending"], reverse=True)
-            except Exception as e:
-                print(f"Error counting aggregated tasks: {e}")
-                import traceback
-                traceback.print_exc()
-                user_summary = []
-        
-        return {
-            "instances": stats,
-            "instances_total": total,
-            "pending_tasks": pending_tasks or 0,
-            "today_tasks": today_tasks,
-            "overdue_tasks": overdue_tasks,
-            "view_scope": view_scope,
-            "view_department": target_department,
-            "user_summary": user_summary,
-        }
+            user_summary = []
+    
+    return {
+        "instances": stats,
+        "instances_total": total,
+        "pending_tasks": pending_tasks or 0,
+        "today_tasks": today_tasks,
+        "overdue_tasks": overdue_tasks,
+        "view_scope": view_scope,
+        "view_department": target_department,
+        "user_summary": user_summary,
+    }
+
+def get_dashboard_stats(username: str, role: str = "user", department: Optional[str] = None,
+                        department_id: Optional[int] = None, session: Optional[Session] = None):
+    with _session(session, read_only=True) as s:
+        return _dashboard_stats(s, username, role, department, department_id)
+
+async def get_dashboard_stats_async(username: str, role: str = "user", department: Optional[str] = None,
+                                    department_id: Optional[int] = None):
+    """get_dashboard_stats 的异步版本"""
+    return await asyncdb.run_read(_dashboard_stats, username, role, department, department_id)
+
+
+# --------------------------
+# 指标：抓取 /metrics 时计算的流程状态
+# --------------------------
+def _running_instance_gauge():
+    with Session(engine) as s:
+        count = s.exec(select(func.count(ProcessInstance.id)).where(ProcessInstance.status == "running")).one()
+    return {(): count}
+
+
+def _pending_task_gauge():
+    with Session(engine) as s:
+        rows = s.exec(
+            select(ProcessInstance.template_id, Task.node_id, func.count(Task.id))
+            .join(ProcessInstance, ProcessInstance.id == Task.instance_id)
+            .where(Task.status == "pending")
+            .group_by(ProcessInstance.template_id, Task.node_id)
+        ).all()
+    return {(tpl or "", node or ""): count for tpl, node, count in rows}
+
+
+metrics.Gauge("wf_instances_running", "Process instances in running status",
+              callback=metrics.CachedCollector(_running_instance_gauge))
+metrics.Gauge("wf_tasks_pending", "Pending tasks by template and node", ("template", "node"),
+              callback=metrics.CachedCollector(_pending_task_gauge))
+
+
+def search_all(q: str, username: str, role: str = "user", kind: Optional[str] = None, limit: int = 20, session: Optional[Session] = None):
+    """全文检索流程实例、审批意见与文档"""
+    with _session(session) as s:
+        return search.query(s, q, username, see_all=role in ("admin", "company_admin"), kind=kind, limit=limit)
+
+
+# --------------------------
+# 导出与流式列表（见 export.py、jsonstream.py）
+# --------------------------
+EXPORT_BATCH = 1000
+
+INSTANCE_EXPORT_HEADER = ["流程ID", "标题", "流程模板", "状态", "当前节点", "发起人", "发起时间", "结束时间",
+                          "优先级", "截止日期", "表单数据"]
+TASK_EXPORT_HEADER = ["任务ID", "流程ID", "流程标题", "流程状态", "流程模板", "节点", "处理人", "状态", "审批意见",
+                      "优先级", "标签", "预估工时", "截止日期", "分配时间", "完成时间"]
+AUDIT_EXPORT_HEADER = ["时间", "用户", "操作", "详情"]
+
+
+def _stream_batches(query, read_only: bool = True, size: int = EXPORT_BATCH):
+    """在独立会话中按批（yield_per，PostgreSQL 上为服务端游标）取出结果，逐批产出 (会话, 行列表)。
+    流式响应在请求级会话关闭后才发送，不能复用 get_session 的会话。会话的标识映射是弱引用，
+    未修改的对象在调用方丢弃该批后即被回收，内存不随行数增长"""
+    with _session(read_only=read_only) as s:
+        for batch in s.exec(query.execution_options(yield_per=size)).partitions():
+            yield s, batch
+
+
+def _stream_rows(query):
+    for s, batch in _stream_batches(query):
+        for row in batch:
+            yield s, row
+
+
+def iter_users():
+    """按创建时间倒序逐个产出用户，供 /api/users 的流式响应使用"""
+    for _, batch in _stream_batches(select(User).order_by(User.created_at.desc()), read_only=False):
+        yield from batch
+
+
+class _TemplateLookup:
+    """导出时按需加载模板（名称与节点名），每个模板只查一次"""
+
+    def __init__(self):
+        self._templates = {}
+
+    def get(self, s: Session, template_id: Optional[str]):
+        if not template_id:
+            return None
+        if template_id not in self._templates:
+            self._templates[template_id] = s.get(ProcessTemplate, template_id)
+        return self._templates[template_id]
+
+    def name(self, s: Session, template_id: Optional[str]):
+        tpl = self.get(s, template_id)
+        return tpl.name if tpl else None
+
+    def node_name(self, s: Session, template_id: Optional[str], node_id: Optional[str]):
+        tpl = self.get(s, template_id)
+        return _node_name(tpl.definition if tpl else None, node_id)
+
+
+def iter_instances_export(status: Optional[str] = None, keyword: Optional[str] = None, started_by: Optional[str] = None,
+                          due_from: Optional[date] = None, due_to: Optional[date] = None, include_archived: bool = False):
+    """逐行生成流程实例导出数据（列见 INSTANCE_EXPORT_HEADER），筛选条件与“我的流程”列表相同，
+    另可按发起人筛选；include_archived 时接着输出归档表中的流程"""
+    templates = _TemplateLookup()
+    for model in (ProcessInstance, ProcessInstanceArchive) if include_archived else (ProcessInstance,):
+        query = select(model.id, model.title, model.template_id, model.status, model.current_node, model.started_by,
+                       model.started_at, model.ended_at, model.priority, model.due_date, model.data)
+        if status:
+            query = query.where(model.status == status)
+        if keyword:
+            query = query.where(model.title.contains(keyword))
+        if started_by:
+            query = query.where(model.started_by == started_by)
+        if due_from:
+            query = query.where(model.due_date >= due_from)
+        if due_to:
+            query = query.where(model.due_date <= due_to)
+        for s, r in _stream_rows(query.order_by(model.started_at.desc())):
+            yield (r.id, r.title, templates.name(s, r.template_id), r.status,
+                   templates.node_name(s, r.template_id, r.current_node), r.started_by, iso_local(r.started_at),
+                   iso_local(r.ended_at), r.priority, r.due_date, r.data)
+
+
+def iter_tasks_export(labels: Optional[List[str]] = None, status: Optional[str] = None):
+    """逐行生成任务导出数据（含所属流程与模板列），筛选条件与管理员任务列表相同"""
+    templates = _TemplateLookup()
+    query = _filter_tasks(
+        select(Task.id, Task.instance_id, ProcessInstance.title, ProcessInstance.status.label("instance_status"),
+               ProcessInstance.template_id, Task.node_id, Task.assignee, Task.status, Task.opinion, Task.priority,
+               Task.labels, Task.estimate_hours, Task.due_date, Task.assigned_at, Task.finished_at)
+        .outerjoin(ProcessInstance, ProcessInstance.id == Task.instance_id),
+        labels, status,
+    )
+    for s, r in _stream_rows(query.order_by(Task.assigned_at.desc())):
+        yield (r.id, r.instance_id, r.title, r.instance_status, templates.name(s, r.template_id),
+               templates.node_name(s, r.template_id, r.node_id), r.assignee, r.status, r.opinion, r.priority,
+               r.labels or [], r.estimate_hours, r.due_date, iso_local(r.assigned_at), iso_local(r.finished_at))
+
+
+def filter_audit(query, user: Optional[str] = None, action: Optional[str] = None,
+                 since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """审计日志列表与导出共用的筛选：操作人、操作类型、时间范围 [since, until)"""
+    if user:
+        query = query.where(AuditLog.user == user)
+    if action:
+        query = query.where(AuditLog.action == action)
+    if since:
+        query = query.where(AuditLog.at >= since)
+    if until:
+        query = query.where(AuditLog.at < until)
+    return query
+
+
+def iter_audit_export(user: Optional[str] = None, action: Optional[str] = None,
+                      since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """逐行生成审计日志导出数据，按时间先后"""
+    query = filter_audit(select(AuditLog.at, AuditLog.user, AuditLog.action, AuditLog.detail), user, action, since, until)
+    for _, r in _stream_rows(query.order_by(AuditLog.at)):
+        yield (iso_local(r.at), r.user, r.action, r.detail)
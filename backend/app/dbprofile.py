@@ -0,0 +1,285 @@
+"""数据库连接配置
+
+SQLite 生产配置（WF_SQLITE_PROFILE=production，默认）：
+- 每个新连接执行 PRAGMA：journal_mode=WAL（读写互不阻塞）、synchronous=NORMAL（WAL 下只在检查点
+  fsync，断电可能丢失最近的提交但不会损坏数据库）、busy_timeout、cache_size、mmap_size、temp_store；
+- 写入排队：同一进程内的写事务按到达顺序逐个进入。连接执行第一条写语句前排队，事务提交或回滚后交给
+  下一个，线程之间不再争抢 SQLite 的写锁（busy handler 靠睡眠重试，既有额外延迟又不公平）。
+  多个 worker 进程之间仍靠 busy_timeout 等待。
+WF_SQLITE_PROFILE=default 保持 SQLAlchemy 的默认行为（回滚日志、无写入排队）。
+
+PostgreSQL：
+- 连接池大小、溢出与等待超时可配置（WF_DB_POOL_SIZE / WF_DB_MAX_OVERFLOW / WF_DB_POOL_TIMEOUT）；
+  每个 worker 各有一个池，总连接数约为 worker 数 ×（pool_size + max_overflow）；
+- 探活（WF_PG_PRE_PING）：always 每次取连接都 ping 一次；idle（默认）只对空闲超过
+  WF_PG_PING_IDLE_SECONDS 的连接 ping，失败则丢弃重连；off 不 ping。无论哪种，执行中遇到
+  断线错误时 SQLAlchemy 都会作废整个池，之后的请求使用新连接；
+- 安装了 psycopg（3.x）时同步引擎改用它，同一连接上执行 WF_PG_PREPARE_THRESHOLD 次的语句
+  自动转为服务端预编译语句；asyncpg 使用自身的语句缓存。经 PgBouncer 事务模式连接时设为 0 关闭；
+- statement_timeout：连接默认值 WF_PG_STATEMENT_TIMEOUT_MS；HTTP 请求按路由类别
+  （read / write / report）在事务开始时 SET LOCAL 各自的上限，与默认值相同时不额外发送；
+- application_name 为 “WF_PG_APPLICATION_NAME/进程号”，便于在 pg_stat_activity 中区分 worker。
+"""
+import importlib.util
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+
+from . import metrics
+from .config import (
+    SQLITE_PROFILE, SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_MB, SQLITE_MMAP_MB,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, PG_POOL_RECYCLE, PG_PRE_PING, PG_PING_IDLE_SECONDS,
+    PG_PREPARE_THRESHOLD, PG_STATEMENT_TIMEOUT_MS, PG_TIMEOUT_READ_MS, PG_TIMEOUT_WRITE_MS,
+    PG_TIMEOUT_REPORT_MS, PG_APPLICATION_NAME,
+)
+
+_WRITE_RE = re.compile(r"^\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|ALTER|DROP)\b", re.IGNORECASE)
+
+
+def is_write_statement(statement: str) -> bool:
+    return _WRITE_RE.match(statement) is not None
+
+
+SQLITE_WRITE_WAIT = metrics.Histogram(
+    "wf_sqlite_write_queue_wait_seconds", "Time a write transaction waited in the SQLite writer queue",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+
+
+def sqlite_pragmas():
+    return [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}",  # 负数单位为 KiB
+        f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+
+class WriteQueue:
+    """按到达顺序授予的互斥锁，持有者是底层 DBAPI 连接（同一连接内多条写语句只排一次队）"""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.owner = None
+        self._lock = threading.Lock()
+        self._waiters = deque()  # [(Event, 连接)]
+
+    def acquire(self, dbapi_conn) -> float:
+        with self._lock:
+            if self.owner is None and not self._waiters:
+                self.owner = dbapi_conn
+                return 0.0
+            waiter = (threading.Event(), dbapi_conn)
+            self._waiters.append(waiter)
+        start = time.perf_counter()
+        if not waiter[0].wait(self.timeout):
+            with self._lock:
+                # 超时的同时可能刚好被授予，此时照常继续
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise TimeoutError(f"waited more than {self.timeout:.0f}s for the SQLite writer queue")
+        return time.perf_counter() - start
+
+    def release(self, dbapi_conn):
+        with self._lock:
+            if self.owner is not dbapi_conn:
+                return
+            if self._waiters:
+                event_, self.owner = self._waiters.popleft()
+                event_.set()
+            else:
+                self.owner = None
+
+    def depth(self) -> int:
+        return len(self._waiters)
+
+
+_queues = []
+
+metrics.Gauge("wf_sqlite_write_queue_depth", "Write transactions waiting in the SQLite writer queue",
+              callback=lambda: {(): sum(q.depth() for q in _queues)})
+
+
+def _raw(conn):
+    # 池归还时 do_rollback 收到的是 _ConnectionFairy，其余时候是 DBAPI 连接本身
+    return getattr(conn, "dbapi_connection", conn)
+
+
+def _install_write_queue(engine):
+    queue = WriteQueue(SQLITE_BUSY_TIMEOUT_MS / 1000.0)
+    _queues.append(queue)
+
+    # 排在其它监听器（SQL 计时）之前，排队时间不计入语句耗时
+    @event.listens_for(engine, "before_cursor_execute", insert=True)
+    def _enter(conn, cursor, statement, parameters, context, executemany):
+        raw = conn.connection.dbapi_connection
+        if queue.owner is raw or not is_write_statement(statement):
+            return
+        SQLITE_WRITE_WAIT.observe(queue.acquire(raw))
+
+    # SQLAlchemy 的 commit/rollback 事件在真正提交之前触发，需在提交完成后才交出写锁，因此包装方言方法
+    dialect = engine.dialect
+    for name in ("do_commit", "do_rollback"):
+        original = getattr(dialect, name)
+
+        def wrapped(dbapi_conn, _original=original):
+            try:
+                _original(dbapi_conn)
+            finally:
+                queue.release(_raw(dbapi_conn))
+
+        setattr(dialect, name, wrapped)
+
+    # 兜底：连接归还或失效时仍持有则释放，避免队列卡死
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_conn, record):
+        if dbapi_conn is not None:
+            queue.release(dbapi_conn)
+
+    @event.listens_for(engine, "invalidate")
+    def _invalidate(dbapi_conn, record, exception):
+        if dbapi_conn is not None:
+            queue.release(dbapi_conn)
+
+
+def apply_sqlite_profile(engine, write_queue: bool = True):
+    """为 SQLite 引擎安装生产配置；异步引擎传 engine.sync_engine 且不启用写入排队（只用于读）"""
+    if SQLITE_PROFILE != "production":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_conn, record):
+        cursor = dbapi_conn.cursor()
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
+        cursor.close()
+
+    if write_queue:
+        _install_write_queue(engine)
+
+
+def pool_kwargs():
+    return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT}
+
+
+# --------------------------
+# PostgreSQL
+# --------------------------
+DB_DISCONNECTS = metrics.Counter("wf_db_disconnects_total", "Statements that failed because the connection was lost")
+DB_IDLE_PINGS = metrics.Counter("wf_db_idle_pings_total", "Liveness pings for connections idle past the threshold",
+                                ("result",))
+
+ROUTE_TIMEOUTS = {"read": PG_TIMEOUT_READ_MS, "write": PG_TIMEOUT_WRITE_MS, "report": PG_TIMEOUT_REPORT_MS}
+# 导出、报表、燃尽图、监控与全文检索扫描的数据量大，单独给较长的上限
+_REPORT_PATH_RE = re.compile(r"/(export|exports|report|reports|burndown|monitor|search)(/|$)")
+_statement_timeout: ContextVar[Optional[int]] = ContextVar("wf_statement_timeout", default=None)
+
+
+def pg_url(database_url: str):
+    """未指定驱动时，装了 psycopg 3 就用它（支持服务端预编译语句），否则沿用 psycopg2"""
+    url = make_url(database_url)
+    if url.drivername == "postgresql" and importlib.util.find_spec("psycopg") is not None:
+        url = url.set(drivername="postgresql+psycopg")
+    return url
+
+
+def pg_engine_kwargs(driver: str):
+    """同步与异步引擎共用的连接池与连接参数；driver 为 psycopg2 / psycopg / asyncpg"""
+    if driver == "asyncpg":
+        connect_args = {"timeout": 10, "ssl": "require", "server_settings": {}}
+        if PG_STATEMENT_TIMEOUT_MS:
+            connect_args["server_settings"]["statement_timeout"] = str(PG_STATEMENT_TIMEOUT_MS)
+        if not PG_PREPARE_THRESHOLD:
+            connect_args["statement_cache_size"] = 0
+    else:
+        connect_args = {"connect_timeout": 10, "sslmode": "require"}  # Supabase 需要 SSL
+        if PG_STATEMENT_TIMEOUT_MS:
+            connect_args["options"] = f"-c statement_timeout={PG_STATEMENT_TIMEOUT_MS}"
+        if driver == "psycopg":
+            connect_args["prepare_threshold"] = PG_PREPARE_THRESHOLD or None
+    return dict(
+        pool_kwargs(),
+        pool_recycle=PG_POOL_RECYCLE,
+        pool_pre_ping=PG_PRE_PING == "always",
+        connect_args=connect_args,
+    )
+
+
+def route_class(method: str, path: str) -> str:
+    if _REPORT_PATH_RE.search(path):
+        return "report"
+    return "read" if method in ("GET", "HEAD") else "write"
+
+
+class StatementTimeoutMiddleware:
+    """纯 ASGI 中间件：按路由类别记下本请求的 statement_timeout，由引擎在事务开始时设置"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = _statement_timeout.set(ROUTE_TIMEOUTS[route_class(scope["method"], scope["path"])])
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _statement_timeout.reset(token)
+
+
+def apply_pg_profile(engine):
+    """为 PostgreSQL 引擎安装 application_name、空闲探活、断线计数与按路由的 statement_timeout"""
+
+    @event.listens_for(engine, "do_connect")
+    def _tag_connection(dialect, conn_rec, cargs, cparams):
+        # 在建立连接时取进程号，fork 出的每个 worker 各不相同
+        name = f"{PG_APPLICATION_NAME}/{os.getpid()}"
+        if "server_settings" in cparams:
+            cparams["server_settings"] = dict(cparams["server_settings"], application_name=name)
+        else:
+            cparams["application_name"] = name
+
+    if PG_PRE_PING == "idle":
+        @event.listens_for(engine, "checkin")
+        def _mark_idle(dbapi_conn, record):
+            record.info["wf_checkin_at"] = time.monotonic()
+
+        @event.listens_for(engine, "checkout")
+        def _ping_if_idle(dbapi_conn, record, proxy):
+            last = record.info.get("wf_checkin_at")
+            if last is None or time.monotonic() - last < PG_PING_IDLE_SECONDS:
+                return
+            try:
+                engine.dialect.do_ping(dbapi_conn)
+            except Exception:
+                DB_IDLE_PINGS.inc(1, "failed")
+                # 抛出 DisconnectionError 时连接池丢弃该连接并重新获取（最多重试 3 次）
+                raise exc.DisconnectionError("idle connection failed the liveness ping")
+            DB_IDLE_PINGS.inc(1, "ok")
+
+    @event.listens_for(engine, "handle_error")
+    def _on_disconnect(context):
+        if context.is_disconnect:
+            DB_DISCONNECTS.inc()
+            print(f"[Database] connection lost, pool will reconnect: {context.original_exception}")
+
+    @event.listens_for(engine, "begin")
+    def _set_statement_timeout(conn):
+        timeout = _statement_timeout.get()
+        if timeout is None or timeout == PG_STATEMENT_TIMEOUT_MS:
+            return
+        # 直接用 DBAPI 游标执行，不经过 SQLAlchemy 的语句事件（不计入每请求 SQL 统计）
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.execute(f"SET LOCAL statement_timeout = {int(timeout)}")
+        finally:
+            cursor.close()
@@ -0,0 +1,198 @@
+"""内存诊断（仅供系统管理员）
+
+运行中开启/关闭 tracemalloc，拍快照并按文件或行号汇总、比较两次快照的差异，
+同时统计当前进程中各 SQLModel 表模型的实例数量，用于定位内存增长而无需重启进程。
+tracemalloc 开启期间每次分配都有额外开销，排查完应及时关闭。
+
+tracemalloc 状态与快照都只属于当前进程。生产模式多 worker 运行时（见 server.py）相邻的请求
+通常落在不同 worker 上，开启、拍快照、比较会作用于不同进程，因此排查时应以单 worker 启动
+（python run.py prod --workers 1 或 WF_WORKERS=1）。所有响应都带 pid，快照 id 形如
+“pid-序号”；请求的快照属于其它 worker 时抛出 OtherWorkerError（接口返回 409）。
+"""
+import gc
+import os
+import threading
+import tracemalloc
+from datetime import datetime
+from typing import Optional
+
+from sqlmodel import SQLModel
+
+MAX_SNAPSHOTS = 5
+GROUP_BY = ("filename", "lineno", "traceback")
+
+_snapshots = {}  # 序号 -> (created_at, label, Snapshot)，按插入顺序淘汰
+_next_id = 1
+_lock = threading.Lock()
+
+# tracemalloc 自身与导入机制的分配没有排查价值
+_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class OtherWorkerError(Exception):
+    """快照由另一个 worker 进程创建，当前进程中不存在"""
+
+
+def _snapshot_id(seq: int) -> str:
+    return f"{os.getpid()}-{seq}"
+
+
+def _parse_id(snapshot_id: str) -> int:
+    """校验快照 id 属于当前进程，返回进程内序号"""
+    pid, _, seq = str(snapshot_id).partition("-")
+    if not (pid.isdigit() and seq.isdigit()):
+        raise ValueError("快照 id 格式应为 pid-序号")
+    if int(pid) != os.getpid():
+        raise OtherWorkerError(f"快照 {snapshot_id} 属于 worker 进程 {pid}，当前请求由进程 {os.getpid()} 处理；"
+                               "请以单 worker 运行后重试")
+    return int(seq)
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # 非 Linux 只能拿到峰值；macOS 单位为字节，其它为 KB
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+    except Exception:
+        return None
+
+
+def status():
+    current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    with _lock:
+        snapshots = [
+            {"id": _snapshot_id(seq), "created_at": created.isoformat(timespec="seconds"), "label": label}
+            for seq, (created, label, _) in _snapshots.items()
+        ]
+    return {
+        "pid": os.getpid(),
+        "rss_bytes": _rss_bytes(),
+        "tracing": tracemalloc.is_tracing(),
+        "frames": tracemalloc.get_traceback_limit() if tracemalloc.is_tracing() else None,
+        "traced_current_bytes": current,
+        "traced_peak_bytes": peak,
+        "snapshots": snapshots,
+    }
+
+
+def start(frames: int = 1):
+    if not 1 <= frames <= 50:
+        raise ValueError("frames 需在 1~50 之间")
+    if tracemalloc.is_tracing():
+        raise ValueError("tracemalloc 已在运行")
+    tracemalloc.start(frames)
+    return status()
+
+
+def stop():
+    """停止跟踪并丢弃所有快照（快照本身占用大量内存）"""
+    global _snapshots
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    with _lock:
+        _snapshots = {}
+    return status()
+
+
+def take_snapshot(label: Optional[str] = None):
+    global _next_id
+    if not tracemalloc.is_tracing():
+        raise ValueError("请先开启 tracemalloc")
+    snapshot = tracemalloc.take_snapshot().filter_traces(_FILTERS)
+    with _lock:
+        seq = _next_id
+        _next_id += 1
+        _snapshots[seq] = (datetime.now(), label, snapshot)
+        while len(_snapshots) > MAX_SNAPSHOTS:
+            _snapshots.pop(next(iter(_snapshots)))
+    return {"id": _snapshot_id(seq), "pid": os.getpid(), "label": label,
+            "total_bytes": sum(stat.size for stat in snapshot.statistics("filename"))}
+
+
+def delete_snapshot(snapshot_id: str):
+    seq = _parse_id(snapshot_id)
+    with _lock:
+        if _snapshots.pop(seq, None) is None:
+            raise ValueError("快照不存在")
+
+
+def _get(snapshot_id: str):
+    seq = _parse_id(snapshot_id)
+    with _lock:
+        item = _snapshots.get(seq)
+    if item is None:
+        raise ValueError("快照不存在")
+    return item[2]
+
+
+def _check_group(group_by: str):
+    if group_by not in GROUP_BY:
+        raise ValueError(f"group_by 只能是 {'/'.join(GROUP_BY)}")
+
+
+def _trace_lines(traceback):
+    return [f"{frame.filename}:{frame.lineno}" for frame in traceback]
+
+
+def top(snapshot_id: str, group_by: str = "lineno", limit: int = 20):
+    """快照中占用内存最多的分配位置"""
+    _check_group(group_by)
+    stats = _get(snapshot_id).statistics(group_by)
+    return {
+        "pid": os.getpid(),
+        "total_bytes": sum(s.size for s in stats),
+        "top": [
+            {"where": _trace_lines(s.traceback), "size_bytes": s.size, "count": s.count}
+            for s in stats[:limit]
+        ],
+    }
+
+
+def diff(snapshot_id: str, base_id: str, group_by: str = "lineno", limit: int = 20):
+    """与基准快照相比增长最多的分配位置"""
+    _check_group(group_by)
+    stats = _get(snapshot_id).compare_to(_get(base_id), group_by)
+    return {
+        "pid": os.getpid(),
+        "size_diff_bytes": sum(s.size_diff for s in stats),
+        "top": [
+            {"where": _trace_lines(s.traceback), "size_bytes": s.size, "size_diff_bytes": s.size_diff,
+             "count": s.count, "count_diff": s.count_diff}
+            for s in stats[:limit]
+        ],
+    }
+
+
+def _table_models():
+    models, pending = set(), list(SQLModel.__subclasses__())
+    while pending:
+        cls = pending.pop()
+        if cls in models:
+            continue
+        models.add(cls)
+        pending.extend(cls.__subclasses__())
+    return {cls for cls in models if getattr(cls, "__table__", None) is not None}
+
+
+def model_counts(collect: bool = False):
+    """遍历 gc 跟踪的对象统计各表模型的存活实例数（耗时与堆大小成正比）；collect 时先做一次完整回收"""
+    if collect:
+        gc.collect()
+    models = _table_models()
+    counts = {cls.__name__: 0 for cls in models}
+    for obj in gc.get_objects():
+        cls = type(obj)
+        if cls in models:
+            counts[cls.__name__] += 1
+    return dict(sorted(counts.items(), key=lambda kv: (-kv[1], kv[0])))
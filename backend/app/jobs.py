@@ -0,0 +1,48 @@
+"""轻量后台定时任务
+
+在单独的守护线程中按固定间隔执行已注册的任务；任务自身需要是幂等的，
+失败只打印日志，不影响下一次调度。
+"""
+import threading
+import time
+import traceback
+
+_jobs = []  # [name, interval, fn, next_run]
+_stop = threading.Event()
+_thread = None
+
+
+def register(name: str, interval: float, fn, run_immediately: bool = True):
+    _jobs.append([name, interval, fn, 0 if run_immediately else time.monotonic() + interval])
+
+
+def _loop():
+    while not _stop.is_set():
+        now = time.monotonic()
+        for job in _jobs:
+            name, interval, fn, next_run = job
+            if now < next_run:
+                continue
+            try:
+                fn()
+            except Exception as e:
+                print(f"Job {name} failed: {e}")
+                traceback.print_exc()
+            job[3] = time.monotonic() + interval
+        wait = min((job[3] for job in _jobs), default=now + 60) - time.monotonic()
+        _stop.wait(max(1.0, wait))
+
+
+def start():
+    global _thread
+    if _thread and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="wf-jobs", daemon=True)
+    _thread.start()
+
+
+def stop(timeout: float = 5.0):
+    _stop.set()
+    if _thread:
+        _thread.join(timeout)
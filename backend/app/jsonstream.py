@@ -0,0 +1,81 @@
+"""大列表接口的流式 JSON 响应
+
+默认情况下列表接口先把 ORM 对象全部取出、再转成 dict 列表、最后由 FastAPI 一次性序列化，峰值内存约为
+响应体的三倍，且要等全部算完才开始发送。请求带 ?stream=json（或 stream=1）时改为边查边发：
+crud 中的 iter_* 生成器按批（yield_per）取数并转换，这里逐行编码，攒够 CHUNK_BYTES 就发送。
+
+- stream=json：普通 JSON 数组，内容与非流式响应相同，客户端无需改动；
+- stream=ndjson 或 Accept: application/x-ndjson：每行一个 JSON 对象，客户端可以逐行解析。
+
+编码优先使用 orjson（未安装时退回标准库 json）。响应开始发送后再出错只能中断连接，
+客户端会收到不完整的 JSON，据此判断失败。
+"""
+import json
+from typing import Iterable, Iterator, Optional
+
+from fastapi.responses import StreamingResponse
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+CHUNK_BYTES = 64 * 1024
+MODES = ("json", "ndjson")
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def encoder() -> str:
+    return "orjson" if orjson is not None else "json"
+
+
+def stream_mode(stream: Optional[str], accept: Optional[str] = None) -> Optional[str]:
+    """由 stream 查询参数与 Accept 请求头决定输出方式，返回 None 表示普通（非流式）响应"""
+    if stream:
+        stream = stream.lower()
+        if stream in MODES:
+            return stream
+        if stream in ("1", "true", "yes"):
+            return "json"
+    if accept and NDJSON_MEDIA_TYPE in accept:
+        return "ndjson"
+    return None
+
+
+def array_chunks(items: Iterable) -> Iterator[bytes]:
+    buf = bytearray(b"[")
+    first = True
+    for item in items:
+        if not first:
+            buf += b","
+        first = False
+        buf += dumps(item)
+        if len(buf) >= CHUNK_BYTES:
+            yield bytes(buf)
+            buf.clear()
+    buf += b"]"
+    yield bytes(buf)
+
+
+def ndjson_chunks(items: Iterable) -> Iterator[bytes]:
+    buf = bytearray()
+    for item in items:
+        buf += dumps(item)
+        buf += b"\n"
+        if len(buf) >= CHUNK_BYTES:
+            yield bytes(buf)
+            buf.clear()
+    if buf:
+        yield bytes(buf)
+
+
+def response(items: Iterable, mode: str) -> StreamingResponse:
+    if mode == "ndjson":
+        return StreamingResponse(ndjson_chunks(items), media_type=NDJSON_MEDIA_TYPE)
+    return StreamingResponse(array_chunks(items), media_type="application/json")
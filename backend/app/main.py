@@ -1,15 +1,57 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Query, Header
+from fastapi.responses import HTMLResponse, FileResponse, PlainTextResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from sqlmodel import Session, select
-from typing import Optional
-from . import crud, models, schemas, auth, storage, workflow
+from typing import Optional, List
+from datetime import date, datetime
+from contextlib import asynccontextmanager
+from . import crud, models, schemas, auth, storage, workflow, search, jobs, metrics, querylog, profiling, diagnostics, asyncdb, dbprofile, replica, export, jsonstream
 from .utils import create_access_token, hash_password
-from .config import UPLOAD_FOLDER
+from .config import UPLOAD_FOLDER, CYCLE_SNAPSHOT_INTERVAL, METRICS_TOKEN, ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL
+from . import config
 import os
 
-app = FastAPI(title="Workflow Full - FastAPI")
+# 后台定时任务：迭代每日快照
+jobs.register("cycle_snapshot", CYCLE_SNAPSHOT_INTERVAL, crud.snapshot_cycles)
+# 已结束流程归档（WF_ARCHIVE_AFTER_DAYS > 0 时）
+if ARCHIVE_AFTER_DAYS > 0:
+    jobs.register("archive", ARCHIVE_INTERVAL, crud.archive_finished_instances, run_immediately=False)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """导入 app.main 不访问数据库也不写文件；建目录、迁移、后台任务都在这里完成。
+    AUTO_MIGRATE/JOBS_ENABLED 运行时读取，生产模式由主进程迁移后按 worker 改写"""
+    config.ensure_directories()
+    config.log_summary()
+    if config.AUTO_MIGRATE:
+        # init db and default admin
+        # 初始化失败不阻止服务启动
+        try:
+            crud.init_db()
+        except Exception as e:
+            print(f"Warning: Database initialization failed: {e}")
+            print("Service will continue to start, but database operations may fail.")
+    else:
+        search.detect(crud.engine)
+    print(f"[Database Config] Async read path: {asyncdb.describe()}")
+    print(f"[Database Config] Read replica: {replica.describe()}")
+    if config.JOBS_ENABLED:
+        jobs.start()
+    app.state.ready = True
+    yield
+    app.state.ready = False
+    jobs.stop()
+    await asyncdb.dispose()
+
+
+app = FastAPI(title="Workflow Full - FastAPI", lifespan=lifespan)
+# 启动完成前与优雅停止期间 /readyz 返回 503
+app.state.ready = False
+app.state.draining = False
+# 所有路由支持按需剖析（X-Profile 请求头或抽样），须在注册路由之前设置
+app.router.route_class = profiling.ProfiledRoute
 
 # 添加 CORS 支持
 app.add_middleware(
@@ -26,50 +68,137 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["*"],
 )
+# 请求计数/耗时/SQL 次数，放在最外层以覆盖 CORS 预检等所有请求
+app.add_middleware(metrics.MetricsMiddleware)
+# 每请求 SQL 统计（语句数/耗时/N+1 检测），需在指标中间件外层
+app.add_middleware(querylog.QueryLogMiddleware)
+# PostgreSQL 按路由类别（读/写/报表）设置 statement_timeout
+if crud.IS_POSTGRES:
+    app.add_middleware(dbprofile.StatementTimeoutMiddleware)
+# 只读副本的读己之写：记录请求是否写过主库
+if replica.enabled():
+    app.add_middleware(replica.ReplicaRoutingMiddleware)
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics(authorization: Optional[str] = Header(None)):
+    """Prometheus 文本格式指标；配置 WF_METRICS_TOKEN 后需携带 Bearer 令牌"""
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """存活探针：进程能响应即可。不查数据库，避免数据库故障时所有实例被反复重启"""
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+def readyz():
+    """就绪探针：启动完成、未在停止中，且数据库连接池可用"""
+    if app.state.draining or not app.state.ready:
+        status = "draining" if app.state.draining else "starting"
+        return JSONResponse(status_code=503, content={"status": status})
+    ok, detail = crud.check_database()
+    return JSONResponse(status_code=200 if ok else 503,
+                        content={"status": "ok" if ok else "unavailable", "database": detail})
+
+def _require_system_admin(cur: models.User):
+    if cur.role != "admin":
+        raise HTTPException(status_code=403, detail="仅系统管理员可访问")
+
+@app.get("/api/admin/profiles")
+def list_request_profiles(cur: models.User = Depends(auth.get_current_user)):
+    _require_system_admin(cur)
+    return profiling.list_profiles()
+
+@app.get("/api/admin/profiles/{name}")
+def download_request_profile(name: str, cur: models.User = Depends(auth.get_current_user)):
+    _require_system_admin(cur)
+    path = profiling.profile_path(name)
+    if not path:
+        raise HTTPException(status_code=404, detail="profile not found")
+    return FileResponse(path, filename=name, media_type="application/octet-stream")
+
+@app.get("/api/admin/diagnostics/memory")
+def memory_diagnostics(collect: bool = False, cur: models.User = Depends(auth.get_current_user)):
+    """进程 RSS、tracemalloc 状态与各表模型的存活实例数"""
+    _require_system_admin(cur)
+    return dict(diagnostics.status(), model_counts=diagnostics.model_counts(collect))
+
+@app.post("/api/admin/diagnostics/tracemalloc/start")
+def start_tracemalloc(frames: int = 1, cur: models.User = Depends(auth.get_current_user)):
+    _require_system_admin(cur)
+    try:
+        return diagnostics.start(frames)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-# init db and default admin
-# 延迟初始化，避免启动时连接失败导致服务无法启动
-try:
-    crud.init_db()
-except Exception as e:
-    print(f"Warning: Database initialization failed: {e}")
-    print("Service will continue to start, but database operations may fail.")
+@app.post("/api/admin/diagnostics/tracemalloc/stop")
+def stop_tracemalloc(cur: models.User = Depends(auth.get_current_user)):
+    _require_system_admin(cur)
+    return diagnostics.stop()
+
+@app.post("/api/admin/diagnostics/snapshots")
+def take_memory_snapshot(label: Optional[str] = None, cur: models.User = Depends(auth.get_current_user)):
+    _require_system_admin(cur)
+    try:
+        return diagnostics.take_snapshot(label)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/admin/diagnostics/snapshots/{snapshot_id}")
+def memory_snapshot_top(snapshot_id: str, group_by: str = "lineno", limit: int = Query(20, ge=1, le=500),
+                        base: Optional[str] = None, cur: models.User = Depends(auth.get_current_user)):
+    """快照中最大的分配位置；传 base 时返回相对该快照的增长"""
+    _require_system_admin(cur)
+    try:
+        if base is not None:
+            return diagnostics.diff(snapshot_id, base, group_by, limit)
+        return diagnostics.top(snapshot_id, group_by, limit)
+    except diagnostics.OtherWorkerError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/api/admin/diagnostics/snapshots/{snapshot_id}")
+def delete_memory_snapshot(snapshot_id: str, cur: models.User = Depends(auth.get_current_user)):
+    _require_system_admin(cur)
+    try:
+        diagnostics.delete_snapshot(snapshot_id)
+    except diagnostics.OtherWorkerError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"ok": True}
 
 # mount static frontend build (index.html should exist in app/static)
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 if os.path.isdir(static_dir):
     app.mount("/", StaticFiles(directory=static_dir, html=True), name="static")
 
-# mount uploads folder for avatars and files
-if os.path.exists(UPLOAD_FOLDER):
-    # 使用自定义的静态文件服务，确保正确的Content-Type
-    from fastapi.responses import FileResponse
-    from fastapi import Request
-    from pathlib import Path
-    
-    @app.get("/api/uploads/{file_path:path}")
-    async def serve_upload_file(file_path: str, request: Request):
-        """自定义静态文件服务，确保正确的Content-Type"""
-        full_path = os.path.join(UPLOAD_FOLDER, file_path)
-        if not os.path.exists(full_path) or not os.path.isfile(full_path):
-            from fastapi import HTTPException
-            raise HTTPException(status_code=404, detail="File not found")
-        return FileResponse(
-            full_path,
-            media_type=None,  # 让FastAPI自动检测
-            filename=os.path.basename(full_path)
-        )
+# serve uploads folder for avatars and files
+# 目录在启动时创建，路由始终注册；使用自定义的静态文件服务，确保正确的Content-Type
+@app.get("/api/uploads/{file_path:path}")
+async def serve_upload_file(file_path: str):
+    """自定义静态文件服务，确保正确的Content-Type"""
+    full_path = os.path.join(UPLOAD_FOLDER, file_path)
+    if not os.path.exists(full_path) or not os.path.isfile(full_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    return FileResponse(
+        full_path,
+        media_type=None,  # 让FastAPI自动检测
+        filename=os.path.basename(full_path)
+    )
 
 from fastapi.security import OAuth2PasswordRequestForm
 
 @app.post("/api/auth/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends()):
+def login(form_data: OAuth2PasswordRequestForm = Depends(), s: Session = Depends(crud.get_session)):
     try:
-        user = auth.authenticate_user(form_data.username, form_data.password)
+        user = auth.authenticate_user(form_data.username, form_data.password, session=s)
         if not user:
             raise HTTPException(status_code=400, detail="invalid credentials")
         token = create_access_token(user.username)
-        crud.write_audit(user.username, "login", {})
+        crud.write_audit(user.username, "login", {}, session=s)
         return {
             "access_token": token, 
             "token_type": "bearer", 
@@ -88,10 +217,10 @@ def login(form_data: OAuth2PasswordRequestForm = Depends()):
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.post("/api/auth/register")
-def register(data: schemas.UserRegister):
+def register(data: schemas.UserRegister, s: Session = Depends(crud.get_session)):
     try:
         # 检查用户名是否已存在
-        existing = crud.get_user_by_username(data.username)
+        existing = crud.get_user_by_username(data.username, session=s)
         if existing:
             raise HTTPException(status_code=400, detail="用户名已存在")
         
@@ -107,9 +236,10 @@ def register(data: schemas.UserRegister):
             username=data.username,
             password_hash=password_hash,
             display_name=data.username,
-            role="user"
+            role="user",
+            session=s,
         )
-        crud.write_audit(user.username, "register", {})
+        crud.write_audit(user.username, "register", {}, session=s)
         return {"message": "注册成功", "username": user.username}
     except HTTPException:
         raise
@@ -120,22 +250,21 @@ def register(data: schemas.UserRegister):
         raise HTTPException(status_code=500, detail=f"注册失败: {str(e)}")
 
 @app.post("/api/auth/reset-password")
-def reset_password(data: schemas.PasswordReset):
+def reset_password(data: schemas.PasswordReset, s: Session = Depends(crud.get_session)):
     try:
-        user = crud.get_user_by_username(data.username)
+        user = crud.get_user_by_username(data.username, session=s)
         if not user:
             raise HTTPException(status_code=404, detail="用户不存在")
         
         # 重置为默认密码 jlcl2025
         default_password = "jlcl2025"
         new_password_hash = hash_password(default_password)
-        with Session(crud.engine) as s:
-            db_user = s.get(models.User, user.id)
-            db_user.password_hash = new_password_hash
-            s.add(db_user)
-            s.commit()
+        db_user = s.get(models.User, user.id)
+        db_user.password_hash = new_password_hash
+        s.add(db_user)
+        s.flush()
         
-        crud.write_audit(user.username, "reset_password", {})
+        crud.write_audit(user.username, "reset_password", {}, session=s)
         return {"message": f"密码已重置为默认密码: {default_password}"}
     except HTTPException:
         raise
@@ -153,44 +282,46 @@ def me(user: models.User = Depends(auth.get_current_user)):
         "display_name": user.display_name, 
         "role": user.role, 
         "department": user.department,
+        "department_id": user.department_id,
         "title": user.title,
         "avatar": user.avatar,
         "created_at": user.created_at.isoformat() if user.created_at else None
     }
 
 @app.put("/api/users/me")
-def update_me(data: schemas.UserUpdate, user: models.User = Depends(auth.get_current_user)):
+def update_me(data: schemas.UserUpdate, user: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     try:
-        with Session(crud.engine) as s:
-            db_user = s.get(models.User, user.id)
-            if data.username is not None and data.username != db_user.username:
-                # 检查新用户名是否已存在
-                existing = crud.get_user_by_username(data.username)
-                if existing and existing.id != db_user.id:
-                    raise HTTPException(status_code=400, detail="Username already exists")
-                db_user.username = data.username
-            if data.display_name is not None:
-                db_user.display_name = data.display_name
-            if data.department is not None:
-                db_user.department = data.department
-            if data.title is not None:
-                db_user.title = data.title
-            if data.avatar is not None:
-                db_user.avatar = data.avatar
-            # 普通用户不能修改自己的角色
-            if data.role is not None and user.role in ("admin", "company_admin"):
-                db_user.role = data.role
-            s.add(db_user)
-            s.commit()
-            s.refresh(db_user)
+        # user 与 db_user 是请求级会话中的同一个对象，审计记录修改前的用户名
+        actor = user.username
+        db_user = s.get(models.User, user.id)
+        if data.username is not None and data.username != db_user.username:
+            # 检查新用户名是否已存在
+            existing = crud.get_user_by_username(data.username, session=s)
+            if existing and existing.id != db_user.id:
+                raise HTTPException(status_code=400, detail="Username already exists")
+            db_user.username = data.username
+        if data.display_name is not None:
+            db_user.display_name = data.display_name
+        if data.department is not None or data.department_id is not None:
+            crud.assign_user_department(s, db_user, name=data.department, department_id=data.department_id)
+        if data.title is not None:
+            db_user.title = data.title
+        if data.avatar is not None:
+            db_user.avatar = data.avatar
+        # 普通用户不能修改自己的角色
+        if data.role is not None and user.role in ("admin", "company_admin"):
+            db_user.role = data.role
+        s.add(db_user)
+        s.flush()
         
-        crud.write_audit(user.username, "update_profile", {})
+        crud.write_audit(actor, "update_profile", {}, session=s)
         return {
             "id": db_user.id,
             "username": db_user.username,
             "display_name": db_user.display_name,
             "role": db_user.role,
             "department": db_user.department,
+            "department_id": db_user.department_id,
             "title": db_user.title,
             "avatar": db_user.avatar,
             "created_at": db_user.created_at.isoformat() if db_user.created_at else None
@@ -204,7 +335,7 @@ def update_me(data: schemas.UserUpdate, user: models.User = Depends(auth.get_cur
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.post("/api/users/me/change-password")
-def change_password(data: schemas.PasswordChange, user: models.User = Depends(auth.get_current_user)):
+def change_password(data: schemas.PasswordChange, user: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     try:
         from .utils import verify_password
         # 验证旧密码
@@ -213,13 +344,12 @@ def change_password(data: schemas.PasswordChange, user: models.User = Depends(au
         
         # 更新密码
         new_password_hash = hash_password(data.new_password)
-        with Session(crud.engine) as s:
-            db_user = s.get(models.User, user.id)
-            db_user.password_hash = new_password_hash
-            s.add(db_user)
-            s.commit()
+        db_user = s.get(models.User, user.id)
+        db_user.password_hash = new_password_hash
+        s.add(db_user)
+        s.flush()
         
-        crud.write_audit(user.username, "change_password", {})
+        crud.write_audit(user.username, "change_password", {}, session=s)
         return {"message": "Password changed successfully"}
     except HTTPException:
         raise
@@ -230,7 +360,7 @@ def change_password(data: schemas.PasswordChange, user: models.User = Depends(au
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.post("/api/users/me/upload-avatar")
-def upload_avatar(file: UploadFile = File(...), user: models.User = Depends(auth.get_current_user)):
+def upload_avatar(file: UploadFile = File(...), user: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     try:
         # 确保 avatars 目录存在
         avatars_dir = os.path.join(UPLOAD_FOLDER, "avatars")
@@ -255,14 +385,12 @@ def upload_avatar(file: UploadFile = File(...), user: models.User = Depends(auth
         
         # 更新用户头像URL
         avatar_url = f"/api/uploads/avatars/{filename}"
-        with Session(crud.engine) as s:
-            db_user = s.get(models.User, user.id)
-            db_user.avatar = avatar_url
-            s.add(db_user)
-            s.commit()
-            s.refresh(db_user)
+        db_user = s.get(models.User, user.id)
+        db_user.avatar = avatar_url
+        s.add(db_user)
+        s.flush()
         
-        crud.write_audit(user.username, "upload_avatar", {})
+        crud.write_audit(user.username, "upload_avatar", {}, session=s)
         return {"avatar": db_user.avatar, "message": "Avatar uploaded successfully"}
     except Exception as e:
         import traceback
@@ -271,18 +399,18 @@ def upload_avatar(file: UploadFile = File(...), user: models.User = Depends(auth
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.post("/api/templates")
-def create_template(data: schemas.TemplateCreate, cur: models.User = Depends(auth.get_current_user)):
+def create_template(data: schemas.TemplateCreate, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     ok, err = workflow.validate_template(data.definition)
     if not ok:
         raise HTTPException(status_code=400, detail=err)
-    tpl = crud.create_template(data.name, data.definition, cur.username)
-    crud.write_audit(cur.username, "create_template", {"template_id": tpl.id})
+    tpl = crud.create_template(data.name, data.definition, cur.username, session=s)
+    crud.write_audit(cur.username, "create_template", {"template_id": tpl.id}, session=s)
     return tpl
 
 @app.get("/api/templates")
-def list_templates(cur: models.User = Depends(auth.get_current_user)):
+def list_templates(cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     try:
-        templates = crud.list_templates()
+        templates = crud.list_templates(session=s)
         # 确保 SQLModel 对象能正确序列化
         return [{"id": t.id, "name": t.name, "definition": t.definition, "created_by": t.created_by, "created_at": t.created_at.isoformat() if t.created_at else None} for t in templates]
     except Exception as e:
@@ -292,12 +420,12 @@ def list_templates(cur: models.User = Depends(auth.get_current_user)):
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.delete("/api/templates/{template_id}")
-def delete_template(template_id: str, cur: models.User = Depends(auth.get_current_user)):
+def delete_template(template_id: str, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     if cur.role not in ("admin", "company_admin", "dept_admin"):
         raise HTTPException(status_code=403, detail="仅管理员可删除模板")
     try:
-        crud.delete_template(template_id)
-        crud.write_audit(cur.username, "delete_template", {"template_id": template_id})
+        crud.delete_template(template_id, session=s)
+        crud.write_audit(cur.username, "delete_template", {"template_id": template_id}, session=s)
         return {"message": "模板已删除"}
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -308,29 +436,49 @@ def delete_template(template_id: str, cur: models.User = Depends(auth.get_curren
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.post("/api/instances/start")
-def start_instance(payload: schemas.StartInstance, cur: models.User = Depends(auth.get_current_user)):
+def start_instance(payload: schemas.StartInstance, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     try:
-        inst, task = crud.create_instance(payload.template_id, payload.data or {}, cur.username, payload.old_instance_id)
+        inst, task = crud.create_instance(payload.template_id, payload.data or {}, cur.username, payload.old_instance_id, session=s)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
-    crud.write_audit(cur.username, "start_instance", {"instance_id": inst.id})
+    crud.write_audit(cur.username, "start_instance", {"instance_id": inst.id}, session=s)
     return {
         "instance": inst,
         "first_task": task
     }
 
+# 以下高频只读接口为 async 端点，查询经 asyncdb 走异步驱动，不占用线程池（见 asyncdb.py）
 @app.get("/api/instances/mine")
-def list_my_instances(status: Optional[str] = None, cur: models.User = Depends(auth.get_current_user)):
-    instances = crud.list_instances_by_user(cur.username, status=status)
+async def list_my_instances(
+    status: Optional[str] = None,
+    q: Optional[str] = None,
+    due_from: Optional[date] = None,
+    due_to: Optional[date] = None,
+    stream: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    cur: models.User = Depends(auth.get_current_user_async),
+):
+    mode = jsonstream.stream_mode(stream, accept)
+    if mode:
+        rows = crud.iter_instances_by_user(cur.username, status=status, keyword=q, due_from=due_from, due_to=due_to)
+        return jsonstream.response(rows, mode)
+    instances = await crud.list_instances_by_user_async(cur.username, status=status, keyword=q, due_from=due_from, due_to=due_to)
     return instances
 
 @app.get("/api/instances/monitor")
-def monitor_instances(cur: models.User = Depends(auth.get_current_user)):
+async def monitor_instances(
+    stream: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    cur: models.User = Depends(auth.get_current_user_async),
+):
     """系统管理员任务监控：查看所有运行中任务的进程、负责人、停留时长"""
     if cur.role not in ("admin", "company_admin"):
         raise HTTPException(status_code=403, detail="仅系统管理员和公司管理员可访问")
+    mode = jsonstream.stream_mode(stream, accept)
+    if mode:
+        return jsonstream.response(crud.iter_all_instances_for_monitoring(), mode)
     try:
-        instances = crud.list_all_instances_for_monitoring()
+        instances = await crud.list_all_instances_for_monitoring_async()
         return instances
     except Exception as e:
         import traceback
@@ -339,51 +487,51 @@ def monitor_instances(cur: models.User = Depends(auth.get_current_user)):
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.get("/api/instances/{instance_id}")
-def get_instance_detail(instance_id: str, cur: models.User = Depends(auth.get_current_user)):
-    detail = crud.get_instance_detail(instance_id, cur.username)
+async def get_instance_detail(instance_id: str, cur: models.User = Depends(auth.get_current_user_async)):
+    detail = await crud.get_instance_detail_async(instance_id, cur.username)
     if not detail:
         raise HTTPException(status_code=404, detail="Instance not found")
     return detail
 
 @app.get("/api/tasks/todo")
-def get_todo(cur: models.User = Depends(auth.get_current_user)):
-    tasks = crud.get_tasks_for_user(cur.username)
+async def get_todo(cur: models.User = Depends(auth.get_current_user_async)):
+    tasks = await crud.get_tasks_for_user_async(cur.username)
     return tasks
 
 @app.post("/api/tasks/{task_id}/complete")
-def complete_task(task_id: str, payload: schemas.CompleteTask, cur: models.User = Depends(auth.get_current_user)):
+def complete_task(task_id: str, payload: schemas.CompleteTask, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     try:
-        task, inst, new_task = crud.complete_task(task_id, cur.username, payload.decision, payload.opinion)
+        task, inst, new_task = crud.complete_task(task_id, cur.username, payload.decision, payload.opinion, session=s)
     except PermissionError as e:
         raise HTTPException(status_code=403, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
-    crud.write_audit(cur.username, "complete_task", {"task_id": task_id, "decision": payload.decision})
+    crud.write_audit(cur.username, "complete_task", {"task_id": task_id, "decision": payload.decision}, session=s)
     return {"task": task, "instance": inst, "new_task": new_task}
 
 @app.post("/api/docs/upload")
-def upload_doc(title: str = Form(...), file: UploadFile = File(...), cur: models.User = Depends(auth.get_current_user)):
+def upload_doc(title: str = Form(...), file: UploadFile = File(...), cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     dest = storage.save_upload_file(file)
-    doc = crud.save_document(title, dest, cur.username)
-    crud.write_audit(cur.username, "upload_doc", {"doc_id": doc.id})
+    doc = crud.save_document(title, dest, cur.username, session=s)
+    crud.write_audit(cur.username, "upload_doc", {"doc_id": doc.id}, session=s)
     return doc
 
 @app.post("/api/docs/{doc_id}/publish")
-def publish_doc(doc_id: str, cur: models.User = Depends(auth.get_current_user)):
+def publish_doc(doc_id: str, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     try:
-        doc = crud.publish_document(doc_id)
+        doc = crud.publish_document(doc_id, session=s)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
-    crud.write_audit(cur.username, "publish_doc", {"doc_id": doc.id})
+    crud.write_audit(cur.username, "publish_doc", {"doc_id": doc.id}, session=s)
     return doc
 
 @app.get("/api/docs")
-def list_docs(cur: models.User = Depends(auth.get_current_user)):
-    return crud.list_documents()
+def list_docs(cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    return crud.list_documents(session=s)
 
 @app.get("/api/docs/{doc_id}/download")
-def download_doc(doc_id: str, cur: models.User = Depends(auth.get_current_user)):
-    doc = crud.get_document(doc_id)
+def download_doc(doc_id: str, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    doc = crud.get_document(doc_id, session=s)
     if not doc:
         raise HTTPException(status_code=404, detail="not found")
     file_path = doc.filename
@@ -395,19 +543,17 @@ def download_doc(doc_id: str, cur: models.User = Depends(auth.get_current_user))
 
 
 @app.post("/api/standard-docs/upload")
-def upload_standard_doc(title: str = Form(...), file: UploadFile = File(...), cur: models.User = Depends(auth.get_current_user)):
+def upload_standard_doc(title: str = Form(...), file: UploadFile = File(...), cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     """标准文档上传：所有登录用户可上传"""
     try:
         dest = storage.save_upload_file(file)
-        doc = crud.save_document(title, dest, cur.username)
+        doc = crud.save_document(title, dest, cur.username, session=s)
         # 标准文档用 status 标记为 'standard'
-        with Session(crud.engine) as s:
-            db_doc = s.get(models.Document, doc.id)
-            db_doc.status = "standard"
-            s.add(db_doc)
-            s.commit()
-            s.refresh(db_doc)
-        crud.write_audit(cur.username, "upload_standard_doc", {"doc_id": doc.id})
+        db_doc = s.get(models.Document, doc.id)
+        db_doc.status = "standard"
+        s.add(db_doc)
+        s.flush()
+        crud.write_audit(cur.username, "upload_standard_doc", {"doc_id": doc.id}, session=s)
         return {
             "id": db_doc.id,
             "title": db_doc.title,
@@ -423,41 +569,39 @@ def upload_standard_doc(title: str = Form(...), file: UploadFile = File(...), cu
 
 
 @app.get("/api/standard-docs")
-def list_standard_docs(cur: models.User = Depends(auth.get_current_user)):
+def list_standard_docs(cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     """标准文档列表：所有登录用户可查看"""
-    with Session(crud.engine) as s:
-        docs = s.exec(
-            select(models.Document)
-            .where(models.Document.status == "standard")
-            .order_by(models.Document.uploaded_at.desc())
-        ).all()
-        return [
-            {
-                "id": d.id,
-                "title": d.title,
-                "filename": d.filename,
-                "uploaded_by": d.uploaded_by,
-                "uploaded_at": d.uploaded_at.isoformat() if d.uploaded_at else None,
-            }
-            for d in docs
-        ]
+    docs = s.exec(
+        select(models.Document)
+        .where(models.Document.status == "standard")
+        .order_by(models.Document.uploaded_at.desc())
+    ).all()
+    return [
+        {
+            "id": d.id,
+            "title": d.title,
+            "filename": d.filename,
+            "uploaded_by": d.uploaded_by,
+            "uploaded_at": d.uploaded_at.isoformat() if d.uploaded_at else None,
+        }
+        for d in docs
+    ]
 
 
 @app.put("/api/standard-docs/{doc_id}")
-def update_standard_doc(doc_id: str, title: str = Form(...), cur: models.User = Depends(auth.get_current_user)):
+def update_standard_doc(doc_id: str, title: str = Form(...), cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     """标准文档重命名：仅系统管理员和公司管理员"""
     if cur.role not in ("admin", "company_admin"):
         raise HTTPException(status_code=403, detail="admin only")
     try:
-        with Session(crud.engine) as s:
-            doc = s.get(models.Document, doc_id)
-            if not doc or doc.status != "standard":
-                raise HTTPException(status_code=404, detail="not found")
-            doc.title = title
-            s.add(doc)
-            s.commit()
-            s.refresh(doc)
-        crud.write_audit(cur.username, "update_standard_doc", {"doc_id": doc_id})
+        doc = s.get(models.Document, doc_id)
+        if not doc or doc.status != "standard":
+            raise HTTPException(status_code=404, detail="not found")
+        doc.title = title
+        s.add(doc)
+        search.index_document(s, doc)
+        s.flush()
+        crud.write_audit(cur.username, "update_standard_doc", {"doc_id": doc_id}, session=s)
         return {
             "id": doc.id,
             "title": doc.title,
@@ -472,26 +616,26 @@ def update_standard_doc(doc_id: str, title: str = Form(...), cur: models.User =
 
 
 @app.delete("/api/standard-docs/{doc_id}")
-def delete_standard_doc(doc_id: str, cur: models.User = Depends(auth.get_current_user)):
+def delete_standard_doc(doc_id: str, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     """标准文档删除：仅系统管理员和公司管理员"""
     if cur.role not in ("admin", "company_admin"):
         raise HTTPException(status_code=403, detail="admin only")
     try:
-        with Session(crud.engine) as s:
-            doc = s.get(models.Document, doc_id)
-            if not doc or doc.status != "standard":
-                raise HTTPException(status_code=404, detail="not found")
-            file_path = doc.filename
-            if not os.path.isabs(file_path):
-                file_path = os.path.join(UPLOAD_FOLDER, file_path)
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except Exception as e:
-                    print(f"Warning: failed to remove file {file_path}: {e}")
-            s.delete(doc)
-            s.commit()
-        crud.write_audit(cur.username, "delete_standard_doc", {"doc_id": doc_id})
+        doc = s.get(models.Document, doc_id)
+        if not doc or doc.status != "standard":
+            raise HTTPException(status_code=404, detail="not found")
+        file_path = doc.filename
+        if not os.path.isabs(file_path):
+            file_path = os.path.join(UPLOAD_FOLDER, file_path)
+        if os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+            except Exception as e:
+                print(f"Warning: failed to remove file {file_path}: {e}")
+        search.remove(s, "document", doc.id)
+        s.delete(doc)
+        s.flush()
+        crud.write_audit(cur.username, "delete_standard_doc", {"doc_id": doc_id}, session=s)
         return {"message": "deleted"}
     except HTTPException:
         raise
@@ -505,32 +649,32 @@ def delete_standard_doc(doc_id: str, cur: models.User = Depends(auth.get_current
 # 模块管理（管理员可见）
 # --------------------------
 @app.get("/api/modules")
-def list_modules(cur: models.User = Depends(auth.get_current_user)):
-    modules = crud.list_modules(cur.role, cur.username)
+def list_modules(cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    modules = crud.list_modules(cur.role, cur.username, session=s)
     return modules
 
 @app.post("/api/modules")
-def create_module(data: schemas.ModuleCreate, cur: models.User = Depends(auth.get_current_user)):
+def create_module(data: schemas.ModuleCreate, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     if cur.role not in ("admin", "company_admin", "dept_admin"):
         raise HTTPException(status_code=403, detail="仅管理员可创建模块")
-    m = crud.create_module(data.name, data.description, cur.username)
+    m = crud.create_module(data.name, data.description, cur.username, session=s)
     return m
 
 @app.put("/api/modules/{module_id}")
-def update_module(module_id: str, data: schemas.ModuleCreate, cur: models.User = Depends(auth.get_current_user)):
+def update_module(module_id: str, data: schemas.ModuleCreate, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     if cur.role not in ("admin", "company_admin", "dept_admin"):
         raise HTTPException(status_code=403, detail="仅管理员可编辑模块")
     try:
-        return crud.update_module(module_id, data.name, data.description)
+        return crud.update_module(module_id, data.name, data.description, session=s)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
 @app.delete("/api/modules/{module_id}")
-def delete_module(module_id: str, cur: models.User = Depends(auth.get_current_user)):
+def delete_module(module_id: str, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     if cur.role not in ("admin", "company_admin", "dept_admin"):
         raise HTTPException(status_code=403, detail="仅管理员可删除模块")
     try:
-        crud.delete_module(module_id)
+        crud.delete_module(module_id, session=s)
         return {"message": "已删除"}
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -540,8 +684,8 @@ def delete_module(module_id: str, cur: models.User = Depends(auth.get_current_us
 # 任务元数据更新
 # --------------------------
 @app.put("/api/tasks/{task_id}/meta")
-def update_task_meta(task_id: str, data: schemas.TaskMetaUpdate, cur: models.User = Depends(auth.get_current_user)):
-    task = crud.get_task(task_id)
+def update_task_meta(task_id: str, data: schemas.TaskMetaUpdate, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    task = crud.get_task(task_id, session=s)
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
     if cur.role not in ("admin", "company_admin") and task.assignee != cur.username:
@@ -554,6 +698,7 @@ def update_task_meta(task_id: str, data: schemas.TaskMetaUpdate, cur: models.Use
             module_id=data.module_id,
             estimate_hours=data.estimate_hours,
             due_date=data.due_date,
+            session=s,
         )
         return updated
     except Exception as e:
@@ -564,39 +709,86 @@ def update_task_meta(task_id: str, data: schemas.TaskMetaUpdate, cur: models.Use
 # 迭代（Cycles）
 # --------------------------
 @app.get("/api/cycles")
-def list_cycles(cur: models.User = Depends(auth.get_current_user)):
-    return crud.list_cycles(cur.role, cur.username)
+def list_cycles(cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    return crud.list_cycles(cur.role, cur.username, session=s)
 
 @app.post("/api/cycles")
-def create_cycle(data: schemas.CycleCreate, cur: models.User = Depends(auth.get_current_user)):
+def create_cycle(data: schemas.CycleCreate, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     if cur.role not in ("admin", "company_admin", "dept_admin"):
         raise HTTPException(status_code=403, detail="仅管理员可创建迭代")
-    return crud.create_cycle(data.name, data.start_date, data.end_date, data.goal, cur.username)
+    return crud.create_cycle(data.name, data.start_date, data.end_date, data.goal, cur.username, session=s)
 
 @app.get("/api/cycles/{cycle_id}")
-def get_cycle_detail(cycle_id: str, cur: models.User = Depends(auth.get_current_user)):
+def get_cycle_detail(
+    cycle_id: str,
+    page: int = 1,
+    page_size: int = 100,
+    status: Optional[str] = None,
+    cur: models.User = Depends(auth.get_current_user),
+    s: Session = Depends(crud.get_session),
+):
     if cur.role not in ("admin", "company_admin", "dept_admin"):
         raise HTTPException(status_code=403, detail="仅管理员可查看迭代")
-    detail = crud.get_cycle_detail(cycle_id)
+    detail = crud.get_cycle_detail(cycle_id, page=max(1, page), page_size=max(1, min(page_size, 500)), status=status, session=s)
     if not detail:
         raise HTTPException(status_code=404, detail="迭代不存在")
     return detail
 
+@app.get("/api/cycles/{cycle_id}/burndown")
+def get_cycle_burndown(cycle_id: str, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    """燃尽序列（来自每日快照）与各处理人容量/负载"""
+    if cur.role not in ("admin", "company_admin", "dept_admin"):
+        raise HTTPException(status_code=403, detail="仅管理员可查看迭代")
+    burndown = crud.get_cycle_burndown(cycle_id, session=s)
+    if not burndown:
+        raise HTTPException(status_code=404, detail="迭代不存在")
+    return burndown
+
 @app.post("/api/cycles/{cycle_id}/tasks")
-def add_task_to_cycle(cycle_id: str, payload: schemas.CycleTaskAssign, cur: models.User = Depends(auth.get_current_user)):
+def add_task_to_cycle(cycle_id: str, payload: schemas.CycleTaskAssign, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     if cur.role not in ("admin", "company_admin", "dept_admin"):
         raise HTTPException(status_code=403, detail="仅管理员可分配任务到迭代")
     try:
-        crud.assign_task_to_cycle(cycle_id, payload.task_id)
+        crud.assign_task_to_cycle(cycle_id, payload.task_id, session=s)
         return {"message": "已加入迭代"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.post("/api/cycles/{cycle_id}/tasks/bulk")
+def bulk_add_tasks_to_cycle(cycle_id: str, payload: schemas.CycleTaskBulk, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    if cur.role not in ("admin", "company_admin", "dept_admin"):
+        raise HTTPException(status_code=403, detail="仅管理员可分配任务到迭代")
+    try:
+        added = crud.bulk_assign_tasks_to_cycle(cycle_id, payload.task_ids, session=s)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    crud.write_audit(cur.username, "cycle_bulk_add", {"cycle_id": cycle_id, "count": added}, session=s)
+    return {"added": added}
+
+@app.post("/api/cycles/{cycle_id}/tasks/bulk-remove")
+def bulk_remove_tasks_from_cycle(cycle_id: str, payload: schemas.CycleTaskBulk, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    if cur.role not in ("admin", "company_admin", "dept_admin"):
+        raise HTTPException(status_code=403, detail="仅管理员可操作")
+    removed = crud.bulk_remove_tasks_from_cycle(cycle_id, payload.task_ids, session=s)
+    crud.write_audit(cur.username, "cycle_bulk_remove", {"cycle_id": cycle_id, "count": removed}, session=s)
+    return {"removed": removed}
+
+@app.post("/api/cycles/{cycle_id}/tasks/move")
+def move_cycle_tasks(cycle_id: str, payload: schemas.CycleTaskMove, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    if cur.role not in ("admin", "company_admin", "dept_admin"):
+        raise HTTPException(status_code=403, detail="仅管理员可操作")
+    try:
+        moved = crud.move_tasks_between_cycles(cycle_id, payload.target_cycle_id, payload.task_ids, session=s)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    crud.write_audit(cur.username, "cycle_move_tasks", {"cycle_id": cycle_id, "target_cycle_id": payload.target_cycle_id, "count": moved}, session=s)
+    return {"moved": moved}
+
 @app.delete("/api/cycles/{cycle_id}/tasks/{task_id}")
-def remove_task_from_cycle(cycle_id: str, task_id: str, cur: models.User = Depends(auth.get_current_user)):
+def remove_task_from_cycle(cycle_id: str, task_id: str, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     if cur.role not in ("admin", "company_admin", "dept_admin"):
         raise HTTPException(status_code=403, detail="仅管理员可操作")
-    crud.remove_task_from_cycle(cycle_id, task_id)
+    crud.remove_task_from_cycle(cycle_id, task_id, session=s)
     return {"message": "已移除"}
 
 
@@ -604,96 +796,151 @@ def remove_task_from_cycle(cycle_id: str, task_id: str, cur: models.User = Depen
 # 管理员任务列表（用于分配迭代等）
 # --------------------------
 @app.get("/api/tasks")
-def list_all_tasks(cur: models.User = Depends(auth.get_current_user)):
+def list_all_tasks(
+    label: Optional[List[str]] = Query(None),
+    status: Optional[str] = None,
+    stream: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    cur: models.User = Depends(auth.get_current_user),
+    s: Session = Depends(crud.get_session),
+):
     if cur.role not in ("admin", "company_admin", "dept_admin"):
         raise HTTPException(status_code=403, detail="仅管理员可查看全部任务")
-    return crud.list_all_tasks_admin()
+    mode = jsonstream.stream_mode(stream, accept)
+    if mode:
+        return jsonstream.response(crud.iter_all_tasks_admin(labels=label, status=status), mode)
+    return crud.list_all_tasks_admin(labels=label, status=status, session=s)
+
+@app.get("/api/tasks/labels")
+def task_label_facets(
+    label: Optional[List[str]] = Query(None),
+    status: Optional[str] = None,
+    cur: models.User = Depends(auth.get_current_user),
+    s: Session = Depends(crud.get_session),
+):
+    """标签分面统计：在当前筛选条件下各标签的任务数"""
+    if cur.role not in ("admin", "company_admin", "dept_admin"):
+        raise HTTPException(status_code=403, detail="仅管理员可查看全部任务")
+    return {"items": crud.task_label_facets(labels=label, status=status, session=s)}
 
 
 # --------------------------
 # 保存视图（个人）
 # --------------------------
 @app.get("/api/views")
-def list_views(cur: models.User = Depends(auth.get_current_user)):
-    return crud.list_views(cur.username)
+def list_views(cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    return crud.list_views(cur.username, session=s)
 
 @app.post("/api/views")
-def create_view(data: schemas.SavedViewCreate, cur: models.User = Depends(auth.get_current_user)):
-    return crud.save_view(cur.username, data.name, data.filters)
+def create_view(data: schemas.SavedViewCreate, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    return crud.save_view(cur.username, data.name, data.filters, session=s)
+
+@app.get("/api/views/{view_id}/tasks")
+def run_view(view_id: str, page: int = 1, page_size: int = 50, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    """在服务端执行视图筛选，分页返回待办任务"""
+    page = max(1, page)
+    page_size = max(1, min(page_size, 200))
+    result = crud.run_view(view_id, cur.username, page=page, page_size=page_size, session=s)
+    if result is None:
+        raise HTTPException(status_code=404, detail="视图不存在")
+    return result
 
 @app.delete("/api/views/{view_id}")
-def delete_view(view_id: str, cur: models.User = Depends(auth.get_current_user)):
-    crud.delete_view(view_id, cur.username)
+def delete_view(view_id: str, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    crud.delete_view(view_id, cur.username, session=s)
     return {"message": "已删除"}
 
 @app.get("/api/dashboard/stats")
-def dashboard_stats(cur: models.User = Depends(auth.get_current_user)):
-    return crud.get_dashboard_stats(
+async def dashboard_stats(cur: models.User = Depends(auth.get_current_user_async)):
+    return await crud.get_dashboard_stats_async(
         username=cur.username,
         role=cur.role,
-        department=cur.department
+        department=cur.department,
+        department_id=cur.department_id,
     )
 
+def _user_row(u: models.User):
+    return {
+        "id": u.id,
+        "username": u.username,
+        "display_name": u.display_name,
+        "role": u.role,
+        "department": u.department,
+        "department_id": u.department_id,
+        "title": u.title,
+        "avatar": u.avatar,
+        "created_at": u.created_at.isoformat() if u.created_at else None
+    }
+
+def _user_page(limit: int, cursor: Optional[str], condition=None, row=_user_row, session: Optional[Session] = None):
+    """传入 limit 时使用游标分页，返回 {items, next_cursor}"""
+    try:
+        users, next_cursor = crud.list_users_page(max(1, min(limit, 500)), cursor, condition, session=session)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": [row(u) for u in users], "next_cursor": next_cursor}
+
 @app.get("/api/users")
-def list_users(cur: models.User = Depends(auth.get_current_user)):
-    """获取用户列表（仅管理员）"""
+def list_users(limit: Optional[int] = None, cursor: Optional[str] = None, stream: Optional[str] = None,
+               accept: Optional[str] = Header(None), cur: models.User = Depends(auth.get_current_user),
+               s: Session = Depends(crud.get_session)):
+    """获取用户列表（仅管理员）；不传 limit 时返回完整列表（兼容旧前端），可用 stream 流式返回"""
     if cur.role not in ("admin", "company_admin"):
         raise HTTPException(status_code=403, detail="admin only")
-    with Session(crud.engine) as s:
-        users = s.exec(select(models.User).order_by(models.User.created_at.desc())).all()
-        return [{
-            "id": u.id,
-            "username": u.username,
-            "display_name": u.display_name,
-            "role": u.role,
-            "department": u.department,
-            "title": u.title,
-            "avatar": u.avatar,
-            "created_at": u.created_at.isoformat() if u.created_at else None
-        } for u in users]
+    if limit:
+        return _user_page(limit, cursor, session=s)
+    mode = jsonstream.stream_mode(stream, accept)
+    if mode:
+        return jsonstream.response((_user_row(u) for u in crud.iter_users()), mode)
+    users = s.exec(select(models.User).order_by(models.User.created_at.desc())).all()
+    return [_user_row(u) for u in users]
+
+@app.get("/api/users/search")
+def search_users(q: str = "", limit: int = 10, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    """人员联想：用户名 / 显示名 / 拼音首字母前缀匹配"""
+    return crud.search_users(q, limit=max(1, min(limit, 50)), session=s)
 
 @app.put("/api/users/{user_id}")
-def update_user(user_id: str, data: schemas.UserUpdate, cur: models.User = Depends(auth.get_current_user)):
+def update_user(user_id: str, data: schemas.UserUpdate, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     """更新用户信息（仅管理员）"""
     if cur.role not in ("admin", "company_admin"):
         raise HTTPException(status_code=403, detail="admin only")
     try:
-        with Session(crud.engine) as s:
-            db_user = s.get(models.User, user_id)
-            if not db_user:
-                raise HTTPException(status_code=404, detail="User not found")
+        db_user = s.get(models.User, user_id)
+        if not db_user:
+            raise HTTPException(status_code=404, detail="User not found")
             
-            if data.username is not None and data.username != db_user.username:
-                # 检查新用户名是否已存在
-                existing = crud.get_user_by_username(data.username)
-                if existing and existing.id != db_user.id:
-                    raise HTTPException(status_code=400, detail="Username already exists")
-                db_user.username = data.username
-            if data.display_name is not None:
-                db_user.display_name = data.display_name
-            if data.department is not None:
-                db_user.department = data.department
-            if data.title is not None:
-                db_user.title = data.title
-            if data.role is not None:
-                # 验证角色值
-                if data.role not in ["user", "dept_admin", "admin", "company_admin"]:
-                    raise HTTPException(status_code=400, detail="Invalid role")
-                db_user.role = data.role
-            if data.avatar is not None:
-                db_user.avatar = data.avatar
+        if data.username is not None and data.username != db_user.username:
+            # 检查新用户名是否已存在
+            existing = crud.get_user_by_username(data.username, session=s)
+            if existing and existing.id != db_user.id:
+                raise HTTPException(status_code=400, detail="Username already exists")
+            db_user.username = data.username
+        if data.display_name is not None:
+            db_user.display_name = data.display_name
+        if data.department is not None or data.department_id is not None:
+            crud.assign_user_department(s, db_user, name=data.department, department_id=data.department_id)
+        if data.title is not None:
+            db_user.title = data.title
+        if data.role is not None:
+            # 验证角色值
+            if data.role not in ["user", "dept_admin", "admin", "company_admin"]:
+                raise HTTPException(status_code=400, detail="Invalid role")
+            db_user.role = data.role
+        if data.avatar is not None:
+            db_user.avatar = data.avatar
             
-            s.add(db_user)
-            s.commit()
-            s.refresh(db_user)
+        s.add(db_user)
+        s.flush()
         
-        crud.write_audit(cur.username, "update_user", {"user_id": user_id})
+        crud.write_audit(cur.username, "update_user", {"user_id": user_id}, session=s)
         return {
             "id": db_user.id,
             "username": db_user.username,
             "display_name": db_user.display_name,
             "role": db_user.role,
             "department": db_user.department,
+            "department_id": db_user.department_id,
             "title": db_user.title,
             "avatar": db_user.avatar,
             "created_at": db_user.created_at.isoformat() if db_user.created_at else None
@@ -712,61 +959,163 @@ def list_departments(cur: models.User = Depends(auth.get_current_user)):
         raise HTTPException(status_code=403, detail="permission denied")
     return {"items": crud.list_departments()}
 
+@app.get("/api/departments/tree")
+def list_department_tree(cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    """部门树节点（含 parent_id 与物化路径）"""
+    if cur.role not in ("admin", "company_admin", "dept_admin"):
+        raise HTTPException(status_code=403, detail="permission denied")
+    return {"items": crud.list_department_tree(session=s)}
+
+@app.post("/api/departments")
+def create_department(data: schemas.DepartmentCreate, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    if cur.role not in ("admin", "company_admin"):
+        raise HTTPException(status_code=403, detail="admin only")
+    if not data.name.strip():
+        raise HTTPException(status_code=400, detail="部门名称不能为空")
+    try:
+        dept = crud.create_department(data.name, data.parent_id, session=s)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    crud.write_audit(cur.username, "create_department", {"department_id": dept["id"]}, session=s)
+    return dept
+
+@app.put("/api/departments/{department_id}")
+def update_department(department_id: int, data: schemas.DepartmentUpdate, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    if cur.role not in ("admin", "company_admin"):
+        raise HTTPException(status_code=403, detail="admin only")
+    try:
+        dept = crud.update_department(department_id, name=data.name, parent_id=data.parent_id, move=data.move, session=s)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    crud.write_audit(cur.username, "update_department", {"department_id": department_id}, session=s)
+    return dept
+
+@app.delete("/api/departments/{department_id}")
+def delete_department(department_id: int, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    if cur.role not in ("admin", "company_admin"):
+        raise HTTPException(status_code=403, detail="admin only")
+    try:
+        crud.delete_department(department_id, session=s)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    crud.write_audit(cur.username, "delete_department", {"department_id": department_id}, session=s)
+    return {"message": "已删除"}
+
 @app.get("/api/users/options")
-def list_user_options(cur: models.User = Depends(auth.get_current_user)):
-    with Session(crud.engine) as s:
-        users = s.exec(select(models.User).order_by(models.User.display_name, models.User.username)).all()
-        return [{
-            "id": u.id,
-            "username": u.username,
-            "display_name": u.display_name or u.username,
-            "department": u.department,
-            "role": u.role or "user"
-        } for u in users]
+def list_user_options(cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    users = s.exec(select(models.User).order_by(models.User.display_name, models.User.username)).all()
+    return [{
+        "id": u.id,
+        "username": u.username,
+        "display_name": u.display_name or u.username,
+        "department": u.department,
+        "department_id": u.department_id,
+        "role": u.role or "user"
+    } for u in users]
 
 @app.get("/api/audit")
-def get_audit(cur: models.User = Depends(auth.get_current_user)):
+def get_audit(
+    user: Optional[str] = None,
+    action: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cur: models.User = Depends(auth.get_current_user),
+    s: Session = Depends(crud.get_session),
+):
     if cur.role not in ("admin", "company_admin"):
         raise HTTPException(status_code=403, detail="admin only")
-    with Session(crud.engine) as s:
-        logs = s.exec(select(models.AuditLog)).all()
+    with crud.read_session(s) as rs:
+        logs = rs.exec(crud.filter_audit(select(models.AuditLog), user, action, since, until)).all()
         return logs
 
 
+# --------------------------
+# 导出（CSV/XLSX 流式下载，见 export.py）
+# --------------------------
+def _export_format(format: str) -> str:
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format 仅支持 {'/'.join(export.FORMATS)}")
+    return format
+
+@app.get("/api/export/instances")
+def export_instances(
+    format: str = "csv",
+    status: Optional[str] = None,
+    q: Optional[str] = None,
+    started_by: Optional[str] = None,
+    due_from: Optional[date] = None,
+    due_to: Optional[date] = None,
+    archived: bool = False,
+    cur: models.User = Depends(auth.get_current_user),
+):
+    """导出流程实例；archived=true 时包含已归档的流程"""
+    if cur.role not in ("admin", "company_admin"):
+        raise HTTPException(status_code=403, detail="仅系统管理员和公司管理员可导出")
+    rows = crud.iter_instances_export(status, q, started_by, due_from, due_to, include_archived=archived)
+    return export.response(_export_format(format), "instances", crud.INSTANCE_EXPORT_HEADER, rows, "流程")
+
+@app.get("/api/export/tasks")
+def export_tasks(
+    format: str = "csv",
+    label: Optional[List[str]] = Query(None),
+    status: Optional[str] = None,
+    cur: models.User = Depends(auth.get_current_user),
+):
+    if cur.role not in ("admin", "company_admin", "dept_admin"):
+        raise HTTPException(status_code=403, detail="仅管理员可导出任务")
+    rows = crud.iter_tasks_export(labels=label, status=status)
+    return export.response(_export_format(format), "tasks", crud.TASK_EXPORT_HEADER, rows, "任务")
+
+@app.get("/api/export/audit")
+def export_audit(
+    format: str = "csv",
+    user: Optional[str] = None,
+    action: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cur: models.User = Depends(auth.get_current_user),
+):
+    if cur.role not in ("admin", "company_admin"):
+        raise HTTPException(status_code=403, detail="admin only")
+    rows = crud.iter_audit_export(user, action, since, until)
+    return export.response(_export_format(format), "audit", crud.AUDIT_EXPORT_HEADER, rows, "审计日志")
+
+
+@app.get("/api/search")
+def search_items(q: str, kind: Optional[str] = None, limit: int = 20, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
+    """全文检索：流程标题/表单内容、审批意见、文档标题"""
+    if kind and kind not in ("instance", "task", "document"):
+        raise HTTPException(status_code=400, detail="kind must be instance, task or document")
+    limit = max(1, min(limit, 100))
+    return {"items": crud.search_all(q, cur.username, cur.role, kind=kind, limit=limit, session=s)}
+
+
+def _hr_profile_row(u: models.User):
+    return {
+        "id": u.id,
+        "username": u.username,
+        "display_name": u.display_name,
+        "department": u.department,
+        "department_id": u.department_id,
+        "title": u.title,
+        "role": u.role or "user",
+        "avatar": u.avatar,
+        "created_at": u.created_at.isoformat() if u.created_at else None,
+    }
+
 @app.get("/api/hr/profiles")
-def list_hr_profiles(cur: models.User = Depends(auth.get_current_user)):
+def list_hr_profiles(limit: Optional[int] = None, cursor: Optional[str] = None, cur: models.User = Depends(auth.get_current_user), s: Session = Depends(crud.get_session)):
     """人事档案：公司管理员查看所有，部门管理员只看本部门"""
     if cur.role not in ("admin", "company_admin", "dept_admin"):
         raise HTTPException(status_code=403, detail="permission denied")
-    with Session(crud.engine) as s:
+    condition = None
+    if cur.role == "dept_admin" and (cur.department_id or cur.department):
+        condition = crud.user_department_filter(cur.department_id, cur.department)
+    if limit:
+        return _user_page(limit, cursor, condition, row=_hr_profile_row, session=s)
+    with crud.read_session(s) as rs:
         query = select(models.User).order_by(models.User.created_at.desc())
-        if cur.role == "dept_admin" and cur.department:
-            query = query.where(models.User.department == cur.department)
-        users = s.exec(query).all()
-        return [
-            {
-                "id": u.id,
-                "username": u.username,
-                "display_name": u.display_name,
-                "department": u.department,
-                "title": u.title,
-                "role": u.role or "user",
-                "avatar": u.avatar,
-                "created_at": u.created_at.isoformat() if u.created_at else None,
-            }
-            for u in users
-        ]
-
-@app.get("/api/instances/monitor")
-def monitor_instances(cur: models.User = Depends(auth.get_current_user)):
-    """系统管理员任务监控：查看所有运行中任务的进程、负责人、停留时长"""
-    if cur.role not in ("admin", "company_admin"):
-        raise HTTPException(status_code=403, detail="仅系统管理员和公司管理员可访问")
-    try:
-        instances = crud.list_all_instances_for_monitoring()
-        return instances
-    except Exception as e:
-        import traceback
-        print(f"Monitor instances error: {str(e)}")
-        print(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+        if condition is not None:
+            query = query.where(condition)
+        users = rs.exec(query).all()
+        return [_hr_profile_row(u) for u in users]
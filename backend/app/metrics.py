@@ -0,0 +1,291 @@
+"""进程内指标采集，按 Prometheus 文本格式输出
+
+每个指标自带一把锁，临界区只有一次字典查找和几次加法；HTTP 指标由纯 ASGI
+中间件记录，数据库连接池与 SQL 计数通过 SQLAlchemy 事件采集（每请求语句数取自 querylog），
+业务指标（运行中流程、各节点待办）在抓取时查询并短暂缓存。
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+from . import querylog
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """可直接 set/inc，也可以传入 callback 在抓取时取值（返回 {labels: value}）"""
+    kind = "gauge"
+
+    def __init__(self, *args, callback: Optional[Callable[[], Dict[Tuple, float]]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, amount: float = 1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount: float = 1, *labels):
+        self.inc(-amount, *labels)
+
+    def render(self) -> List[str]:
+        if self._callback is not None:
+            try:
+                items = list(self._callback().items())
+            except Exception as e:
+                print(f"Metrics callback {self.name} failed: {e}")
+                items = []
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values: Dict[Tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *labels):
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            state[idx] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {state[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {state[-1]}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        body = metric.render()
+        if body:
+            lines.extend(metric.header())
+            lines.extend(body)
+    return "\n".join(lines) + "\n"
+
+
+# --------------------------
+# HTTP
+# --------------------------
+HTTP_REQUESTS = Counter("wf_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("wf_http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+HTTP_IN_FLIGHT = Gauge("wf_http_requests_in_flight", "HTTP requests currently being served")
+DB_QUERIES_PER_REQUEST = Histogram(
+    "wf_db_queries_per_request", "SQL statements executed per HTTP request", ("route",),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件：不包装响应体，只在 http.response.start 时取状态码"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        # 语句统计由外层 QueryLogMiddleware 建立，这里只读取
+        stats = querylog.current()
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            # 只用路由模板作为标签，避免按实际路径产生无限多的时间序列
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            HTTP_REQUESTS.inc(1, method, path, str(status["code"]))
+            HTTP_LATENCY.observe(elapsed, method, path)
+            if stats is not None:
+                DB_QUERIES_PER_REQUEST.observe(stats.count, path)
+
+
+# --------------------------
+# 数据库
+# --------------------------
+DB_QUERIES = Counter("wf_db_queries_total", "SQL statements executed")
+DB_POOL_CHECKOUTS = Counter("wf_db_pool_checkouts_total", "Connections checked out of the pool")
+DB_POOL_WAIT = Histogram(
+    "wf_db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+
+_engines = []
+
+
+def _pool_stats() -> Dict[Tuple, float]:
+    values = {}
+    for name, engine in _engines:
+        pool = engine.pool
+        for stat in ("size", "checkedout", "overflow", "checkedin"):
+            fn = getattr(pool, stat, None)
+            if fn is not None:
+                try:
+                    values[(name, stat)] = fn()
+                except Exception:
+                    pass
+    return values
+
+
+DB_POOL = Gauge("wf_db_pool_connections", "Connection pool state (size/checkedout/overflow/checkedin)",
+                ("engine", "state"), callback=_pool_stats)
+
+
+# 取连接的开始时间。SQLAlchemy 没有“开始等待连接”的公开事件：在 engine.connect() 入口记下时间，
+# 由池的 checkout 事件计算等待时长。Session 与异步引擎（AsyncConnection 在 greenlet 中调用
+# sync_engine.connect()）都经过 engine.connect()。用 ContextVar 而不是线程局部变量：同一事件循环线程上的
+# 协程在 AsyncAdaptedQueuePool 上等待时会交替执行，每个任务（及其 greenlet）有自己的上下文，互不覆盖
+_checkout_started: ContextVar[Optional[float]] = ContextVar("wf_checkout_started", default=None)
+
+
+def _time_connect(engine):
+    original = engine.connect
+    if getattr(original, "_wf_timed", False):
+        return
+
+    @wraps(original)
+    def timed_connect(*args, **kwargs):
+        token = _checkout_started.set(time.perf_counter())
+        try:
+            return original(*args, **kwargs)
+        finally:
+            _checkout_started.reset(token)
+
+    timed_connect._wf_timed = True
+    engine.connect = timed_connect
+
+
+def instrument_engine(engine, name: str = "primary"):
+    _engines.append((name, engine))
+    _time_connect(engine)
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_conn, record, proxy):
+        DB_POOL_CHECKOUTS.inc()
+        started = _checkout_started.get()
+        if started is not None:
+            _checkout_started.set(None)
+            DB_POOL_WAIT.observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _on_execute(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERIES.inc()
+
+
+# --------------------------
+# 业务指标
+# --------------------------
+TASK_COMPLETION = Histogram(
+    "wf_task_completion_seconds", "Time from task assignment to completion", ("decision",),
+    buckets=(60, 300, 900, 3600, 4 * 3600, 8 * 3600, 86400, 3 * 86400, 7 * 86400),
+)
+
+
+class CachedCollector:
+    """抓取时执行的查询结果缓存 ttl 秒，避免频繁抓取压到数据库"""
+
+    def __init__(self, fn: Callable[[], Dict[Tuple, float]], ttl: float = 15.0):
+        self.fn = fn
+        self.ttl = ttl
+        self._value = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            if self._value is None or time.monotonic() >= self._expires:
+                self._value = self.fn()
+                self._expires = time.monotonic() + self.ttl
+            return self._value
@@ -1,11 +1,44 @@
 from typing import Optional, Dict, Any, List
 from datetime import datetime, timezone, timedelta, date
 from sqlmodel import SQLModel, Field
-from sqlalchemy import JSON
+from sqlalchemy import JSON, UniqueConstraint, Index, String
+from sqlalchemy.dialects import postgresql
+import secrets
+import threading
+import time
 import uuid
 
+_uuid7_lock = threading.Lock()
+_uuid7_last_ms = 0
+_uuid7_seq = 0
+
+
+def uuid7() -> uuid.UUID:
+    """RFC 9562 UUIDv7：高 48 位为毫秒时间戳，其后 12 位为同一毫秒内递增的序号，其余为随机数。
+    新行的主键按时间递增，插入总是落在索引末尾，不会像 UUID4 那样随机分裂 B-tree 页。
+    同一进程内严格单调（时钟回拨时沿用上一个时间戳继续递增）"""
+    global _uuid7_last_ms, _uuid7_seq
+    with _uuid7_lock:
+        ms = time.time_ns() // 1_000_000
+        if ms > _uuid7_last_ms:
+            _uuid7_last_ms = ms
+            _uuid7_seq = secrets.randbits(11)  # 随机起点，高位留出递增空间
+        else:
+            _uuid7_seq += 1
+            if _uuid7_seq > 0xFFF:
+                _uuid7_last_ms += 1
+                _uuid7_seq = 0
+        ms, seq = _uuid7_last_ms, _uuid7_seq
+    value = (ms << 80) | (0x7 << 76) | (seq << 64) | (0b10 << 62) | secrets.randbits(62)
+    return uuid.UUID(int=value)
+
+
 def gen_uuid():
-    return str(uuid.uuid4())
+    return str(uuid7())
+
+
+# PostgreSQL 上存为原生 uuid（16 字节），其它数据库仍为 36 字符文本；Python 侧始终是 str
+UUIDText = String().with_variant(postgresql.UUID(as_uuid=False), "postgresql")
 
 def local_now():
     """使用系统本地时间（无强制时区），避免重复转换造成偏移"""
@@ -17,16 +50,20 @@ class User(SQLModel, table=True):
     password_hash: str
     display_name: Optional[str] = None
     role: Optional[str] = "user"
-    department: Optional[str] = None
+    department: Optional[str] = None  # 部门名称（展示用），归属以 department_id 为准
+    department_id: Optional[int] = Field(default=None, foreign_key="department.id", index=True)
     title: Optional[str] = None  # 职称
     avatar: Optional[str] = None  # 头像URL
+    pinyin_initials: Optional[str] = Field(default=None, index=True)  # 显示名拼音首字母，供人员联想搜索
     disabled: bool = False
-    created_at: datetime = Field(default_factory=local_now)
+    created_at: datetime = Field(default_factory=local_now, index=True)
 
 class Department(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
     parent_id: Optional[int] = None
+    # 物化路径，如 "/1/4/"；子树查询使用路径前缀的范围条件
+    path: str = Field(default="", index=True)
 
 class ProcessTemplate(SQLModel, table=True):
     id: Optional[str] = Field(default_factory=gen_uuid, primary_key=True)
@@ -44,10 +81,16 @@ class ProcessInstance(SQLModel, table=True):
     started_by: Optional[str] = None
     started_at: datetime = Field(default_factory=local_now)
     ended_at: Optional[datetime] = None
+    # 以下字段从 data 中投影出来，便于在 SQL 中筛选/排序
+    title: Optional[str] = Field(default=None, index=True)
+    priority: Optional[str] = Field(default=None, index=True)
+    due_date: Optional[date] = Field(default=None, index=True)
 
 class Task(SQLModel, table=True):
+    # 待办查询（assignee + status）走联合索引
+    __table_args__ = (Index("ix_task_assignee_status", "assignee", "status"),)
     id: Optional[str] = Field(default_factory=gen_uuid, primary_key=True)
-    instance_id: str
+    instance_id: str = Field(index=True)
     node_id: str
     assignee: Optional[str] = None
     status: str = "pending"
@@ -60,6 +103,44 @@ class Task(SQLModel, table=True):
     estimate_hours: Optional[float] = None  # 预估工时
     due_date: Optional[date] = None  # 截止日期
 
+class ProcessInstanceArchive(SQLModel, table=True):
+    """已结束且超过保留期的流程实例（见 archive.py），列与 ProcessInstance 相同"""
+    __table_args__ = (Index("ix_processinstancearchive_started_by_status", "started_by", "status"),)
+    id: str = Field(primary_key=True)
+    template_id: str
+    data: Dict[str, Any] = Field(default_factory=dict, sa_type=JSON)
+    status: str
+    current_node: Optional[str] = None
+    started_by: Optional[str] = None
+    started_at: datetime
+    ended_at: Optional[datetime] = None
+    title: Optional[str] = None
+    priority: Optional[str] = None
+    due_date: Optional[date] = None
+    archived_at: datetime = Field(default_factory=local_now)
+
+class TaskArchive(SQLModel, table=True):
+    """归档实例的任务，列与 Task 相同；标签只保留 labels 列，不再写入 TaskLabel"""
+    id: str = Field(primary_key=True)
+    instance_id: str = Field(index=True)
+    node_id: str
+    assignee: Optional[str] = None
+    status: str
+    opinion: Optional[str] = None
+    assigned_at: datetime
+    finished_at: Optional[datetime] = None
+    priority: Optional[str] = None
+    labels: List[str] = Field(default_factory=list, sa_type=JSON)
+    module_id: Optional[str] = None
+    estimate_hours: Optional[float] = None
+    due_date: Optional[date] = None
+    archived_at: datetime = Field(default_factory=local_now)
+
+class TaskLabel(SQLModel, table=True):
+    """Task.labels 的规范化副本，按标签筛选/统计时走索引"""
+    task_id: str = Field(primary_key=True)
+    label: str = Field(primary_key=True, index=True)
+
 class Document(SQLModel, table=True):
     id: Optional[str] = Field(default_factory=gen_uuid, primary_key=True)
     title: str
@@ -70,7 +151,8 @@ class Document(SQLModel, table=True):
     uploaded_at: datetime = Field(default_factory=datetime.utcnow)
 
 class AuditLog(SQLModel, table=True):
-    id: Optional[str] = Field(default_factory=gen_uuid, primary_key=True)
+    # 没有其它表引用审计日志 id，可以直接使用原生 uuid 类型
+    id: Optional[str] = Field(default_factory=gen_uuid, primary_key=True, sa_type=UUIDText)
     user: Optional[str] = None
     action: str = ""
     detail: Dict[str, Any] = Field(default_factory=dict, sa_type=JSON)
@@ -100,9 +182,33 @@ class CycleTask(SQLModel, table=True):
     task_id: str = Field(primary_key=True)
 
 
+class CycleSnapshot(SQLModel, table=True):
+    """迭代每日快照：按处理人、模块汇总剩余任务数与剩余工时，用于燃尽图"""
+    __table_args__ = (Index("ix_cyclesnapshot_cycle_date", "cycle_id", "snap_date"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    cycle_id: str
+    snap_date: date
+    assignee: Optional[str] = None
+    module_id: Optional[str] = None
+    total_tasks: int = 0
+    remaining_tasks: int = 0
+    remaining_hours: float = 0
+
+
 class SavedView(SQLModel, table=True):
     id: Optional[str] = Field(default_factory=gen_uuid, primary_key=True)
     name: str
     owner: str  # username
     filters: Dict[str, Any] = Field(default_factory=dict, sa_type=JSON)
     created_at: datetime = Field(default_factory=local_now)
+
+
+class SearchDocument(SQLModel, table=True):
+    """全文检索条目：kind 为 instance/task/document，分词后的正文存放在 FTS5 虚表或 tsv 列中"""
+    __table_args__ = (UniqueConstraint("kind", "ref_id"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str
+    ref_id: str
+    parent_id: Optional[str] = None  # 任务所属流程实例
+    owner: Optional[str] = Field(default=None, index=True)  # 发起人/处理人，用于权限过滤
+    title: Optional[str] = None
@@ -0,0 +1,278 @@
+"""按需请求剖析
+
+所有路由使用 ProfiledRoute。满足以下任一条件的请求会被剖析：
+- 携带 X-Profile: 1 且 Authorization 为系统管理员；
+- 按 WF_PROFILE_SAMPLE_RATE 随机抽样（默认 0，即关闭）。
+未命中时只多一次请求头判断，可常开。
+
+WF_PROFILE_MODE=sample（默认）时由一个旁路线程每隔 WF_PROFILE_INTERVAL_MS 毫秒采样
+执行端点函数的线程栈，输出 collapsed stack 文本（flamegraph.pl / speedscope 可直接打开）；
+=cprofile 时用 cProfile 记录并输出 .prof（pstats 格式，可用 snakeviz、flameprof 查看）。
+结果写入 WF_PROFILE_DIR，只保留最近 WF_PROFILE_KEEP 份。
+
+只剖析端点函数本身（依赖项另行在线程池中执行）；async 端点运行在事件循环线程上，
+采样或 cProfile 结果都会混入同时处理的其它协程。cProfile 同一时刻只服务一个请求，
+其余并发的剖析请求改用采样；剖析器启动或停止失败只打印日志，不影响请求本身。
+"""
+import asyncio
+import cProfile
+import inspect
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+from typing import Optional
+
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+
+from .crud import get_user_by_username
+from .utils import decode_token
+from .config import PROFILE_DIR, PROFILE_SAMPLE_RATE, PROFILE_MODE, PROFILE_KEEP, PROFILE_INTERVAL_MS
+
+_EXTENSIONS = {"sample": "collapsed", "cprofile": "prof"}
+_FILENAME_RE = re.compile(r"^(\d{8}-\d{6}-\d{6})_([A-Z]+)_(.+)_(\d+)ms\.(collapsed|prof)$")
+_write_lock = threading.Lock()
+# cProfile 同一时刻只能有一个处于启用状态（Python 3.12+ 第二个 enable 会抛 ValueError），
+# 并发到达的其它剖析请求退回采样方式
+_cprofile_lock = threading.Lock()
+
+
+class _ProfileJob:
+    __slots__ = ("mode", "stacks", "profile")
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.stacks = Counter()
+        self.profile = None
+
+
+_active: ContextVar[Optional[_ProfileJob]] = ContextVar("wf_profile_job", default=None)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    # 去掉 site-packages 之前的路径，让火焰图更易读
+    idx = filename.rfind("site-packages")
+    if idx >= 0:
+        filename = filename[idx + len("site-packages") + 1:]
+    else:
+        filename = os.path.relpath(filename) if os.path.isabs(filename) else filename
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, thread_id: int, stacks: Counter, interval: float):
+        super().__init__(name="wf-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.stacks = stacks
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(labels))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _start(job: _ProfileJob):
+    if job.mode == "cprofile":
+        if _cprofile_lock.acquire(blocking=False):
+            try:
+                job.profile = cProfile.Profile()
+                job.profile.enable()
+                return job.profile
+            except BaseException:
+                job.profile = None
+                _cprofile_lock.release()
+                raise
+        # 已有请求在用 cProfile：本请求改为采样
+        job.mode = "sample"
+    sampler = _Sampler(threading.get_ident(), job.stacks, PROFILE_INTERVAL_MS / 1000.0)
+    sampler.start()
+    return sampler
+
+
+def _stop(job: _ProfileJob, handle):
+    if job.mode == "cprofile":
+        try:
+            handle.disable()
+        finally:
+            _cprofile_lock.release()
+    else:
+        handle.stop()
+
+
+def _begin(job: _ProfileJob):
+    """启动剖析；失败时只打印日志并返回 None，请求照常处理"""
+    try:
+        return _start(job)
+    except Exception as e:
+        print(f"[Profile] failed to start profiler: {e}")
+        return None
+
+
+def _end(job: _ProfileJob, handle):
+    if handle is None:
+        return
+    try:
+        _stop(job, handle)
+    except Exception as e:
+        print(f"[Profile] failed to stop profiler: {e}")
+
+
+def _wrap_endpoint(call):
+    """在端点实际执行的线程里启动剖析；需保持原函数的同步/异步属性，FastAPI 据此决定是否放入线程池"""
+    if getattr(call, "_wf_profiled", False):
+        return call
+    if _is_coroutine(call):
+        @wraps(call)
+        async def async_wrapper(*args, **kwargs):
+            job = _active.get()
+            if job is None:
+                return await call(*args, **kwargs)
+            handle = _begin(job)
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                _end(job, handle)
+        async_wrapper._wf_profiled = True
+        return async_wrapper
+
+    @wraps(call)
+    def wrapper(*args, **kwargs):
+        job = _active.get()
+        if job is None:
+            return call(*args, **kwargs)
+        handle = _begin(job)
+        try:
+            return call(*args, **kwargs)
+        finally:
+            _end(job, handle)
+    wrapper._wf_profiled = True
+    return wrapper
+
+
+def _is_coroutine(call) -> bool:
+    if inspect.isroutine(call):
+        return asyncio.iscoroutinefunction(call)
+    dunder_call = getattr(call, "__call__", None)
+    return asyncio.iscoroutinefunction(dunder_call)
+
+
+def _is_admin(request) -> bool:
+    auth = request.headers.get("authorization", "")
+    if not auth.lower().startswith("bearer "):
+        return False
+    payload = decode_token(auth[7:].strip())
+    if not payload or "sub" not in payload:
+        return False
+    user = get_user_by_username(payload["sub"])
+    return bool(user and not user.disabled and user.role == "admin")
+
+
+async def _should_profile(request) -> bool:
+    if request.headers.get("x-profile") == "1":
+        # 校验管理员需要查库，放到线程池避免阻塞事件循环
+        return await run_in_threadpool(_is_admin, request)
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _save(job: _ProfileJob, method: str, route_path: str, elapsed: float):
+    if job.mode == "cprofile" and job.profile is None:
+        return None
+    if job.mode == "sample" and not job.stacks:
+        return None
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", route_path).strip("-") or "root"
+    name = f"{datetime.now():%Y%m%d-%H%M%S-%f}_{method}_{slug}_{int(elapsed * 1000)}ms.{_EXTENSIONS[job.mode]}"
+    with _write_lock:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, name)
+        if job.mode == "cprofile":
+            job.profile.dump_stats(path)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in job.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        # 环形保留：文件名以时间开头，按名称排序即按时间排序
+        names = sorted(n for n in os.listdir(PROFILE_DIR) if _FILENAME_RE.match(n))
+        for old in names[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else []:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, old))
+            except OSError:
+                pass
+    return name
+
+
+class ProfiledRoute(APIRoute):
+    def get_route_handler(self):
+        self.dependant.call = _wrap_endpoint(self.dependant.call)
+        handler = super().get_route_handler()
+        route_path = self.path
+
+        async def profiled_handler(request):
+            if not await _should_profile(request):
+                return await handler(request)
+            job = _ProfileJob(PROFILE_MODE if PROFILE_MODE in _EXTENSIONS else "sample")
+            token = _active.set(job)
+            start = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                _active.reset(token)
+                try:
+                    name = _save(job, request.method, route_path, time.perf_counter() - start)
+                    if name:
+                        print(f"[Profile] {request.method} {request.url.path} -> {name}")
+                    else:
+                        print(f"[Profile] {request.method} {request.url.path} finished before the first sample")
+                except Exception as e:
+                    print(f"[Profile] failed to save profile: {e}")
+
+        return profiled_handler
+
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    results = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        m = _FILENAME_RE.match(name)
+        if not m:
+            continue
+        stamp, method, slug, ms, ext = m.groups()
+        results.append({
+            "name": name,
+            "created_at": datetime.strptime(stamp, "%Y%m%d-%H%M%S-%f").isoformat(timespec="seconds"),
+            "method": method,
+            "route": slug,
+            "duration_ms": int(ms),
+            "format": "pstats" if ext == "prof" else "collapsed",
+            "size": os.path.getsize(os.path.join(PROFILE_DIR, name)),
+        })
+    return results
+
+
+def profile_path(name: str) -> Optional[str]:
+    """只接受本目录下符合命名规则的文件，防止路径穿越"""
+    if not _FILENAME_RE.match(name) or os.path.basename(name) != name:
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,171 @@
+"""按请求统计 SQL
+
+QueryLogMiddleware 为每个请求建立一个 QueryStats，engine 事件钩子把语句数、
+耗时和（归一化后的）语句重复次数记到当前请求上：
+- WF_SQL_DEBUG=1 时在响应头返回 X-SQL-Count / X-SQL-Time-ms；
+- 超过 WF_SLOW_QUERY_MS 的 SELECT 会连同执行计划打印出来；
+- 同一请求内同一条语句执行次数达到 WF_N_PLUS_ONE_THRESHOLD 视为 N+1，
+  默认只打印告警，WF_SQL_STRICT=1（测试环境）时直接抛出 NPlusOneError。
+"""
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import event
+
+from .config import SQL_DEBUG, SLOW_QUERY_MS, SQL_STRICT, N_PLUS_ONE_THRESHOLD
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+class QueryStats:
+    __slots__ = ("count", "seconds", "statements", "reported")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Dict[str, int] = {}
+        self.reported = False
+
+    def merge(self, other: "QueryStats"):
+        self.count += other.count
+        self.seconds += other.seconds
+        for sql, n in other.statements.items():
+            self.statements[sql] = self.statements.get(sql, 0) + n
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD):
+        return {sql: n for sql, n in self.statements.items() if n >= threshold}
+
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("wf_query_stats", default=None)
+
+
+def current() -> Optional[QueryStats]:
+    return _current.get()
+
+
+@contextmanager
+def capture():
+    """在请求之外统计一段代码的 SQL（脚本、基准测试、测试用例）；
+    其间经 TestClient 发出的请求，其语句也会并入（见 QueryLogMiddleware）"""
+    stats = QueryStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def assert_constant_queries(call: Callable[[], object], grow: Callable[[], object], slack: int = 0):
+    """测试辅助：先执行 call，再用 grow 增加数据后重跑；语句数随数据量增长即判定为 N+1"""
+    with capture() as before:
+        call()
+    grow()
+    with capture() as after:
+        call()
+    if after.count > before.count + slack:
+        worst = sorted(after.statements.items(), key=lambda kv: -kv[1])[:3]
+        raise NPlusOneError(f"query count grew from {before.count} to {after.count}: {worst}")
+    return before.count, after.count
+
+
+_IN_LIST_RE = re.compile(r"\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)")
+_PARAM_NAME_RE = re.compile(r"%\((\w+?)_\d+\)s")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def _normalize(statement: str):
+    sql, in_lists = _IN_LIST_RE.subn("(?)", statement)
+    sql = _PARAM_NAME_RE.sub(r"%(\1)s", sql)
+    return _SPACE_RE.sub(" ", sql).strip(), in_lists > 0
+
+
+def normalize(statement: str) -> str:
+    """把 IN 列表、带序号的参数名折叠掉，使同一形状的语句归为一类"""
+    return _normalize(statement)[0]
+
+
+def _explain(conn, statement, parameters, dialect_name):
+    prefix = "EXPLAIN QUERY PLAN " if dialect_name == "sqlite" else "EXPLAIN "
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return "\n".join("  " + " | ".join(str(c) for c in row) for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def instrument_engine(engine):
+    dialect_name = engine.dialect.name
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("wf_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "handle_error")
+    def _on_error(context):
+        # 出错的语句不会触发 after_cursor_execute，这里弹出计时栈
+        starts = context.connection.info.get("wf_query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["wf_query_start"].pop()
+        stats = _current.get()
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += elapsed
+            key, batched = _normalize(statement)
+            n = stats.statements.get(key, 0) + 1
+            stats.statements[key] = n
+            # 带 IN 列表的语句是按块批量加载（见 crud._chunks），不按 N+1 处理
+            if n == N_PLUS_ONE_THRESHOLD and not batched:
+                message = f"[SQL] possible N+1: statement executed {n} times in one request: {key[:300]}"
+                if SQL_STRICT:
+                    raise NPlusOneError(message)
+                if not stats.reported:
+                    stats.reported = True
+                    print(message)
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            plan = ""
+            if not executemany and statement.lstrip()[:6].upper() == "SELECT":
+                try:
+                    plan = "\n" + _explain(conn, statement, parameters, dialect_name)
+                except Exception as e:
+                    plan = f"\n  (explain failed: {e})"
+            print(f"[SQL] slow query {elapsed * 1000:.1f}ms: {_SPACE_RE.sub(' ', statement)[:1000]}{plan}")
+
+
+class QueryLogMiddleware:
+    """纯 ASGI 中间件，为每个 HTTP 请求建立 QueryStats，调试模式下写入响应头"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        # 外层有 capture()（测试中经 TestClient 调用接口）时，请求结束后把本请求的统计并入
+        outer = _current.get()
+        stats = QueryStats()
+        token = _current.set(stats)
+
+        async def send_wrapper(message):
+            if SQL_DEBUG and message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-sql-count", str(stats.count).encode()))
+                headers.append((b"x-sql-time-ms", f"{stats.seconds * 1000:.1f}".encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            if outer is not None:
+                outer.merge(stats)
@@ -0,0 +1,198 @@
+"""只读副本路由
+
+显式声明为只读的查询（crud 中用 read_engine() 打开会话的函数、asyncdb.run_read：管理员任务列表、
+任务监控、审计日志、人事档案、首页统计）在配置了副本时改读副本，其余查询一律走主库。
+
+读己之写：请求在主库上执行过写语句后，该用户在 WF_REPLICA_STICKY_SECONDS 秒内的只读查询仍走主库。
+同时用两种方式记录：进程内按用户名记录（同一 worker 内生效），以及在响应中设置 wf_primary Cookie
+（浏览器带回后任一 worker 都能识别）。副本连接出错后 WF_REPLICA_RETRY_SECONDS 秒内改读主库。
+
+本地测试：WF_REPLICA_DB 指向另一个 SQLite 文件，python run.py replica-sync 定时把主库复制过去，
+复制间隔即模拟的复制延迟。
+"""
+import threading
+import time
+from contextvars import ContextVar
+from http.cookies import SimpleCookie
+from typing import Dict, Optional
+
+from sqlalchemy import create_engine, event
+
+from . import dbprofile, metrics, querylog
+from .config import (
+    DATABASE_URL, REPLICA_DATABASE_URL, REPLICA_DB, REPLICA_STICKY_SECONDS, REPLICA_RETRY_SECONDS,
+    SQLITE_BUSY_TIMEOUT_MS,
+)
+
+STICKY_COOKIE = "wf_primary"
+
+READ_ROUTES = metrics.Counter("wf_db_read_routing_total", "Read-only queries by target database and reason",
+                              ("target", "reason"))
+
+_primary = None
+_replica = None
+_replica_down_until = 0.0
+_sticky_users: Dict[str, float] = {}  # 用户名 -> 改回副本的时间（monotonic）
+_sticky_lock = threading.Lock()
+
+
+class _RequestState:
+    __slots__ = ("user", "wrote", "primary")
+
+    def __init__(self, primary: bool):
+        self.user: Optional[str] = None
+        self.wrote = False
+        self.primary = primary
+
+
+_state: ContextVar[Optional[_RequestState]] = ContextVar("wf_replica_state", default=None)
+
+
+def _create_replica_engine():
+    if DATABASE_URL:
+        if not REPLICA_DATABASE_URL:
+            return None
+        url = dbprofile.pg_url(REPLICA_DATABASE_URL.replace("postgres://", "postgresql://", 1))
+        engine = create_engine(url, echo=False, **dbprofile.pg_engine_kwargs(url.get_driver_name()))
+        dbprofile.apply_pg_profile(engine)
+        return engine
+    if not REPLICA_DB:
+        return None
+    engine = create_engine(
+        f"sqlite:///{REPLICA_DB}",
+        echo=False,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000.0},
+        **dbprofile.pool_kwargs(),
+    )
+    dbprofile.apply_sqlite_profile(engine, write_queue=False)
+    return engine
+
+
+def configure(primary_engine):
+    """由 crud 在创建主库引擎后调用；未配置副本时所有查询照旧走主库"""
+    global _primary, _replica
+    _primary = primary_engine
+    _replica = _create_replica_engine()
+    if _replica is None:
+        return None
+    metrics.instrument_engine(_replica, "replica")
+    querylog.instrument_engine(_replica)
+
+    @event.listens_for(_replica, "handle_error")
+    def _replica_failed(context):
+        global _replica_down_until
+        if context.is_disconnect or context.connection is None:
+            _replica_down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+            print(f"[Replica] read replica unavailable, reading from primary for {REPLICA_RETRY_SECONDS:.0f}s: "
+                  f"{context.original_exception}")
+
+    @event.listens_for(_primary, "before_cursor_execute")
+    def _note_write(conn, cursor, statement, parameters, context, executemany):
+        state = _state.get()
+        if state is not None and not state.wrote and dbprofile.is_write_statement(statement):
+            state.wrote = True
+
+    return _replica
+
+
+def enabled() -> bool:
+    return _replica is not None
+
+
+def describe() -> str:
+    if _replica is None:
+        return "not configured"
+    return f"{_replica.url.render_as_string(hide_password=True)} (sticky {REPLICA_STICKY_SECONDS:.0f}s)"
+
+
+def set_user(username: str):
+    """鉴权后记下当前用户，用于按用户的读己之写判断"""
+    state = _state.get()
+    if state is not None:
+        state.user = username
+
+
+def _is_sticky(username: Optional[str]) -> bool:
+    if not username:
+        return False
+    until = _sticky_users.get(username)
+    return until is not None and until > time.monotonic()
+
+
+def _mark_sticky(username: str):
+    now = time.monotonic()
+    with _sticky_lock:
+        if len(_sticky_users) > 10000:
+            for name in [n for n, until in _sticky_users.items() if until <= now]:
+                del _sticky_users[name]
+        _sticky_users[username] = now + REPLICA_STICKY_SECONDS
+
+
+def read_engine():
+    """只读查询使用的引擎：副本，或因读己之写、副本不可用而退回主库"""
+    if _replica is None:
+        return _primary
+    state = _state.get()
+    if state is not None and (state.primary or state.wrote or _is_sticky(state.user)):
+        READ_ROUTES.inc(1, "primary", "sticky")
+        return _primary
+    if _replica_down_until > time.monotonic():
+        READ_ROUTES.inc(1, "primary", "replica_down")
+        return _primary
+    READ_ROUTES.inc(1, "replica", "read_only")
+    return _replica
+
+
+def is_replica(engine) -> bool:
+    return engine is not None and engine is _replica
+
+
+class ReplicaRoutingMiddleware:
+    """纯 ASGI 中间件：读取 wf_primary Cookie；请求中写过主库时记下用户并设置 Cookie"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        state = _RequestState(primary=_has_sticky_cookie(scope))
+        token = _state.set(state)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and state.wrote:
+                if state.user:
+                    _mark_sticky(state.user)
+                cookie = (f"{STICKY_COOKIE}=1; Max-Age={int(REPLICA_STICKY_SECONDS)}; Path=/; "
+                          f"HttpOnly; SameSite=Lax")
+                message["headers"] = [*message.get("headers", ()), (b"set-cookie", cookie.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _state.reset(token)
+
+
+def _has_sticky_cookie(scope) -> bool:
+    for name, value in scope.get("headers", ()):
+        if name == b"cookie" and STICKY_COOKIE.encode() in value:
+            cookie = SimpleCookie()
+            try:
+                cookie.load(value.decode("latin-1"))
+            except Exception:
+                return False
+            return STICKY_COOKIE in cookie
+    return False
+
+
+def sync_sqlite(source: str, dest: str):
+    """本地测试用：用备份 API 把主库完整复制到副本文件（副本上的读连接会短暂等待）"""
+    import sqlite3
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(dest, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
@@ -25,6 +25,7 @@ class UserUpdate(BaseModel):
     title: Optional[str] = None
     avatar: Optional[str] = None
     role: Optional[str] = None  # 添加角色字段
+    department_id: Optional[int] = None  # 指定部门树节点，优先于 department 名称
 
 class PasswordChange(BaseModel):
     old_password: str
@@ -98,8 +99,26 @@ class CycleCreate(BaseModel):
 class CycleTaskAssign(BaseModel):
     task_id: str
 
+class CycleTaskBulk(BaseModel):
+    task_ids: List[str]
+
+class CycleTaskMove(BaseModel):
+    task_ids: List[str]
+    target_cycle_id: str
+
 
 # --- 保存视图 ---
 class SavedViewCreate(BaseModel):
     name: str
     filters: Dict[str, Any] = {}
+
+
+# --- 部门 ---
+class DepartmentCreate(BaseModel):
+    name: str
+    parent_id: Optional[int] = None
+
+class DepartmentUpdate(BaseModel):
+    name: Optional[str] = None
+    parent_id: Optional[int] = None
+    move: bool = False  # 为 True 时按 parent_id 移动（parent_id 为空表示移到顶级）
@@ -0,0 +1,241 @@
+"""全文检索索引
+
+SQLite 使用 FTS5 虚表，PostgreSQL 使用 tsvector + GIN 索引。
+中文没有空格分词，这里统一在写入和查询前把中文切成二元组（bigram），
+因此两种数据库都只需要最简单的分词器即可支持中文检索。
+"""
+import re
+from typing import Optional, List
+from sqlmodel import Session, select
+from sqlalchemy import text, func
+from .models import SearchDocument, ProcessInstance, ProcessTemplate, Task, Document, ProcessInstanceArchive, TaskArchive
+
+# 中日韩统一表意文字 + 扩展 A + 兼容表意文字
+_CJK = "㐀-䶿一-鿿豈-﫿"
+_TOKEN_RE = re.compile(f"[{_CJK}]+|[0-9A-Za-zÀ-ɏ]+")
+
+# 每个文档参与索引的正文长度上限，避免超大表单拖慢写入
+MAX_BODY_CHARS = 20000
+REBUILD_BATCH = 500
+
+_dialect = None  # "sqlite" / "postgresql"，ensure_index 后设置；None 表示索引不可用
+
+
+def segment(value: str) -> List[str]:
+    """切词：中文连续片段切为二元组，英文/数字按单词小写。"""
+    tokens = []
+    for m in _TOKEN_RE.finditer(value or ""):
+        word = m.group(0)
+        if "㐀" <= word[0] <= "﫿":
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word.lower())
+    return tokens
+
+
+def _flatten(value) -> List[str]:
+    """把表单 data 中的字符串/数字值展开为文本片段"""
+    if isinstance(value, dict):
+        parts = []
+        for v in value.values():
+            parts.extend(_flatten(v))
+        return parts
+    if isinstance(value, (list, tuple)):
+        parts = []
+        for v in value:
+            parts.extend(_flatten(v))
+        return parts
+    if isinstance(value, bool) or value is None:
+        return []
+    if isinstance(value, (str, int, float)):
+        return [str(value)]
+    return []
+
+
+def ensure_index(engine):
+    """创建全文索引所需的虚表/列与索引，失败时检索功能降级为不可用。"""
+    global _dialect
+    dialect = engine.dialect.name
+    try:
+        with engine.begin() as conn:
+            if dialect == "postgresql":
+                conn.execute(text("ALTER TABLE searchdocument ADD COLUMN IF NOT EXISTS tsv tsvector"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_searchdocument_tsv ON searchdocument USING GIN (tsv)"))
+            else:
+                conn.execute(text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts "
+                    "USING fts5(title, body, tokenize='unicode61')"
+                ))
+        _dialect = dialect
+    except Exception as e:
+        _dialect = None
+        print(f"Search index unavailable: {e}")
+        return
+    with Session(engine) as s:
+        indexed = s.exec(select(func.count(SearchDocument.id))).one()
+        if not indexed and s.exec(select(ProcessInstance.id).limit(1)).first():
+            rebuild(s)
+            print("Search index rebuilt")
+
+
+def detect(engine):
+    """只检查索引是否已由迁移建好（不执行 DDL），供跳过 init_db 的 worker 启动时调用"""
+    global _dialect
+    dialect = engine.dialect.name
+    try:
+        with engine.connect() as conn:
+            if dialect == "postgresql":
+                found = conn.execute(text(
+                    "SELECT 1 FROM information_schema.columns WHERE table_name = 'searchdocument' AND column_name = 'tsv'"
+                )).first()
+            else:
+                found = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'search_fts'")).first()
+    except Exception as e:
+        found = None
+        print(f"Search index check failed: {e}")
+    _dialect = dialect if found else None
+    if not found:
+        print("Search index unavailable: run migrations (python run.py migrate)")
+
+
+def _upsert(s: Session, kind: str, ref_id: str, owner: Optional[str], title: Optional[str],
+            body: str, parent_id: Optional[str] = None):
+    if _dialect is None:
+        return
+    doc = s.exec(select(SearchDocument).where(SearchDocument.kind == kind, SearchDocument.ref_id == ref_id)).first()
+    if not doc:
+        doc = SearchDocument(kind=kind, ref_id=ref_id)
+    doc.owner = owner
+    doc.title = title
+    doc.parent_id = parent_id
+    s.add(doc); s.flush()
+    title_tokens = " ".join(segment(title or ""))
+    body_tokens = " ".join(segment((body or "")[:MAX_BODY_CHARS]))
+    if _dialect == "postgresql":
+        s.exec(text(
+            "UPDATE searchdocument SET tsv = "
+            "setweight(to_tsvector('simple', :t), 'A') || setweight(to_tsvector('simple', :b), 'B') "
+            "WHERE id = :id"
+        ).bindparams(t=title_tokens, b=body_tokens, id=doc.id))
+    else:
+        s.exec(text("DELETE FROM search_fts WHERE rowid = :id").bindparams(id=doc.id))
+        s.exec(text("INSERT INTO search_fts(rowid, title, body) VALUES (:id, :t, :b)")
+               .bindparams(id=doc.id, t=title_tokens, b=body_tokens))
+
+
+def index_instance(s: Session, inst: ProcessInstance, template_name: Optional[str] = None):
+    data = inst.data or {}
+    title = data.get("title") or template_name or inst.id
+    body = " ".join([template_name or ""] + _flatten(data))
+    _upsert(s, "instance", inst.id, inst.started_by, title, body)
+
+
+def index_task(s: Session, task: Task, instance_title: Optional[str] = None):
+    """任务只按审批意见建索引，标题沿用所属流程标题"""
+    if not task.opinion:
+        return
+    _upsert(s, "task", task.id, task.assignee, instance_title, task.opinion, parent_id=task.instance_id)
+
+
+def index_document(s: Session, doc: Document):
+    _upsert(s, "document", doc.id, None, doc.title, doc.title)
+
+
+def remove(s: Session, kind: str, ref_id: str):
+    if _dialect is None:
+        return
+    doc = s.exec(select(SearchDocument).where(SearchDocument.kind == kind, SearchDocument.ref_id == ref_id)).first()
+    if not doc:
+        return
+    if _dialect != "postgresql":
+        s.exec(text("DELETE FROM search_fts WHERE rowid = :id").bindparams(id=doc.id))
+    s.delete(doc)
+
+
+def rebuild(s: Session):
+    """全量重建索引（按批提交），用于首次启用或索引损坏后修复"""
+    if _dialect is None:
+        return
+    if _dialect == "postgresql":
+        s.exec(text("DELETE FROM searchdocument"))
+    else:
+        s.exec(text("DELETE FROM search_fts"))
+        s.exec(text("DELETE FROM searchdocument"))
+    s.commit()
+    tpl_names = {tid: name for tid, name in s.exec(select(ProcessTemplate.id, ProcessTemplate.name)).all()}
+    titles = {}
+    # 归档表（见 archive.py）中的流程与审批意见同样可检索
+    for model in (ProcessInstance, ProcessInstanceArchive):
+        offset = 0
+        while True:
+            batch = s.exec(select(model).order_by(model.started_at).offset(offset).limit(REBUILD_BATCH)).all()
+            if not batch:
+                break
+            for inst in batch:
+                index_instance(s, inst, tpl_names.get(inst.template_id))
+                titles[inst.id] = (inst.data or {}).get("title")
+            s.commit()
+            offset += REBUILD_BATCH
+    for model in (Task, TaskArchive):
+        offset = 0
+        while True:
+            batch = s.exec(
+                select(model).where(model.opinion.isnot(None)).order_by(model.assigned_at).offset(offset).limit(REBUILD_BATCH)
+            ).all()
+            if not batch:
+                break
+            for t in batch:
+                index_task(s, t, titles.get(t.instance_id))
+            s.commit()
+            offset += REBUILD_BATCH
+    for doc in s.exec(select(Document)).all():
+        index_document(s, doc)
+    s.commit()
+
+
+def query(s: Session, q: str, username: str, see_all: bool = False, kind: Optional[str] = None, limit: int = 20):
+    """按相关度返回检索结果；非管理员只能看到自己发起/处理的条目和公共文档。"""
+    if _dialect is None:
+        return []
+    tokens = segment(q)
+    if not tokens:
+        return []
+    params = {"limit": limit}
+    filters = []
+    if kind:
+        filters.append("d.kind = :kind")
+        params["kind"] = kind
+    if not see_all:
+        filters.append("(d.kind = 'document' OR d.owner = :username)")
+        params["username"] = username
+    where = "".join(f" AND {f}" for f in filters)
+    if _dialect == "postgresql":
+        # 最后一个词按前缀匹配，便于边输入边搜索
+        params["q"] = " & ".join([f"'{t}'" for t in tokens[:-1]] + [f"'{tokens[-1]}':*"])
+        sql = (
+            "SELECT d.kind, d.ref_id, d.parent_id, d.title, ts_rank(d.tsv, query) AS score "
+            "FROM searchdocument d, to_tsquery('simple', :q) query "
+            f"WHERE d.tsv @@ query{where} ORDER BY score DESC LIMIT :limit"
+        )
+    else:
+        params["q"] = " ".join([f'"{t}"' for t in tokens[:-1]] + [f'"{tokens[-1]}"*'])
+        # bm25 越小越相关；标题权重高于正文
+        sql = (
+            "SELECT d.kind, d.ref_id, d.parent_id, d.title, -bm25(search_fts, 5.0, 1.0) AS score "
+            "FROM search_fts JOIN searchdocument d ON d.id = search_fts.rowid "
+            f"WHERE search_fts MATCH :q{where} ORDER BY bm25(search_fts, 5.0, 1.0) LIMIT :limit"
+        )
+    rows = s.exec(text(sql).bindparams(**params)).all()
+    return [
+        {
+            "kind": row[0],
+            "id": row[1],
+            "instance_id": row[2] if row[0] == "task" else (row[1] if row[0] == "instance" else None),
+            "title": row[3],
+            "score": float(row[4] or 0),
+        }
+        for row in rows
+    ]
@@ -0,0 +1,209 @@
+"""生产模式多进程服务（python run.py prod）
+
+主进程先导入 app（预加载，fork 后各 worker 共享只读内存页，无需各自重新导入）、
+执行一次迁移并绑定监听 socket，再 fork 出 N 个 worker，各 worker 在同一个 socket 上
+运行 uvicorn，由内核分配新连接：
+- fork 后 worker 丢弃继承的数据库连接，各自建立连接池；PostgreSQL 的总连接数约为
+  worker 数 × 2（同步与异步引擎）×（WF_DB_POOL_SIZE + WF_DB_MAX_OVERFLOW），需小于数据库的
+  max_connections；
+- 后台定时任务只在 0 号 worker 中运行；
+- 主进程收到 SIGTERM/SIGINT 后转发给所有 worker：worker 先让 /readyz 返回 503，
+  等待 WF_DRAIN_DELAY 秒让负载均衡摘除流量，再停止接收新连接，最多等待
+  WF_GRACEFUL_TIMEOUT 秒让进行中的请求完成；超时仍未退出的 worker 被强制结束；
+- worker 异常退出时主进程拉起同编号的新 worker，短时间内反复崩溃则整体退出。
+进程内缓存的内容与 /metrics 指标按 worker 各自独立，缓存代号在 fork 前分配的共享内存中，
+任一 worker 提交变更后所有 worker 的相关缓存立即失效（见 cache.py）。不支持 fork 的平台退化为单进程。
+"""
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+
+from . import config
+
+# worker 启动后存活不足该秒数即退出视为启动失败；连续失败达到 worker 数 × 3 次后放弃
+_FAST_FAILURE_SECONDS = 10
+_FAST_FAILURE_FACTOR = 3
+
+
+def default_workers() -> int:
+    """按可用 CPU 数选择：端点以同步函数为主、受 GIL 限制，每核一个进程即可用满 CPU；
+    SQLite 同一时刻只允许一个写事务，进程再多也只是排队等锁，因此最多 4 个"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    cpus = max(1, cpus)
+    return cpus if config.DATABASE_URL else min(cpus, 4)
+
+
+def _bind(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _draining_server_class():
+    import uvicorn
+
+    class DrainingServer(uvicorn.Server):
+        """收到退出信号后先标记 draining（/readyz 返回 503），延迟 DRAIN_DELAY 秒再交给 uvicorn 优雅停止"""
+
+        def __init__(self, uv_config, app):
+            super().__init__(uv_config)
+            self.app = app
+
+        def handle_exit(self, sig, frame):
+            first = not self.app.state.draining
+            self.app.state.draining = True
+            if first and config.DRAIN_DELAY > 0:
+                threading.Timer(config.DRAIN_DELAY, self._stop_accepting, (sig, frame)).start()
+                return
+            super().handle_exit(sig, frame)
+
+        def _stop_accepting(self, sig, frame):
+            # 等待期间若已收到第二个信号并开始停止，不再重复触发（否则会被 uvicorn 视为强制退出）
+            if not self.should_exit:
+                super().handle_exit(sig, frame)
+
+    return DrainingServer
+
+
+def _run_worker(index: int, sock: socket.socket, app, log_level: str, access_log: bool) -> int:
+    import uvicorn
+    from . import crud
+
+    # 主进程的信号处理函数随 fork 继承下来，需恢复默认；uvicorn 启动后会安装自己的处理函数
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGALRM):
+        signal.signal(sig, signal.SIG_DFL)
+    config.AUTO_MIGRATE = False
+    config.JOBS_ENABLED = config.JOBS_ENABLED and index == 0
+    # 继承自主进程的连接不能跨进程共用：丢弃引用但不关闭（关闭会影响父进程持有的同一个 socket）
+    crud.engine.dispose(close=False)
+
+    uv_config = uvicorn.Config(
+        app,
+        lifespan="on",
+        log_level=log_level,
+        access_log=access_log,
+        timeout_graceful_shutdown=config.GRACEFUL_TIMEOUT,
+        proxy_headers=True,
+    )
+    server = _draining_server_class()(uv_config, app)
+    print(f"[Server] worker {index} started (pid {os.getpid()})")
+    server.run(sockets=[sock])
+    return 0 if server.started else 3
+
+
+class _Supervisor:
+    def __init__(self, sock: socket.socket, app, workers: int, log_level: str, access_log: bool):
+        self.sock = sock
+        self.app = app
+        self.workers = workers
+        self.log_level = log_level
+        self.access_log = access_log
+        self.children = {}  # pid -> (worker 编号, 启动时间)
+        self.stopping = False
+        self.fast_failures = 0
+        self.exit_code = 0
+
+    def spawn(self, index: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = _run_worker(index, self.sock, self.app, self.log_level, self.access_log)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+        self.children[pid] = (index, time.monotonic())
+
+    def _signal_children(self, sig):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def stop(self, signum=signal.SIGTERM, frame=None):
+        if self.stopping:
+            # 第二次 Ctrl+C：转发给 worker，由 uvicorn 放弃等待立即退出
+            self._signal_children(signum)
+            return
+        self.stopping = True
+        print(f"[Server] stopping {len(self.children)} workers (signal {signum})")
+        self._signal_children(signal.SIGTERM)
+        signal.alarm(int(config.DRAIN_DELAY + config.GRACEFUL_TIMEOUT) + 10)
+
+    def _kill_remaining(self, signum, frame):
+        if self.children:
+            print(f"[Server] {len(self.children)} workers did not exit in time, killing")
+            self._signal_children(signal.SIGKILL)
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGALRM, self._kill_remaining)
+        for index in range(self.workers):
+            self.spawn(index)
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index, started_at = self.children.pop(pid, (None, 0))
+            if index is None or self.stopping:
+                continue
+            print(f"[Server] worker {index} (pid {pid}) exited with code {os.waitstatus_to_exitcode(status)}")
+            if time.monotonic() - started_at < _FAST_FAILURE_SECONDS:
+                self.fast_failures += 1
+            else:
+                self.fast_failures = 0
+            if self.fast_failures >= self.workers * _FAST_FAILURE_FACTOR:
+                print("[Server] workers keep failing on startup, giving up")
+                self.exit_code = 1
+                self.stop()
+                continue
+            time.sleep(min(self.fast_failures, 5))
+            if not self.stopping:
+                self.spawn(index)
+        signal.alarm(0)
+        self.sock.close()
+        print("[Server] stopped")
+        return self.exit_code
+
+
+def serve(host: str = None, port: int = None, workers: int = None,
+          log_level: str = "info", access_log: bool = True) -> int:
+    import uvicorn
+    from . import crud
+    from .main import app
+
+    host = host or config.HOST
+    port = port or config.PORT
+    workers = workers or config.WORKERS or default_workers()
+
+    # 迁移只在主进程执行一次；失败直接退出，不带着半迁移的库启动 worker
+    config.ensure_directories()
+    config.log_summary()
+    if config.AUTO_MIGRATE:
+        crud.init_db()
+        config.AUTO_MIGRATE = False
+    crud.engine.dispose()
+
+    if not hasattr(os, "fork"):
+        print(f"[Server] fork is not available on this platform, serving with a single process on {host}:{port}")
+        uvicorn.run(app, host=host, port=port, log_level=log_level, access_log=access_log,
+                    timeout_graceful_shutdown=config.GRACEFUL_TIMEOUT, proxy_headers=True)
+        return 0
+
+    sock = _bind(host, port)
+    print(f"[Server] master pid {os.getpid()} listening on http://{host}:{port} with {workers} workers")
+    return _Supervisor(sock, app, workers, log_level, access_log).run()
@@ -1,31 +1,86 @@
-from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
-from jose import jwt
+from functools import lru_cache
 from typing import Optional
 from .config import SECRET_KEY, ACCESS_TOKEN_EXPIRE_MINUTES
 
-# 初始化密码上下文，确保 bcrypt 后端可用
-try:
-    pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
-except Exception as e:
-    raise RuntimeError(f"Failed to initialize bcrypt context: {e}. Please ensure bcrypt is installed: pip install bcrypt")
+# passlib / jose 导入较慢，首次使用时再加载，缩短 worker 冷启动时间
+@lru_cache(maxsize=None)
+def _pwd_context():
+    from passlib.context import CryptContext
+    try:
+        return CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+    except Exception as e:
+        raise RuntimeError(f"Failed to initialize bcrypt context: {e}. Please ensure bcrypt is installed: pip install bcrypt")
+
+def _jwt():
+    from jose import jwt
+    return jwt
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return _pwd_context().hash(password)
 
 def verify_password(password: str, password_hash: str) -> bool:
-    return pwd_context.verify(password, password_hash)
+    return _pwd_context().verify(password, password_hash)
 
 def create_access_token(subject: str, expires_minutes: Optional[int] = None):
     expire = datetime.now() + timedelta(minutes=(expires_minutes or ACCESS_TOKEN_EXPIRE_MINUTES))
     payload = {"sub": subject, "exp": expire}
-    token = jwt.encode(payload, SECRET_KEY, algorithm="HS256")
+    token = _jwt().encode(payload, SECRET_KEY, algorithm="HS256")
     return token
 
 def decode_token(token: str):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        payload = _jwt().decode(token, SECRET_KEY, algorithms=["HS256"])
         return payload
     except Exception as e:
         print(f"Token decode error: {e}")
         return None
+
+# GB2312 一级汉字按拼音排序，各声母首字的区位码边界
+_GB2312_INITIALS = [
+    (0xB0A1, "a"), (0xB0C5, "b"), (0xB2C1, "c"), (0xB4EE, "d"), (0xB6EA, "e"), (0xB7A2, "f"),
+    (0xB8C1, "g"), (0xB9FE, "h"), (0xBBF7, "j"), (0xBFA6, "k"), (0xC0AC, "l"), (0xC2E8, "m"),
+    (0xC4C3, "n"), (0xC5B6, "o"), (0xC5BE, "p"), (0xC6DA, "q"), (0xC8BB, "r"), (0xC8F6, "s"),
+    (0xCBFA, "t"), (0xCDDA, "w"), (0xCEF4, "x"), (0xD1B9, "y"), (0xD4D1, "z"),
+]
+_GB2312_LEVEL1_END = 0xD7F9
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:  # 可选依赖：未安装时仅覆盖 GB2312 一级常用汉字
+    lazy_pinyin = None
+
+
+def _char_initial(ch: str) -> str:
+    if lazy_pinyin is not None:
+        letters = lazy_pinyin(ch, style=Style.FIRST_LETTER, errors="ignore")
+        return letters[0][:1].lower() if letters and letters[0] else ""
+    try:
+        raw = ch.encode("gb2312")
+    except UnicodeEncodeError:
+        return ""
+    if len(raw) != 2:
+        return ""
+    code = (raw[0] << 8) + raw[1]
+    if code < _GB2312_INITIALS[0][0] or code > _GB2312_LEVEL1_END:
+        return ""
+    initial = ""
+    for boundary, letter in _GB2312_INITIALS:
+        if code < boundary:
+            break
+        initial = letter
+    return initial
+
+
+def pinyin_initials(value: Optional[str]) -> str:
+    """拼音首字母：'张三' -> 'zs'，英文与数字原样转小写保留"""
+    if not value:
+        return ""
+    result = []
+    for ch in value:
+        if ch.isascii():
+            if ch.isalnum():
+                result.append(ch.lower())
+        else:
+            result.append(_char_initial(ch))
+    return "".join(result)
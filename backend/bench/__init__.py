@@ -0,0 +1 @@
+"""性能基准：数据生成（datagen）与 crud 热点路径基准（bench_crud），在 backend 目录下以 python -m bench.xxx 运行"""
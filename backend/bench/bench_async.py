@@ -0,0 +1,97 @@
+"""异步读路径基准
+
+同样的 worker 数（默认 1，即同样的 CPU）下，分别以 WF_ASYNC_DB=0（同步端点 + 线程池）与
+WF_ASYNC_DB=1（async 端点 + 异步驱动）启动服务，用只读的 browse 场景（待办、我发起的、
+流程详情、首页统计）在不同并发下压测，比较吞吐与尾延迟。
+
+并发超过线程池大小（默认 40）后，线程池模式下请求要排队等线程；异步模式的并发上限是连接池
+（pool_size + max_overflow），数据库往返越慢（远程 PostgreSQL）差距越明显。本机 SQLite 的查询
+几乎全是 CPU 时间，两者接近属正常。
+
+    python -m bench.datagen --db /tmp/bench.sqlite --instances 100000
+    python -m bench.bench_async --db /tmp/bench.sqlite --users 20,100,300 --duration 30
+    python -m bench.bench_async --database-url postgresql+psycopg2://... --out bench/results/async.json
+
+需要安装 httpx 以及 aiosqlite / asyncpg。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from datetime import datetime
+
+from . import loadtest
+
+MODES = (("threadpool", "0"), ("async", "1"))
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Compare the async read path with the threadpool")
+    p.add_argument("--db", help="SQLite file (sets WF_DB)")
+    p.add_argument("--database-url", help="PostgreSQL URL (sets DATABASE_URL)")
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--users", default="20,100,300", help="comma separated concurrency levels")
+    p.add_argument("--duration", type=float, default=30)
+    p.add_argument("--ramp", type=float, default=2)
+    p.add_argument("--think", type=float, default=0.0)
+    p.add_argument("--accounts", type=int, default=100)
+    p.add_argument("--startup-timeout", type=float, default=600)
+    p.add_argument("--out", help="write results to this JSON file")
+    return p.parse_args(argv)
+
+
+def _run_mode(args, flag, levels):
+    os.environ["WF_ASYNC_DB"] = flag
+    lt_args = loadtest.parse_args([
+        "--start", "--workers", str(args.workers), "--duration", str(args.duration), "--ramp", str(args.ramp),
+        "--think", str(args.think), "--scenarios", "browse", "--accounts", str(args.accounts),
+        "--startup-timeout", str(args.startup_timeout), "--reuse-session",
+    ])
+    lt_args.db, lt_args.database_url = args.db, args.database_url
+    proc, base_url = loadtest.start_server(lt_args)
+    rows = []
+    try:
+        for users in levels:
+            lt_args.users = users
+            (overall, endpoints), elapsed = asyncio.run(loadtest.drive(lt_args, base_url))
+            rows.append(dict(overall, users=users, duration_s=round(elapsed, 1), endpoints=endpoints))
+    finally:
+        loadtest.stop_server(proc)
+    return rows
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.db and not args.database_url:
+        raise SystemExit("pass --db or --database-url")
+    levels = [int(x) for x in args.users.split(",") if x.strip()]
+    results = {}
+    for name, flag in MODES:
+        print(f"[{name}] users {levels} ...", file=sys.stderr)
+        results[name] = _run_mode(args, flag, levels)
+
+    print(f"\n{'mode':11} {'users':>6} {'rps':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}")
+    for name, rows in results.items():
+        for r in rows:
+            print(f"{name:11} {r['users']:6} {r['rps']:9.1f} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} "
+                  f"{r['p99_ms']:8.1f} {r['errors']:7}")
+    for base, fast in zip(results["threadpool"], results["async"]):
+        gain = fast["rps"] / base["rps"] if base["rps"] else 0
+        print(f"users {base['users']:4}: async/threadpool throughput {gain:.2f}x")
+    if args.out:
+        report = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "database": "postgres" if args.database_url else "sqlite",
+            "workers": args.workers,
+            "think_s": args.think,
+            "results": results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
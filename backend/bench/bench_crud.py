@@ -0,0 +1,187 @@
+"""crud 热点路径微基准
+
+在 datagen 生成的数据库上逐个调用 crud 函数，记录耗时分布与 SQL 语句数，结果写成 JSON，
+便于在不同提交之间比较：
+
+    python -m bench.datagen --db /tmp/bench.sqlite --instances 200000
+    python -m bench.bench_crud --db /tmp/bench.sqlite --out bench/results/$(git rev-parse --short HEAD).json
+    python -m bench.bench_crud --db /tmp/bench.sqlite --compare bench/results/<旧提交>.json
+
+create_instance / complete_task 会写入少量新数据（每次迭代一条流程），反复运行对结果影响可忽略。
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from .datagen import configure
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark crud hot paths")
+    p.add_argument("--db", help="SQLite file (sets WF_DB)")
+    p.add_argument("--database-url", help="PostgreSQL URL (sets DATABASE_URL)")
+    p.add_argument("--repeat", type=int, default=10)
+    p.add_argument("--warmup", type=int, default=1)
+    p.add_argument("--cases", help="comma separated subset of cases to run")
+    p.add_argument("--out", help="write results to this JSON file")
+    p.add_argument("--compare", help="baseline JSON to compare medians against")
+    p.add_argument("--fail-over", type=float, default=0.25,
+                   help="exit non-zero when a median regresses by more than this fraction (with --compare)")
+    return p.parse_args(argv)
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def build_cases():
+    """返回 {名称: (setup, call)}；setup 的返回值作为 call 的参数，不计入耗时"""
+    from sqlmodel import Session, select
+    from sqlalchemy import func
+    from app import crud
+    from app.models import Task, ProcessTemplate
+
+    with Session(crud.engine) as s:
+        busiest = s.exec(
+            select(Task.assignee, func.count(Task.id))
+            .where(Task.status == "pending")
+            .group_by(Task.assignee)
+            .order_by(func.count(Task.id).desc())
+            .limit(1)
+        ).first()
+        template_id = s.exec(select(ProcessTemplate.id).order_by(ProcessTemplate.created_at).limit(1)).first()
+    if not busiest or not template_id:
+        raise SystemExit("database has no data, run python -m bench.datagen first")
+    assignee = busiest[0]
+
+    def new_instance(_=None):
+        _, task = crud.create_instance(template_id, {"title": "bench", "priority": "中"}, assignee)
+        return task
+
+    return {
+        "get_tasks_for_user": (None, lambda _: crud.get_tasks_for_user(assignee)),
+        "list_all_tasks_admin": (None, lambda _: crud.list_all_tasks_admin()),
+        "list_all_instances_for_monitoring": (None, lambda _: crud.list_all_instances_for_monitoring()),
+        "get_dashboard_stats_admin": (None, lambda _: crud.get_dashboard_stats("admin", "admin")),
+        "get_dashboard_stats_user": (None, lambda _: crud.get_dashboard_stats(assignee, "user")),
+        "create_instance": (None, new_instance),
+        "complete_task": (new_instance, lambda task: crud.complete_task(task.id, task.assignee, "approve", "同意")),
+    }, {"busiest_assignee": assignee, "pending_for_assignee": busiest[1]}
+
+
+def run_case(setup, call, repeat: int, warmup: int):
+    from app import querylog
+
+    for _ in range(warmup):
+        call(setup() if setup else None)
+    timings = []
+    queries = None
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        with querylog.capture() as stats:
+            start = time.perf_counter()
+            result = call(arg)
+            elapsed = time.perf_counter() - start
+        timings.append(elapsed * 1000)
+        queries = stats.count
+    rows = len(result) if isinstance(result, list) else None
+    return {
+        "runs": repeat,
+        "min_ms": round(min(timings), 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "mean_ms": round(statistics.mean(timings), 3),
+        "p95_ms": round(_percentile(timings, 95), 3),
+        "max_ms": round(max(timings), 3),
+        "queries": queries,
+        "rows": rows,
+    }
+
+
+def dataset_summary():
+    from sqlmodel import Session, select
+    from sqlalchemy import func
+    from app import crud
+    from app.models import User, ProcessTemplate, ProcessInstance, Task
+
+    with Session(crud.engine) as s:
+        return {
+            "dialect": crud.engine.dialect.name,
+            "users": s.exec(select(func.count(User.id))).one(),
+            "templates": s.exec(select(func.count(ProcessTemplate.id))).one(),
+            "instances": s.exec(select(func.count(ProcessInstance.id))).one(),
+            "tasks": s.exec(select(func.count(Task.id))).one(),
+        }
+
+
+def compare(results, baseline_path, fail_over):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressed = []
+    print(f"\n{'case':40} {'base ms':>10} {'now ms':>10} {'change':>8}")
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        change = (r["median_ms"] - base["median_ms"]) / base["median_ms"] if base["median_ms"] else 0
+        print(f"{name:40} {base['median_ms']:10.2f} {r['median_ms']:10.2f} {change:+8.1%}")
+        if change > fail_over:
+            regressed.append(name)
+    return regressed
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure(args)
+    cases, context = build_cases()
+    if args.cases:
+        wanted = [c.strip() for c in args.cases.split(",") if c.strip()]
+        unknown = [c for c in wanted if c not in cases]
+        if unknown:
+            raise SystemExit(f"unknown cases: {', '.join(unknown)} (available: {', '.join(cases)})")
+        cases = {name: cases[name] for name in wanted}
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "dataset": dataset_summary(),
+        "context": context,
+        "results": {},
+    }
+    for name, (setup, call) in cases.items():
+        r = run_case(setup, call, args.repeat, args.warmup)
+        report["results"][name] = r
+        print(f"{name:40} median {r['median_ms']:9.2f}ms  p95 {r['p95_ms']:9.2f}ms  queries {r['queries']}")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"results written to {args.out}")
+    if args.compare:
+        regressed = compare(report["results"], args.compare, args.fail_over)
+        if regressed:
+            print(f"regressions over {args.fail_over:.0%}: {', '.join(regressed)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""主键类型基准：UUID4 与 UUIDv7 的插入与范围扫描
+
+对每种主键各建一张与任务表相近的表（文本主键 + 流程 id + 创建时间 + 一段载荷），按批插入
+--rows 行，记录每 10% 的插入速率（表超过缓存后 UUID4 的随机插入会明显变慢），再比较：
+
+- 存储：表与索引占用的空间；
+- 主键分页：从随机位置按主键顺序连续取 --pages 页，每页 --page-size 行（keyset 分页）；
+- 时间窗口：取最近 10% 的行。UUIDv7 直接按主键范围扫描，UUID4 只能走 created_at 索引再回表。
+
+    python -m bench.bench_ids --rows 500000 --cache-mb 8
+    python -m bench.bench_ids --database-url postgresql://... --rows 1000000 --out bench/results/ids.json
+
+--cache-mb 限制 SQLite 的页缓存，模拟表远大于内存的情况；PostgreSQL 上额外测一组原生 uuid 类型（uuid7-native）。
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from app.models import uuid7  # noqa: E402
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Insert and range-scan cost of UUID4 vs UUIDv7 primary keys")
+    p.add_argument("--database-url", help="PostgreSQL URL (default: temporary SQLite files)")
+    p.add_argument("--rows", type=int, default=200000)
+    p.add_argument("--batch", type=int, default=1000, help="rows per insert transaction")
+    p.add_argument("--cache-mb", type=int, default=8, help="SQLite page cache per connection")
+    p.add_argument("--page-size", type=int, default=100)
+    p.add_argument("--pages", type=int, default=50)
+    p.add_argument("--repeat", type=int, default=20)
+    p.add_argument("--kinds", help="comma separated subset of uuid4,uuid7,uuid7-native")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", help="write results to this JSON file")
+    return p.parse_args(argv)
+
+
+def _uuid4() -> str:
+    return str(uuid.uuid4())
+
+
+def _uuid7() -> str:
+    return str(uuid7())
+
+
+def _uuid7_floor(ms: int) -> str:
+    """给定毫秒时间戳的最小 UUIDv7，用作主键范围扫描的下界"""
+    return str(uuid.UUID(int=(ms << 80) | (0x7 << 76) | (0b10 << 62)))
+
+
+KINDS = {
+    # 名称: (生成函数, 主键列类型（SQLite）, 主键列类型（PostgreSQL）)
+    "uuid4": (_uuid4, "TEXT", "VARCHAR"),
+    "uuid7": (_uuid7, "TEXT", "VARCHAR"),
+    "uuid7-native": (_uuid7, None, "UUID"),
+}
+
+
+def _engine(args, workdir, kind):
+    from sqlalchemy import create_engine, event
+    if args.database_url:
+        return create_engine(args.database_url.replace("postgres://", "postgresql://", 1))
+    engine = create_engine(f"sqlite:///{os.path.join(workdir, kind + '.sqlite')}")
+
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA cache_size=-{args.cache_mb * 1024}")
+        cur.close()
+
+    return engine
+
+
+def _size_bytes(conn, table, postgres):
+    from sqlalchemy import text
+    if postgres:
+        return conn.execute(text(f"SELECT pg_total_relation_size('{table}')")).scalar()
+    page_size = conn.execute(text("PRAGMA page_size")).scalar()
+    return conn.execute(text("PRAGMA page_count")).scalar() * page_size
+
+
+def _timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(samples), 3), "max_ms": round(max(samples), 3)}
+
+
+def run_kind(args, kind, workdir):
+    from sqlalchemy import text
+    gen, sqlite_type, pg_type = KINDS[kind]
+    postgres = bool(args.database_url)
+    table = "bench_ids_" + kind.replace("-", "_")
+    engine = _engine(args, workdir, kind)
+    rng = random.Random(args.seed)
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        conn.execute(text(f"CREATE TABLE {table} (id {pg_type if postgres else sqlite_type} PRIMARY KEY, "
+                          f"instance_id VARCHAR NOT NULL, created_at TIMESTAMP NOT NULL, payload VARCHAR)"))
+        conn.execute(text(f"CREATE INDEX ix_{table}_created_at ON {table} (created_at)"))
+
+    insert = text(f"INSERT INTO {table} (id, instance_id, created_at, payload) VALUES (:id, :iid, :at, :p)")
+    payload = "x" * 120
+    segment = max(args.rows // 10, args.batch)
+    rates, seg_rows, seg_start = [], 0, time.perf_counter()
+    window_start = None
+    started = time.perf_counter()
+    inserted = 0
+    while inserted < args.rows:
+        n = min(args.batch, args.rows - inserted)
+        now = datetime.now()
+        rows = [{"id": gen(), "iid": gen(), "at": now, "p": payload} for _ in range(n)]
+        with engine.begin() as conn:
+            conn.execute(insert, rows)
+        inserted += n
+        seg_rows += n
+        if window_start is None and inserted >= args.rows * 0.9:
+            window_start = now
+        if seg_rows >= segment:
+            elapsed = time.perf_counter() - seg_start
+            rates.append(round(seg_rows / elapsed))
+            seg_rows, seg_start = 0, time.perf_counter()
+    insert_s = time.perf_counter() - started
+
+    with engine.connect() as conn:
+        if postgres:
+            conn.execute(text(f"ANALYZE {table}"))
+        else:
+            conn.execute(text("ANALYZE"))
+        size = _size_bytes(conn, table, postgres)
+        ids = [r[0] for r in conn.execute(text(f"SELECT id FROM {table} ORDER BY random() LIMIT 200"))]
+
+        page_sql = text(f"SELECT id, instance_id, payload FROM {table} WHERE id > :after ORDER BY id LIMIT :n")
+
+        def paginate():
+            after = rng.choice(ids)
+            for _ in range(args.pages):
+                rows = conn.execute(page_sql, {"after": after, "n": args.page_size}).all()
+                if not rows:
+                    break
+                after = rows[-1][0]
+
+        if kind == "uuid4":
+            window_sql = text(f"SELECT id, instance_id, payload FROM {table} WHERE created_at >= :at")
+            window_params = {"at": window_start}
+        else:
+            window_sql = text(f"SELECT id, instance_id, payload FROM {table} WHERE id >= :floor")
+            window_params = {"floor": _uuid7_floor(int(window_start.timestamp() * 1000))}
+        window_rows = len(conn.execute(window_sql, window_params).all())
+
+        result = {
+            "insert_rows_per_s": round(args.rows / insert_s),
+            "insert_rate_by_decile": rates,
+            "size_mb": round(size / 1024 / 1024, 1),
+            "paginate": _timed(paginate, args.repeat),
+            "time_window": dict(_timed(lambda: conn.execute(window_sql, window_params).all(), args.repeat),
+                                rows=window_rows),
+        }
+    if postgres:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE {table}"))
+    engine.dispose()
+    return result
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.kinds:
+        kinds = [k.strip() for k in args.kinds.split(",") if k.strip()]
+    else:
+        kinds = ["uuid4", "uuid7"] + (["uuid7-native"] if args.database_url else [])
+    unknown = [k for k in kinds if k not in KINDS]
+    if unknown:
+        raise SystemExit(f"unknown kinds: {', '.join(unknown)}")
+    if not args.database_url and "uuid7-native" in kinds:
+        raise SystemExit("uuid7-native needs --database-url (SQLite has no uuid type)")
+
+    workdir = tempfile.mkdtemp(prefix="wf-ids-")
+    results = {}
+    try:
+        for kind in kinds:
+            print(f"[{kind}] inserting {args.rows} rows ...", file=sys.stderr)
+            results[kind] = run_kind(args, kind, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{'kind':13} {'insert/s':>9} {'first 10%':>10} {'last 10%':>9} {'size':>8} "
+          f"{'paginate':>10} {'window':>10}")
+    for kind, r in results.items():
+        rates = r["insert_rate_by_decile"] or [0]
+        print(f"{kind:13} {r['insert_rows_per_s']:9} {rates[0]:10} {rates[-1]:9} {r['size_mb']:6.1f}MB "
+              f"{r['paginate']['median_ms']:8.2f}ms {r['time_window']['median_ms']:8.2f}ms")
+    if args.out:
+        report = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "database": "postgres" if args.database_url else "sqlite",
+            "rows": args.rows,
+            "batch": args.batch,
+            "cache_mb": None if args.database_url else args.cache_mb,
+            "results": results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
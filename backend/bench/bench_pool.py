@@ -0,0 +1,186 @@
+"""连接池等待时间基准
+
+对每组连接池配置（pool_size / max_overflow）与探活方式（WF_PG_PRE_PING）各启动一个子进程，
+用多于连接数的线程同时执行读操作（待办列表、首页统计）与少量写操作（发起流程、审批），
+从 wf_db_pool_checkout_wait_seconds 直方图读出取连接的等待时间：均值、按桶估算的 p50/p95/p99、
+等待超过 1ms 的取连接比例，以及各配置下的吞吐。
+
+    python -m bench.bench_pool --db /tmp/bench.sqlite --threads 32 --pools 5+10,10+20,20+0
+    python -m bench.bench_pool --database-url postgresql://... --pre-ping always,idle,off --out bench/results/pool.json
+
+SQLite 的查询几乎全是 CPU 时间，等待主要来自 GIL 与写入排队；PostgreSQL 的往返延迟更能体现池大小的影响。
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Connection pool checkout wait per pool configuration")
+    p.add_argument("--db", help="SQLite file generated by bench.datagen (sets WF_DB; writes go to this file)")
+    p.add_argument("--database-url", help="PostgreSQL URL (sets DATABASE_URL)")
+    p.add_argument("--pools", default="5+10,10+20", help="comma separated pool_size+max_overflow pairs")
+    p.add_argument("--pre-ping", default="idle", help="comma separated WF_PG_PRE_PING modes (PostgreSQL only)")
+    p.add_argument("--threads", type=int, default=32)
+    p.add_argument("--write-ratio", type=float, default=0.05)
+    p.add_argument("--duration", type=float, default=20)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", help="write results to this JSON file")
+    p.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    return p.parse_args(argv)
+
+
+def _bucket_percentile(buckets, counts, pct):
+    """按直方图桶估算分位数，返回所在桶的上界（秒）"""
+    total = sum(counts)
+    if not total:
+        return 0.0
+    target = pct / 100.0 * total
+    cumulative = 0
+    for bound, count in zip(buckets, counts):
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return buckets[-1]
+
+
+def run_child(args):
+    """按环境变量中的连接池配置施压，结果以 JSON 打印到 stdout"""
+    sys.path.insert(0, BACKEND_DIR)
+    from sqlmodel import Session, select
+    from sqlalchemy import func
+    from app import crud, metrics
+    from app.models import Task, ProcessTemplate
+
+    with Session(crud.engine) as s:
+        assignees = list(s.exec(
+            select(Task.assignee).where(Task.status == "pending").group_by(Task.assignee)
+            .order_by(func.count(Task.id).desc()).limit(50)
+        ).all())
+        template_id = s.exec(select(ProcessTemplate.id).order_by(ProcessTemplate.created_at).limit(1)).first()
+    if not assignees or not template_id:
+        raise SystemExit("database has no data, run python -m bench.datagen first")
+    # 只统计压测期间的等待
+    with metrics.DB_POOL_WAIT._lock:
+        metrics.DB_POOL_WAIT._values.clear()
+
+    def write(rng):
+        _, task = crud.create_instance(template_id, {"title": "bench", "priority": "中"}, rng.choice(assignees))
+        if task.assignee:
+            crud.complete_task(task.id, task.assignee, "approve", "同意")
+
+    reads = (
+        lambda rng: crud.get_tasks_for_user(rng.choice(assignees)),
+        lambda rng: crud.get_dashboard_stats(rng.choice(assignees), "user"),
+    )
+    done = {"ops": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def loop(seed):
+        rng = random.Random(seed)
+        while time.monotonic() < deadline:
+            try:
+                if rng.random() < args.write_ratio:
+                    write(rng)
+                else:
+                    rng.choice(reads)(rng)
+                key = "ops"
+            except Exception:
+                key = "errors"
+            with lock:
+                done[key] += 1
+
+    threads = [threading.Thread(target=loop, args=(args.seed * 1000 + i,)) for i in range(args.threads)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+
+    with metrics.DB_POOL_WAIT._lock:
+        state = list(metrics.DB_POOL_WAIT._values.get((), [0] * len(metrics.DB_POOL_WAIT.buckets) + [0.0, 0]))
+    buckets = metrics.DB_POOL_WAIT.buckets
+    counts, wait_sum, checkouts = state[:-2], state[-2], state[-1]
+    waited = sum(c for bound, c in zip(buckets, counts) if bound > 0.001)
+    print(json.dumps({
+        "ops_per_s": round(done["ops"] / elapsed, 1),
+        "errors": done["errors"],
+        "checkouts": checkouts,
+        "wait_mean_ms": round(wait_sum / checkouts * 1000, 3) if checkouts else 0,
+        "wait_p50_ms": _bucket_percentile(buckets, counts, 50) * 1000,
+        "wait_p95_ms": _bucket_percentile(buckets, counts, 95) * 1000,
+        "wait_p99_ms": _bucket_percentile(buckets, counts, 99) * 1000,
+        "waited_over_1ms": round(waited / checkouts, 4) if checkouts else 0,
+    }))
+
+
+def run_config(args, pool_size, max_overflow, pre_ping):
+    env = dict(os.environ, WF_JOBS="0", WF_DB_POOL_SIZE=str(pool_size), WF_DB_MAX_OVERFLOW=str(max_overflow),
+               WF_PG_PRE_PING=pre_ping)
+    if args.database_url:
+        env["DATABASE_URL"] = args.database_url
+    else:
+        env.pop("DATABASE_URL", None)
+        env["WF_DB"] = os.path.abspath(args.db)
+    cmd = [sys.executable, "-m", "bench.bench_pool", "--child", "--threads", str(args.threads),
+           "--write-ratio", str(args.write_ratio), "--duration", str(args.duration), "--seed", str(args.seed)]
+    proc = subprocess.run(cmd, cwd=BACKEND_DIR, env=env, stdout=subprocess.PIPE)
+    if proc.returncode:
+        raise SystemExit(f"child exited with code {proc.returncode}")
+    return json.loads(proc.stdout.decode().strip().splitlines()[-1])
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        return run_child(args)
+    if not args.db and not args.database_url:
+        raise SystemExit("pass --db or --database-url")
+    pools = []
+    for item in args.pools.split(","):
+        size, _, overflow = item.strip().partition("+")
+        pools.append((int(size), int(overflow or 0)))
+    # 探活方式只影响 PostgreSQL
+    modes = [m.strip() for m in args.pre_ping.split(",") if m.strip()] if args.database_url else ["idle"]
+
+    rows = []
+    for pool_size, max_overflow in pools:
+        for mode in modes:
+            print(f"[pool {pool_size}+{max_overflow}, pre-ping {mode}] {args.threads} threads, "
+                  f"{args.duration:.0f}s ...", file=sys.stderr)
+            r = run_config(args, pool_size, max_overflow, mode)
+            rows.append(dict(r, pool_size=pool_size, max_overflow=max_overflow, pre_ping=mode))
+
+    print(f"\n{'pool':>7} {'ping':>6} {'ops/s':>8} {'wait mean':>10} {'p50':>7} {'p95':>7} {'p99':>7} "
+          f"{'>1ms':>6} {'errors':>7}")
+    for r in rows:
+        print(f"{r['pool_size']:>3}+{r['max_overflow']:<3} {r['pre_ping']:>6} {r['ops_per_s']:8.1f} "
+              f"{r['wait_mean_ms']:9.2f}ms {r['wait_p50_ms']:7.1f} {r['wait_p95_ms']:7.1f} {r['wait_p99_ms']:7.1f} "
+              f"{r['waited_over_1ms']:6.1%} {r['errors']:7}")
+    if args.out:
+        report = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "database": "postgres" if args.database_url else "sqlite",
+            "threads": args.threads,
+            "write_ratio": args.write_ratio,
+            "duration_s": args.duration,
+            "results": rows,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
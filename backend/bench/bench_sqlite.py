@@ -0,0 +1,207 @@
+"""SQLite 配置对比：混合读写吞吐
+
+把 datagen 生成的数据库分别复制成 default（回滚日志、无写入排队）与 production
+（WAL + PRAGMA + 写入排队）两份，在每份上用多个线程（可选多个进程，对应多 worker 部署）
+同时执行读操作（待办列表、首页统计）与写操作（发起流程、审批），统计各自的吞吐、延迟
+与 “database is locked” 等错误数。
+
+    python -m bench.datagen --db /tmp/bench.sqlite --instances 50000
+    python -m bench.bench_sqlite --db /tmp/bench.sqlite --threads 16 --write-ratio 0.2 --duration 20
+    python -m bench.bench_sqlite --db /tmp/bench.sqlite --procs 4 --threads 8 --out bench/results/sqlite.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILES = ("default", "production")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Mixed read/write throughput per SQLite profile")
+    p.add_argument("--db", required=True, help="source SQLite file generated by bench.datagen (not modified)")
+    p.add_argument("--threads", type=int, default=16, help="threads per process")
+    p.add_argument("--procs", type=int, default=1, help="processes sharing the database (like run.py prod workers)")
+    p.add_argument("--write-ratio", type=float, default=0.2, help="fraction of operations that write")
+    p.add_argument("--duration", type=float, default=20)
+    p.add_argument("--profiles", default=",".join(PROFILES))
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", help="write results to this JSON file")
+    p.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    return p.parse_args(argv)
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+
+def run_child(args):
+    """在当前进程内按 WF_SQLITE_PROFILE 打开数据库并施压，结果以 JSON 打印到 stdout"""
+    os.environ["WF_DB"] = os.path.abspath(args.db)
+    os.environ.pop("DATABASE_URL", None)
+    sys.path.insert(0, BACKEND_DIR)
+    from sqlmodel import Session, select
+    from sqlalchemy import func
+    from app import crud
+    from app.models import Task, ProcessTemplate
+
+    with Session(crud.engine) as s:
+        assignees = list(s.exec(
+            select(Task.assignee).where(Task.status == "pending").group_by(Task.assignee)
+            .order_by(func.count(Task.id).desc()).limit(50)
+        ).all())
+        template_id = s.exec(select(ProcessTemplate.id).order_by(ProcessTemplate.created_at).limit(1)).first()
+    if not assignees or not template_id:
+        raise SystemExit("database has no data, run python -m bench.datagen first")
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def write(rng):
+        _, task = crud.create_instance(template_id, {"title": "bench", "priority": "中"}, rng.choice(assignees))
+        if task.assignee:
+            crud.complete_task(task.id, task.assignee, "approve", "同意")
+
+    operations = {
+        "read_todo": lambda rng: crud.get_tasks_for_user(rng.choice(assignees)),
+        "read_dashboard": lambda rng: crud.get_dashboard_stats(rng.choice(assignees), "user"),
+        "write_start_approve": write,
+    }
+
+    def loop(seed):
+        rng = random.Random(seed)
+        while time.monotonic() < deadline:
+            if rng.random() < args.write_ratio:
+                name = "write_start_approve"
+            else:
+                name = rng.choice(("read_todo", "read_dashboard"))
+            start = time.perf_counter()
+            try:
+                operations[name](rng)
+                ok = True
+            except Exception as e:
+                ok = False
+                key = "locked" if "locked" in str(e) else type(e).__name__
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                if ok:
+                    latencies[name].append(elapsed)
+                else:
+                    errors[key] += 1
+
+    threads = [threading.Thread(target=loop, args=(args.seed * 1000 + os.getpid() * 100 + i,))
+               for i in range(args.threads)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print(json.dumps({"elapsed": time.monotonic() - started, "latencies": latencies, "errors": errors}))
+
+
+def _copy(source: str, dest: str, profile: str):
+    """用备份 API 复制（源库可能处于 WAL 模式），再按配置设置日志模式：WAL 会持久保存在库文件中"""
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(dest)
+    src.backup(dst)
+    src.close()
+    dst.execute("PRAGMA journal_mode=" + ("WAL" if profile == "production" else "DELETE"))
+    dst.close()
+
+
+def run_profile(args, profile: str, workdir: str):
+    db = os.path.join(workdir, f"{profile}.sqlite")
+    _copy(args.db, db, profile)
+    env = dict(os.environ, WF_SQLITE_PROFILE=profile, WF_JOBS="0")
+    cmd = [sys.executable, "-m", "bench.bench_sqlite", "--child", "--db", db, "--threads", str(args.threads),
+           "--write-ratio", str(args.write_ratio), "--duration", str(args.duration), "--seed", str(args.seed)]
+    procs = [subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=subprocess.PIPE) for _ in range(args.procs)]
+    latencies, errors, elapsed = defaultdict(list), defaultdict(int), 0.0
+    for proc in procs:
+        out, _ = proc.communicate()
+        if proc.returncode:
+            raise SystemExit(f"{profile} child exited with code {proc.returncode}")
+        r = json.loads(out.decode().strip().splitlines()[-1])
+        elapsed = max(elapsed, r["elapsed"])
+        for name, values in r["latencies"].items():
+            latencies[name].extend(values)
+        for name, count in r["errors"].items():
+            errors[name] += count
+
+    ops = {}
+    for name, values in sorted(latencies.items()):
+        ordered = sorted(values)
+        ops[name] = {
+            "count": len(ordered),
+            "per_s": round(len(ordered) / elapsed, 1),
+            "median_ms": round(statistics.median(ordered), 2),
+            "p95_ms": round(_percentile(ordered, 95), 2),
+            "p99_ms": round(_percentile(ordered, 99), 2),
+            "max_ms": round(ordered[-1], 2),
+        }
+    reads = sum(v["count"] for k, v in ops.items() if k.startswith("read"))
+    writes = sum(v["count"] for k, v in ops.items() if k.startswith("write"))
+    return {
+        "reads_per_s": round(reads / elapsed, 1),
+        "writes_per_s": round(writes / elapsed, 1),
+        "errors": dict(errors),
+        "operations": ops,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        return run_child(args)
+    profiles = [p.strip() for p in args.profiles.split(",") if p.strip()]
+    unknown = [p for p in profiles if p not in PROFILES]
+    if unknown:
+        raise SystemExit(f"unknown profiles: {', '.join(unknown)}")
+    workdir = tempfile.mkdtemp(prefix="wf-sqlite-")
+    results = {}
+    try:
+        for profile in profiles:
+            print(f"[{profile}] {args.procs} procs x {args.threads} threads, {args.duration:.0f}s ...", file=sys.stderr)
+            results[profile] = run_profile(args, profile, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{'profile':11} {'reads/s':>9} {'writes/s':>9} {'read p95':>9} {'write p95':>10} {'write p99':>10}  errors")
+    for profile, r in results.items():
+        ops = r["operations"]
+        read_p95 = max((v["p95_ms"] for k, v in ops.items() if k.startswith("read")), default=0)
+        write = ops.get("write_start_approve", {})
+        print(f"{profile:11} {r['reads_per_s']:9.1f} {r['writes_per_s']:9.1f} {read_p95:9.1f} "
+              f"{write.get('p95_ms', 0):10.1f} {write.get('p99_ms', 0):10.1f}  {r['errors'] or '-'}")
+    if args.out:
+        report = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "procs": args.procs,
+            "threads": args.threads,
+            "write_ratio": args.write_ratio,
+            "duration_s": args.duration,
+            "results": results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
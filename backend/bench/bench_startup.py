@@ -0,0 +1,116 @@
+"""冷启动基准
+
+每次在全新子进程中测量：
+- import：导入 app.main 的耗时（同时检查导入是否创建了数据库文件，应当没有）；
+- startup：执行 lifespan 启动阶段的耗时，分别在 WF_AUTO_MIGRATE=1（每个 worker 自行迁移）
+  与 WF_AUTO_MIGRATE=0（已提前 python run.py migrate）两种模式下测量；
+- 另用 python -X importtime 列出累计耗时最多的模块，便于发现新引入的重依赖。
+
+    python -m bench.bench_startup --runs 5 --out bench/results/startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = r"""
+import asyncio, json, os, sys, time
+t0 = time.perf_counter()
+import app.main as m
+t1 = time.perf_counter()
+created = os.path.exists(os.environ["WF_DB"])
+result = {"import_s": t1 - t0, "db_created_on_import": created}
+if sys.argv[1] == "startup":
+    async def run():
+        async with m.app.router.lifespan_context(m.app):
+            result["startup_s"] = time.perf_counter() - t1
+    asyncio.run(run())
+print(json.dumps(result))
+"""
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Measure import and startup time of app.main")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--top", type=int, default=15, help="number of slowest imports to list")
+    p.add_argument("--out", help="write results to this JSON file")
+    return p.parse_args(argv)
+
+
+def _probe(mode: str, env: dict):
+    out = subprocess.check_output([sys.executable, "-c", _PROBE, mode], cwd=BACKEND_DIR, env=env,
+                                  stderr=subprocess.DEVNULL)
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def _summary(values):
+    return {"median_ms": round(statistics.median(values) * 1000, 1),
+            "min_ms": round(min(values) * 1000, 1), "max_ms": round(max(values) * 1000, 1)}
+
+
+def slowest_imports(env: dict, top: int):
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"], cwd=BACKEND_DIR, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    rows = []
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "").split("|")]
+        if not self_us.isdigit():
+            continue
+        # 只保留顶层包与本项目模块，避免子模块重复计入
+        if "." in name and not name.startswith("app."):
+            continue
+        rows.append({"module": name, "cumulative_ms": round(int(cumulative_us) / 1000, 1),
+                     "self_ms": round(int(self_us) / 1000, 1)})
+    return sorted(rows, key=lambda r: -r["cumulative_ms"])[:top]
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="wf-startup-")
+    db = os.path.join(workdir, "startup.sqlite")
+    env = dict(os.environ, WF_DB=db, WF_JOBS="0", WF_PROFILE_DIR=os.path.join(workdir, "profiles"))
+    env.pop("DATABASE_URL", None)
+
+    imports, created = [], False
+    for _ in range(args.runs):
+        r = _probe("import", env)
+        imports.append(r["import_s"])
+        created = created or r["db_created_on_import"]
+
+    # 先迁移一次，之后测量的是“已有数据库”上的启动
+    subprocess.check_call([sys.executable, "run.py", "migrate"], cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+    startup = {}
+    for auto in ("1", "0"):
+        values = [_probe("startup", dict(env, WF_AUTO_MIGRATE=auto))["startup_s"] for _ in range(args.runs)]
+        startup["auto_migrate" if auto == "1" else "pre_migrated"] = _summary(values)
+
+    report = {
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        "import": _summary(imports),
+        "import_creates_db": created,
+        "startup": startup,
+        "slowest_imports": slowest_imports(env, args.top),
+    }
+    print(f"import app.main     median {report['import']['median_ms']}ms (creates db: {created})")
+    for name, r in startup.items():
+        print(f"startup {name:12} median {r['median_ms']}ms")
+    print("slowest imports:")
+    for r in report["slowest_imports"]:
+        print(f"  {r['module']:40} {r['cumulative_ms']:8.1f}ms")
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""worker 数扩展性基准
+
+对每种数据库、每个 worker 数分别用 python run.py prod 启动服务，跑同一段压测，
+比较吞吐量与尾延迟随 worker 数的变化。默认不留思考时间，让服务端始终处于饱和状态。
+SQLite 写事务全局串行，预期在写比例较高的场景下提升有限；PostgreSQL 应接近按核数线性增长，
+直到数据库本身或连接数（worker 数 × 连接池大小）成为瓶颈。
+
+    python -m bench.datagen --db /tmp/bench.sqlite --instances 100000
+    python -m bench.bench_workers --db /tmp/bench.sqlite --workers 1,2,4 --users 64 --duration 30
+    python -m bench.bench_workers --database-url postgresql://... --workers 1,2,4,8 --out bench/results/workers.json
+
+可同时传入 --db 与 --database-url 依次测量两种数据库。压测账号、场景参数与 loadtest 相同。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from datetime import datetime
+
+from . import loadtest
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Throughput scaling with worker processes")
+    p.add_argument("--db", help="SQLite file (sets WF_DB)")
+    p.add_argument("--database-url", help="PostgreSQL URL (sets DATABASE_URL)")
+    p.add_argument("--workers", default=f"1,2,{max(os.cpu_count() or 1, 4)}",
+                   help="comma separated worker counts")
+    p.add_argument("--users", type=int, default=64)
+    p.add_argument("--duration", type=float, default=30)
+    p.add_argument("--ramp", type=float, default=2)
+    p.add_argument("--think", type=float, default=0.0)
+    p.add_argument("--scenarios", default="approve=3,launch=1,dashboard=6")
+    p.add_argument("--accounts", type=int, default=100)
+    p.add_argument("--startup-timeout", type=float, default=600)
+    p.add_argument("--out", help="write results to this JSON file")
+    return p.parse_args(argv)
+
+
+def _run_one(args, db, database_url, workers):
+    lt_args = loadtest.parse_args([
+        "--start", "--workers", str(workers), "--users", str(args.users), "--duration", str(args.duration),
+        "--ramp", str(args.ramp), "--think", str(args.think), "--poll-interval", str(args.think),
+        "--scenarios", args.scenarios, "--accounts", str(args.accounts),
+        "--startup-timeout", str(args.startup_timeout), "--reuse-session",
+    ])
+    lt_args.db, lt_args.database_url = db, database_url
+    proc, base_url = loadtest.start_server(lt_args)
+    try:
+        (overall, _), elapsed = asyncio.run(loadtest.drive(lt_args, base_url))
+    finally:
+        loadtest.stop_server(proc)
+    return dict(overall, workers=workers, duration_s=round(elapsed, 1))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    targets = []
+    if args.db:
+        targets.append(("sqlite", args.db, None))
+    if args.database_url:
+        targets.append(("postgres", None, args.database_url))
+    if not targets:
+        raise SystemExit("pass --db and/or --database-url")
+    counts = [int(x) for x in args.workers.split(",") if x.strip()]
+
+    results = {}
+    for name, db, database_url in targets:
+        rows = []
+        for workers in counts:
+            print(f"[{name}] {workers} workers ...", file=sys.stderr)
+            rows.append(_run_one(args, db, database_url, workers))
+        base = rows[0]["rps"] or 1
+        for row in rows:
+            row["speedup"] = round(row["rps"] / base, 2)
+        results[name] = rows
+
+    print(f"\n{'database':10} {'workers':>7} {'rps':>9} {'speedup':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}")
+    for name, rows in results.items():
+        for r in rows:
+            print(f"{name:10} {r['workers']:7} {r['rps']:9.1f} {r['speedup']:7.2f}x "
+                  f"{r['p50_ms']:8.1f} {r['p95_ms']:8.1f} {r['p99_ms']:8.1f} {r['errors']:7}")
+    if args.out:
+        report = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "cpus": os.cpu_count(),
+            "users": args.users,
+            "think_s": args.think,
+            "scenarios": args.scenarios,
+            "results": results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""端到端 HTTP 压测
+
+用异步 httpx 客户端模拟多个并发用户，按权重回放典型操作路径：
+- approve：登录 → 待办列表 → 流程详情 → 审批通过
+- launch：登录 → 模板列表 → 上传附件 → 发起流程
+- dashboard：登录 → 每隔一段时间轮询首页统计
+- browse：登录 → 待办 → 我发起的 → 流程详情 → 首页统计（只读，对应 async 端点）
+
+输出每个接口的吞吐量与 p50/p95/p99 延迟，可写成 JSON 与历史结果对比。
+账号默认使用 datagen 生成的 user00000… / bench123（--accounts 不要超过生成的用户数）。
+launch 场景会真实上传文件到服务端的上传目录，压测完成后可自行清理。
+
+    python -m bench.datagen --db /tmp/bench.sqlite --instances 100000
+    python -m bench.loadtest --db /tmp/bench.sqlite --start --workers 2 --users 50 --duration 60
+    python -m bench.loadtest --base-url http://127.0.0.1:8000 --scenarios approve=1,dashboard=3
+
+需要额外安装 httpx（pip install httpx）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from collections import defaultdict
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SCENARIOS = "approve=3,launch=1,dashboard=6"
+# 把路径中的 id 归一化，按接口模板聚合统计
+_ID_RE = re.compile(r"/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|/\d+(?=/|$)")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="HTTP load test with scripted user journeys")
+    p.add_argument("--base-url", default=None, help="target an already running server")
+    p.add_argument("--start", action="store_true", help="start a local server (python run.py prod) for the run")
+    p.add_argument("--db", help="SQLite file for --start (sets WF_DB)")
+    p.add_argument("--database-url", help="PostgreSQL URL for --start (sets DATABASE_URL)")
+    p.add_argument("--workers", type=int, default=1, help="worker processes for --start (python run.py prod)")
+    p.add_argument("--startup-timeout", type=float, default=600,
+                   help="seconds to wait for --start (the first start on a datagen database rebuilds the search index)")
+    p.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    p.add_argument("--duration", type=float, default=30, help="seconds to run after ramp-up starts")
+    p.add_argument("--ramp", type=float, default=5, help="seconds over which virtual users are started")
+    p.add_argument("--think", type=float, default=1.0, help="mean think time between steps (seconds)")
+    p.add_argument("--poll-interval", type=float, default=15, help="dashboard polling interval (seconds)")
+    p.add_argument("--scenarios", default=DEFAULT_SCENARIOS, help="weighted scenarios, e.g. approve=3,dashboard=6")
+    p.add_argument("--accounts", type=int, default=200, help="log in as user00000..user{N-1}")
+    p.add_argument("--password", default="bench123")
+    p.add_argument("--reuse-session", action="store_true", help="log in once per virtual user instead of per journey")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", help="write results to this JSON file")
+    return p.parse_args(argv)
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def add(self, name: str, seconds: float, status: int):
+        self.latencies[name].append(seconds * 1000)
+        self.statuses[name][status] += 1
+        if status >= 400 or status == 0:
+            self.errors[name] += 1
+
+    def report(self, elapsed: float):
+        endpoints = {}
+        for name, values in sorted(self.latencies.items()):
+            ordered = sorted(values)
+            endpoints[name] = {
+                "count": len(ordered),
+                "errors": self.errors[name],
+                "rps": round(len(ordered) / elapsed, 2),
+                "p50_ms": round(_percentile(ordered, 50), 2),
+                "p95_ms": round(_percentile(ordered, 95), 2),
+                "p99_ms": round(_percentile(ordered, 99), 2),
+                "max_ms": round(ordered[-1], 2),
+                "statuses": dict(self.statuses[name]),
+            }
+        total = sum(len(v) for v in self.latencies.values())
+        everything = sorted(x for v in self.latencies.values() for x in v)
+        overall = {
+            "requests": total,
+            "errors": sum(self.errors.values()),
+            "rps": round(total / elapsed, 2) if elapsed else 0,
+            "p50_ms": round(_percentile(everything, 50), 2) if everything else None,
+            "p95_ms": round(_percentile(everything, 95), 2) if everything else None,
+            "p99_ms": round(_percentile(everything, 99), 2) if everything else None,
+        }
+        return overall, endpoints
+
+
+def _percentile(ordered, pct):
+    """最近秩法，输入需已排序"""
+    if not ordered:
+        return 0
+    rank = max(1, int(-(-pct * len(ordered) // 100)))
+    return ordered[rank - 1]
+
+
+class VirtualUser:
+    def __init__(self, client, recorder: Recorder, args, rng: random.Random, deadline: float):
+        self.client = client
+        self.recorder = recorder
+        self.args = args
+        self.rng = rng
+        self.deadline = deadline
+        self.headers = None
+
+    async def call(self, method: str, path: str, **kwargs):
+        name = f"{method} {_ID_RE.sub('/{id}', path)}"
+        start = time.perf_counter()
+        try:
+            r = await self.client.request(method, path, headers=self.headers, **kwargs)
+            status = r.status_code
+        except Exception:
+            r, status = None, 0
+        self.recorder.add(name, time.perf_counter() - start, status)
+        return r if r is not None and status < 400 else None
+
+    async def think(self, mean: float = None):
+        mean = self.args.think if mean is None else mean
+        await asyncio.sleep(min(self.rng.uniform(0.5, 1.5) * mean, max(0.0, self.deadline - time.monotonic())))
+
+    def alive(self):
+        return time.monotonic() < self.deadline
+
+    async def login(self):
+        if self.args.reuse_session and self.headers:
+            return True
+        self.headers = None
+        username = f"user{self.rng.randrange(self.args.accounts):05d}"
+        r = await self.call("POST", "/api/auth/login", data={"username": username, "password": self.args.password})
+        if r is None:
+            return False
+        self.headers = {"Authorization": "Bearer " + r.json()["access_token"]}
+        return True
+
+    async def approve(self):
+        if not await self.login():
+            return
+        await self.think()
+        r = await self.call("GET", "/api/tasks/todo")
+        tasks = r.json() if r is not None else []
+        if not tasks or not self.alive():
+            return
+        task = self.rng.choice(tasks)
+        await self.think()
+        await self.call("GET", f"/api/instances/{task['instance_id']}")
+        await self.think()
+        await self.call("POST", f"/api/tasks/{task['id']}/complete", json={"decision": "approve", "opinion": "同意"})
+
+    async def launch(self):
+        if not await self.login():
+            return
+        await self.think()
+        r = await self.call("GET", "/api/templates")
+        templates = r.json() if r is not None else []
+        if not templates or not self.alive():
+            return
+        await self.think()
+        content = os.urandom(self.rng.randint(1, 64) * 1024)
+        r = await self.call("POST", "/api/docs/upload", data={"title": "附件.bin"},
+                            files={"file": ("附件.bin", content, "application/octet-stream")})
+        attachments = [{"id": r.json()["id"], "title": "附件.bin"}] if r is not None else []
+        await self.think()
+        await self.call("POST", "/api/instances/start", json={
+            "template_id": self.rng.choice(templates)["id"],
+            "data": {"title": f"压测-{self.rng.randrange(10 ** 6)}", "priority": "中", "attachments": attachments},
+        })
+
+    async def dashboard(self):
+        if not await self.login():
+            return
+        # 仪表盘页面常驻，按固定间隔轮询；一轮会话轮询 3~6 次
+        for _ in range(self.rng.randint(3, 6)):
+            if not self.alive():
+                return
+            await self.call("GET", "/api/dashboard/stats")
+            await self.think(self.args.poll_interval)
+
+    async def browse(self):
+        if not await self.login():
+            return
+        r = await self.call("GET", "/api/tasks/todo")
+        tasks = r.json() if r is not None else []
+        await self.think()
+        r = await self.call("GET", "/api/instances/mine")
+        mine = r.json() if r is not None else []
+        ids = [t["instance_id"] for t in tasks] + [i["id"] for i in mine]
+        if ids and self.alive():
+            await self.think()
+            await self.call("GET", f"/api/instances/{self.rng.choice(ids)}")
+        await self.think()
+        await self.call("GET", "/api/dashboard/stats")
+
+    async def run(self, scenarios):
+        names = [name for name, _ in scenarios]
+        weights = [weight for _, weight in scenarios]
+        while self.alive():
+            await getattr(self, self.rng.choices(names, weights)[0])()
+            await self.think()
+
+
+def parse_scenarios(value: str):
+    scenarios = []
+    for part in value.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name not in ("approve", "launch", "dashboard", "browse"):
+            raise SystemExit(f"unknown scenario: {name}")
+        scenarios.append((name, float(weight or 1)))
+    return scenarios
+
+
+async def drive(args, base_url: str):
+    try:
+        import httpx
+    except ImportError:
+        raise SystemExit("loadtest needs httpx: pip install httpx")
+    recorder = Recorder()
+    scenarios = parse_scenarios(args.scenarios)
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        start = time.monotonic()
+        deadline = start + args.duration
+        tasks = []
+        for i in range(args.users):
+            vu = VirtualUser(client, recorder, args, random.Random(args.seed * 100003 + i), deadline)
+            tasks.append(asyncio.create_task(vu.run(scenarios)))
+            if args.ramp and args.users > 1:
+                await asyncio.sleep(args.ramp / args.users)
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - start
+    return recorder.report(elapsed), elapsed
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args):
+    """用生产模式（python run.py prod）启动服务，等到 /readyz 返回 200"""
+    port = _free_port()
+    env = dict(os.environ, WF_JOBS="0")
+    if args.database_url:
+        env["DATABASE_URL"] = args.database_url
+    elif args.db:
+        env["WF_DB"] = os.path.abspath(args.db)
+    proc = subprocess.Popen(
+        [sys.executable, "run.py", "prod", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"server exited with code {proc.returncode}")
+        try:
+            with urllib.request.urlopen(base_url + "/readyz", timeout=2) as r:
+                if r.status == 200:
+                    return proc, base_url
+        except OSError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit(f"server did not start within {args.startup_timeout:.0f}s")
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def print_report(overall, endpoints):
+    print(f"\n{'endpoint':45} {'count':>7} {'err':>5} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, r in endpoints.items():
+        print(f"{name:45} {r['count']:7} {r['errors']:5} {r['rps']:8.2f} "
+              f"{r['p50_ms']:9.1f} {r['p95_ms']:9.1f} {r['p99_ms']:9.1f}")
+    print(f"\ntotal {overall['requests']} requests, {overall['errors']} errors, {overall['rps']} req/s, "
+          f"p50 {overall['p50_ms']}ms p95 {overall['p95_ms']}ms p99 {overall['p99_ms']}ms")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.base_url and not args.start:
+        raise SystemExit("pass --base-url or --start")
+    proc = None
+    base_url = args.base_url
+    if args.start:
+        proc, base_url = start_server(args)
+    try:
+        (overall, endpoints), elapsed = asyncio.run(drive(args, base_url))
+    finally:
+        if proc is not None:
+            stop_server(proc)
+    print_report(overall, endpoints)
+    if args.out:
+        report = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "base_url": base_url,
+            "workers": args.workers if args.start else None,
+            "users": args.users,
+            "duration_s": round(elapsed, 1),
+            "think_s": args.think,
+            "scenarios": args.scenarios,
+            "overall": overall,
+            "endpoints": endpoints,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
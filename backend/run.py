@@ -1,4 +1,82 @@
 # run.py
-import uvicorn
+# python run.py            启动开发服务器（自动重载）
+# python run.py migrate    建表、执行迁移并创建默认管理员，部署时在启动 worker 之前执行一次
+# python run.py prod [--host 0.0.0.0] [--port 8000] [--workers N]
+#                          生产模式：预加载应用后 fork 多个 worker 共享端口，SIGTERM 时优雅停止
+# python run.py replica-sync [--interval 2]
+#                          本地测试只读副本：定时把 SQLite 主库（WF_DB）复制到 WF_REPLICA_DB
+# python run.py archive [--days 180] [--batch 200] [--max-batches 0]
+#                          把已结束超过 N 天的流程及其任务移入归档表（首次启用时清理存量，之后由定时任务执行）
+import argparse
+import sys
+
+
+def migrate():
+    from app import config, crud
+    config.ensure_directories()
+    config.log_summary()
+    crud.init_db()
+    print("Database is up to date")
+
+
+def serve():
+    import uvicorn
+    uvicorn.run("app.main:app", host="127.0.0.1", port=8000, reload=True)
+
+
+def prod(argv):
+    from app import server
+    p = argparse.ArgumentParser(prog="run.py prod", description="Serve with multiple worker processes")
+    p.add_argument("--host", help="bind address (default WF_HOST or 0.0.0.0)")
+    p.add_argument("--port", type=int, help="bind port (default PORT / WF_PORT or 8000)")
+    p.add_argument("--workers", type=int,
+                   help=f"worker processes (default WF_WORKERS or {server.default_workers()} on this machine)")
+    p.add_argument("--log-level", default="info")
+    p.add_argument("--no-access-log", action="store_true")
+    args = p.parse_args(argv)
+    sys.exit(server.serve(args.host, args.port, args.workers, args.log_level, not args.no_access_log))
+
+
+def replica_sync(argv):
+    import time
+    from app import config, replica
+    p = argparse.ArgumentParser(prog="run.py replica-sync", description="Copy the SQLite primary to WF_REPLICA_DB")
+    p.add_argument("--interval", type=float, default=2, help="seconds between copies (simulated replication lag)")
+    p.add_argument("--once", action="store_true")
+    args = p.parse_args(argv)
+    if config.DATABASE_URL or not config.REPLICA_DB:
+        sys.exit("replica-sync only works with SQLite: set WF_REPLICA_DB and leave DATABASE_URL unset")
+    while True:
+        replica.sync_sqlite(config.DB_FILE, config.REPLICA_DB)
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+def archive(argv):
+    from app import config, crud
+    p = argparse.ArgumentParser(prog="run.py archive", description="Move finished instances to archive tables")
+    p.add_argument("--days", type=int, default=config.ARCHIVE_AFTER_DAYS or None, required=not config.ARCHIVE_AFTER_DAYS,
+                   help="archive instances finished more than N days ago (default WF_ARCHIVE_AFTER_DAYS)")
+    p.add_argument("--batch", type=int, default=config.ARCHIVE_BATCH, help="instances per transaction")
+    p.add_argument("--max-batches", type=int, default=0, help="stop after N batches (0: until done)")
+    p.add_argument("--pause-ms", type=int, default=config.ARCHIVE_PAUSE_MS, help="pause between batches")
+    args = p.parse_args(argv)
+    instances, tasks = crud.archive_finished_instances(args.days, args.batch, args.max_batches, args.pause_ms)
+    print(f"Archived {instances} instances and {tasks} tasks")
+
+
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
+    command = sys.argv[1] if len(sys.argv) > 1 else "serve"
+    if command == "migrate":
+        migrate()
+    elif command == "serve":
+        serve()
+    elif command == "prod":
+        prod(sys.argv[2:])
+    elif command == "replica-sync":
+        replica_sync(sys.argv[2:])
+    elif command == "archive":
+        archive(sys.argv[2:])
+    else:
+        sys.exit(f"unknown command: {command} (expected serve, migrate, prod, replica-sync or archive)")
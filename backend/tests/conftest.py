@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.config 在导入时读取环境变量，必须在导入 app 之前指定测试用的数据库；
+# 测试中开启 WF_SQL_STRICT，任何接口出现 N+1 都会直接抛出 NPlusOneError
+os.environ.setdefault("WF_DB", os.path.join(tempfile.mkdtemp(prefix="wf-test-"), "test.sqlite"))
+os.environ.setdefault("WF_SQL_STRICT", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from app import main
+
+    with TestClient(main.app) as c:
+        yield c
+
+
+def login(client, username, password):
+    r = client.post("/api/auth/login", data={"username": username, "password": password})
+    assert r.status_code == 200, r.text
+    return {"Authorization": "Bearer " + r.json()["access_token"]}
+
+
+@pytest.fixture(scope="session")
+def admin(client):
+    return login(client, "admin", "admin123")
+
+
+@pytest.fixture(scope="session")
+def make_user(client):
+    def make(username, password="secret1"):
+        client.post("/api/auth/register", json={"username": username, "password": password})
+        return login(client, username, password)
+    return make
@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+from app import cache
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="需要 fork")
+def test_generation_shared_with_forked_workers():
+    """server.py 的 worker 由 fork 产生：子进程中的 bump 使父进程的缓存同样失效"""
+    c = cache.LocalCache(namespace="test-shared")
+    c.set("key", "value")
+    assert c.get("key") == "value"
+    pid = os.fork()
+    if pid == 0:
+        cache.bump("test-shared")
+        os._exit(0)
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    assert c.get("key") is None
+
+
+def test_set_with_stale_generation_is_not_served():
+    c = cache.LocalCache(namespace="test-stale")
+    gen = cache.generation("test-stale")
+    cache.bump("test-stale")
+    c.set("key", "value", gen)
+    assert c.get("key") is None
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def tracing(client, admin):
+    r = client.post("/api/admin/diagnostics/tracemalloc/start", headers=admin)
+    assert r.status_code == 200, r.text
+    yield
+    client.post("/api/admin/diagnostics/tracemalloc/stop", headers=admin)
+
+
+def test_snapshot_ids_carry_the_worker_pid(client, admin, tracing):
+    snap = client.post("/api/admin/diagnostics/snapshots", headers=admin).json()
+    assert snap["pid"] == os.getpid()
+    assert snap["id"].startswith(f"{os.getpid()}-")
+    r = client.get(f"/api/admin/diagnostics/snapshots/{snap['id']}", headers=admin)
+    assert r.status_code == 200 and r.json()["pid"] == os.getpid()
+    status = client.get("/api/admin/diagnostics/memory", headers=admin).json()
+    assert status["pid"] == os.getpid() and [s["id"] for s in status["snapshots"]] == [snap["id"]]
+
+
+def test_snapshot_from_another_worker_is_a_conflict(client, admin, tracing):
+    snap = client.post("/api/admin/diagnostics/snapshots", headers=admin).json()
+    other = f"{os.getpid() + 1}-{snap['id'].split('-')[1]}"
+    assert client.get(f"/api/admin/diagnostics/snapshots/{other}", headers=admin).status_code == 409
+    assert client.get(f"/api/admin/diagnostics/snapshots/{snap['id']}?base={other}", headers=admin).status_code == 409
+    assert client.delete(f"/api/admin/diagnostics/snapshots/{other}", headers=admin).status_code == 409
+    assert client.get("/api/admin/diagnostics/snapshots/abc", headers=admin).status_code == 400
+    assert client.delete(f"/api/admin/diagnostics/snapshots/{os.getpid()}-999999", headers=admin).status_code == 404
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app import metrics
+
+pytest.importorskip("aiosqlite")
+
+HOLD_SECONDS = 0.05
+
+
+def _wait_totals():
+    """(次数, 总秒数)；直方图状态为 [各桶计数..., sum, count]"""
+    state = metrics.DB_POOL_WAIT._values.get((), [0.0, 0])
+    return state[-1], state[-2]
+
+
+def test_pool_wait_concurrent_async_checkouts(tmp_path):
+    """池大小为 1 时并发取连接：每个协程的等待时间各自记录，不会被同一线程上的其它协程覆盖"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'pool.sqlite'}",
+                                 poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0, pool_timeout=30)
+    metrics.instrument_engine(engine.sync_engine, "test-async")
+    workers = 5
+
+    async def hold():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            await asyncio.sleep(HOLD_SECONDS)
+
+    async def run():
+        # 先建好唯一的连接，之后的等待只来自排队
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        count_before, total_before = _wait_totals()
+        await asyncio.gather(*(hold() for _ in range(workers)))
+        count_after, total_after = _wait_totals()
+        await engine.dispose()
+        return count_after - count_before, total_after - total_before
+
+    try:
+        count, total = asyncio.run(run())
+    finally:
+        metrics._engines[:] = [(n, e) for n, e in metrics._engines if e is not engine.sync_engine]
+
+    assert count == workers
+    # 依次排队：第 i 个协程约等待 i * HOLD_SECONDS
+    expected = HOLD_SECONDS * sum(range(workers))
+    assert expected * 0.8 <= total <= expected * 3
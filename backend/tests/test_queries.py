@@ -0,0 +1,113 @@
+"""列表与详情接口的语句数不随数据量增长（N+1 回归测试）
+
+conftest 开启了 WF_SQL_STRICT=1：同一语句在一个请求内重复执行达到阈值时请求直接失败；
+assert_constant_queries 再比较数据增长前后的语句总数。
+"""
+import uuid
+
+import pytest
+
+from app import config, querylog
+
+
+def _steps(n, assignee):
+    nodes = [{"id": "s", "type": "start"}]
+    nodes += [{"id": f"n{i}", "type": "task", "meta": {"name": f"第{i}步", "assignee": assignee}} for i in range(n)]
+    nodes.append({"id": "e", "type": "end"})
+    ids = [node["id"] for node in nodes]
+    return {"nodes": nodes, "edges": [{"from": a, "to": b} for a, b in zip(ids, ids[1:])]}
+
+
+@pytest.fixture(scope="module")
+def world(client, admin, make_user):
+    """独立的发起人与审批人，避免与其它测试的数据互相影响"""
+    suffix = uuid.uuid4().hex[:8]
+    starter, approver = f"starter_{suffix}", f"approver_{suffix}"
+    starter_headers = make_user(starter)
+    approver_headers = make_user(approver)
+    r = client.post("/api/templates", json={"name": f"审批_{suffix}", "definition": _steps(2, approver)}, headers=admin)
+    assert r.status_code == 200, r.text
+    return {
+        "client": client,
+        "admin": admin,
+        "starter": starter_headers,
+        "approver": approver_headers,
+        "approver_name": approver,
+        "template_id": r.json()["id"],
+    }
+
+
+def _start(world, count):
+    client = world["client"]
+    for i in range(count):
+        r = client.post("/api/instances/start", json={"template_id": world["template_id"], "data": {"title": f"申请{i}"}},
+                        headers=world["starter"])
+        assert r.status_code == 200, r.text
+
+
+def _get(world, path, headers):
+    def call():
+        r = world["client"].get(path, headers=headers)
+        assert r.status_code == 200, r.text
+        return r.json()
+    return call
+
+
+def _assert_constant(call, grow):
+    before, after = querylog.assert_constant_queries(call, grow)
+    assert before > 0, "capture() did not see the request's statements"
+    return before, after
+
+
+def test_strict_mode_enabled():
+    assert config.SQL_STRICT
+
+
+def test_todo_list(world):
+    _start(world, 2)
+    call = _get(world, "/api/tasks/todo", world["approver"])
+    _assert_constant(call, lambda: _start(world, config.N_PLUS_ONE_THRESHOLD + 5))
+    assert len(call()) >= config.N_PLUS_ONE_THRESHOLD + 5
+
+
+def test_my_instances(world):
+    _start(world, 2)
+    call = _get(world, "/api/instances/mine", world["starter"])
+    _assert_constant(call, lambda: _start(world, config.N_PLUS_ONE_THRESHOLD + 5))
+
+
+def test_monitor(world):
+    _start(world, 2)
+    call = _get(world, "/api/instances/monitor", world["admin"])
+    _assert_constant(call, lambda: _start(world, config.N_PLUS_ONE_THRESHOLD + 5))
+
+
+def test_admin_task_list(world):
+    _start(world, 2)
+    call = _get(world, "/api/tasks", world["admin"])
+    _assert_constant(call, lambda: _start(world, config.N_PLUS_ONE_THRESHOLD + 5))
+
+
+def test_instance_detail(world, client, admin, make_user):
+    """详情的任务历史随审批推进变长，语句数不变"""
+    steps = config.N_PLUS_ONE_THRESHOLD + 5
+    suffix = uuid.uuid4().hex[:8]
+    approver = f"long_{suffix}"
+    approver_headers = make_user(approver)
+    r = client.post("/api/templates", json={"name": f"长流程_{suffix}", "definition": _steps(steps, approver)}, headers=admin)
+    assert r.status_code == 200, r.text
+    r = client.post("/api/instances/start", json={"template_id": r.json()["id"], "data": {"title": "长流程"}}, headers=admin)
+    assert r.status_code == 200, r.text
+    instance_id = r.json()["instance"]["id"]
+
+    def approve_all_but_last():
+        for _ in range(steps - 1):
+            todo = [t for t in client.get("/api/tasks/todo", headers=approver_headers).json()
+                    if t["instance_id"] == instance_id]
+            r = client.post(f"/api/tasks/{todo[0]['id']}/complete", json={"decision": "approve", "opinion": "同意"},
+                            headers=approver_headers)
+            assert r.status_code == 200, r.text
+
+    call = _get(world, f"/api/instances/{instance_id}", admin)
+    _assert_constant(call, approve_all_but_last)
+    assert len(call()["history"]) == steps
@@ -62,12 +62,16 @@ export default function Cycles() {
     }
   }
 
-  async function loadDetail(id) {
+  // 迭代详情的任务列表按页返回（默认每页 100 条），total 为迭代内全部任务数
+  async function loadDetail(id, page = 1) {
+    if (id !== selected) setDetail(null);
     setSelected(id);
-    setDetail(null);
     setError('');
     try {
-      const r = await api.get(`/cycles/${id}`);
+      const r = await api.get(`/cycles/${id}`, { params: { page } });
+      const pages = Math.max(1, Math.ceil((r.data.total || 0) / (r.data.page_size || 1)));
+      // 移出任务后当前页可能已经超出范围，回到最后一页
+      if (page > pages) return loadDetail(id, pages);
       setDetail(r.data);
     } catch (e) {
       setError('加载迭代详情失败：' + (e?.response?.data?.detail || e.message));
@@ -80,7 +84,7 @@ export default function Cycles() {
     setError('');
     try {
       await api.post(`/cycles/${selected}/tasks`, { task_id: assignTaskId.trim() });
-      await loadDetail(selected);
+      await loadDetail(selected, detail?.page || 1);
       setAssignTaskId('');
     } catch (e) {
       setError('分配任务失败：' + (e?.response?.data?.detail || e.message));
@@ -93,7 +97,7 @@ export default function Cycles() {
     if (!selected) return;
     try {
       await api.delete(`/cycles/${selected}/tasks/${taskId}`);
-      await loadDetail(selected);
+      await loadDetail(selected, detail?.page || 1);
     } catch (e) {
       setError('移除任务失败：' + (e?.response?.data?.detail || e.message));
     }
@@ -166,7 +170,7 @@ export default function Cycles() {
               <div className="hint" style={{ marginBottom:8 }}>
                 {detail.start_date} ~ {detail.end_date}，目标：{detail.goal || '—'}
               </div>
-              <Burndown tasks={detail.tasks || []} start={detail.start_date} end={detail.end_date} />
+              <Burndown total={detail.total || 0} pending={detail.status_counts?.pending || 0} start={detail.start_date} end={detail.end_date} />
               <div style={{ display:'flex', gap:8, alignItems:'center', marginBottom:12 }}>
                 <select
                   className="input"
@@ -204,6 +208,15 @@ export default function Cycles() {
                   ))}
                 </div>
               )}
+              {detail.total > 0 && (
+                <Pager
+                  page={detail.page || 1}
+                  pageSize={detail.page_size || detail.total}
+                  total={detail.total}
+                  shown={detail.tasks?.length || 0}
+                  onChange={p=>loadDetail(selected, p)}
+                />
+              )}
             </>
           )}
         </div>
@@ -212,13 +225,30 @@ export default function Cycles() {
   );
 }
 
-function Burndown({ tasks, start, end }) {
+function Pager({ page, pageSize, total, shown, onChange }) {
+  const pages = Math.max(1, Math.ceil(total / pageSize));
+  const from = shown ? (page - 1) * pageSize + 1 : 0;
+  const to = shown ? from + shown - 1 : 0;
+  return (
+    <div style={{ display:'flex', gap:8, alignItems:'center', justifyContent:'flex-end', marginTop:12 }}>
+      <span className="hint">第 {from}–{to} 条，共 {total} 个任务</span>
+      {pages > 1 && (
+        <>
+          <button className="btn small secondary" disabled={page <= 1} onClick={()=>onChange(page - 1)}>上一页</button>
+          <span className="hint">{page} / {pages}</span>
+          <button className="btn small secondary" disabled={page >= pages} onClick={()=>onChange(page + 1)}>下一页</button>
+        </>
+      )}
+    </div>
+  );
+}
+
+function Burndown({ total, pending, start, end }) {
   if (!start || !end) return null;
   const startDate = new Date(start);
   const endDate = new Date(end);
   const days = Math.max(1, Math.round((endDate - startDate) / (1000*60*60*24)) + 1);
-  const total = tasks.length || 0;
-  if (total === 0) return null;
+  if (!total) return null;
 
   // 计算每日剩余（简单用完成状态统计：status === 'pending' 算未完成）
   const remainingByDay = [];
@@ -226,7 +256,7 @@ function Burndown({ tasks, start, end }) {
     const day = new Date(startDate);
     day.setDate(day.getDate() + i);
     // 这里简化：如果任务 finished_at 存在且该日之后则计为完成
-    const remain = tasks.filter(t => t.status === 'pending').length; // 无完成时间字段，使用状态
+    const remain = pending; // 无完成时间字段，使用状态（总数与各状态计数由后端汇总）
     remainingByDay.push({ day, remain });
   }
   const ideal = [];
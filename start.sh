@@ -14,7 +14,7 @@ echo "Installing dependencies..."
 pip install -r requirements.txt
 
 echo "Starting FastAPI server..."
-# 阻塞运行，打印所有日志
-exec uvicorn main:app --host 0.0.0.0 --port ${PORT:-8000} --log-level debug
+# 生产模式：主进程迁移后按 CPU 数 fork worker（WF_WORKERS 可覆盖）；exec 使平台的 SIGTERM 直接送达主进程以优雅停止
+exec python run.py prod --host 0.0.0.0 --port ${PORT:-8000}
 
 echo "========== END DEPLOY =========="